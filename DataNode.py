@@ -1,19 +1,233 @@
+import argparse
+import json
+import logging
 import socket
 import threading
-import json
 import os
+import queue
 import time
+import metrics
+from chunkcache import ChunkCache
+from checksum import (ALGORITHMS, META_SUFFIX, ChecksumError, StreamingChecksum, StreamingVerifier, read_sidecar,
+                      sidecar_path, write_sidecar)
+from metrics import Counter, Gauge, Histogram, TimedLock
+from protocol import default_pool, hello_response, recv_message, send_fds_message, send_message
+from throttle import MAX_STREAMS, THROTTLE_STEP, Busy, TokenBucket, TransferScheduler, priority_of
+from tracing import Tracer
+from volumes import VOLUME_POLICIES, ChunkWriter, VolumeError, VolumeSet, parse_volumes
 
 # Configuration
 NAMENODE_HOST = '192.168.164.58'  # Replace with the NameNode's IP
 NAMENODE_PORT = 5000
 DATANODE_HOST = '0.0.0.0'  # Listen on all interfaces
 DATANODE_PORT = 5001  # Port for this DataNode
-STORAGE_DIR = "datanode_storage"  # Directory to store file blocks
+STORAGE_DIR = "datanode_storage"  # Directories to store file blocks: "[TIER]path,..." (see volumes.py)
+VOLUME_POLICY = "round-robin"  # How new chunks are spread over the volumes of a tier
+SYNC_WRITES = False  # fsync each chunk (in per-volume batches) before acknowledging it
 HEARTBEAT_INTERVAL = 10  # Send heartbeat every 10 seconds
+RECV_BUFFER_SIZE = 1024 * 1024  # Bytes received (and forwarded) per step
+PIPELINE_TIMEOUT = 20  # Seconds to wait on the next DataNode in a pipeline
+ADVERTISE_HOST = None  # Address reported to the NameNode (None = detect)
+RACK = "/default-rack"  # Rack/zone label used for replica placement
+SCRUB_RATE = 1024 * 1024  # Bytes/s the scrubber may read (0 disables it)
+SCRUB_PERIOD = 21 * 24 * 3600  # Re-verify each chunk at least this often
+SCRUB_STATE = "scrubber.json"  # Progress of the scrubber's current pass, kept in the first volume
+CACHE_BYTES = 0  # Memory for hot chunks held in the read cache (0 disables it)
+DOMAIN_SOCKET = None  # Unix socket path for short-circuit reads by clients on this host (None disables them)
+BANDWIDTH = 0  # Chunk bytes/s sent, and received, at most (0 = no limit)
+METRICS_HOST = '127.0.0.1'  # Where /metrics and /traces are served...
+METRICS_PORT = 0  # ...if this is set
+
+log = logging.getLogger("datanode")
+tracer = Tracer("datanode")  # Records spans of requests that carry a trace context
+
+REQUEST_SECONDS = Histogram("dfs_datanode_request_seconds", "Time to handle a request, by message type", ["type"])
+RECEIVED_BYTES = Counter("dfs_datanode_received_bytes_total", "Chunk bytes received from clients and pipelines")
+SENT_BYTES = Counter("dfs_datanode_sent_bytes_total", "Chunk bytes sent to readers, by where they came from",
+                     ["source"])
+REPLICATED_BYTES = Counter("dfs_datanode_replicated_bytes_total", "Chunk bytes copied to other DataNodes")
+PIPELINE_FAILURES = Counter("dfs_datanode_pipeline_failures_total", "Chunks the next DataNode of a pipeline "
+                            "did not store")
+SHORT_CIRCUIT_READS = Counter("dfs_datanode_short_circuit_reads_total", "Chunks handed to local clients as "
+                              "file descriptors, by where they came from", ["source"])
+CONNECTIONS = Gauge("dfs_datanode_connections", "Open connections")
+LOCK_WAIT = Histogram("dfs_datanode_replace_lock_wait_seconds", "Time spent waiting for replace_lock")
+ADMISSION_WAIT = Histogram("dfs_datanode_admission_wait_seconds", "Time chunk transfers waited for a stream, "
+                           "by priority", ["priority"])
+REFUSED = Counter("dfs_datanode_transfers_refused_total", "Chunk transfers refused for lack of a free stream, "
+                  "by priority", ["priority"])
+
+class TransferStats:
+    """In-flight transfer count and bytes moved, reported with each heartbeat."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.bytes = 0
+        self.since = time.monotonic()
+
+    def begin(self):
+        with self.lock:
+            self.inflight += 1
+
+    def end(self, nbytes):
+        with self.lock:
+            self.inflight -= 1
+            self.bytes += nbytes
+
+    def snapshot(self):
+        """Return (inflight, bytes/s since the previous snapshot)."""
+        with self.lock:
+            now = time.monotonic()
+            throughput = self.bytes / max(now - self.since, 1e-6)
+            self.bytes = 0
+            self.since = now
+            return self.inflight, throughput
+
+transfer_stats = TransferStats()
+Gauge("dfs_datanode_inflight_transfers", "Chunk transfers in progress", function=lambda: transfer_stats.inflight)
+
+# Held while a chunk and its sidecar are swapped in, and while one is opened
+# with its sidecar, so the data and checksums a reader sees always match
+replace_lock = TimedLock(LOCK_WAIT)
+
+class ChunkLoader(threading.Thread):
+    """Reads chunks that became hot into the read cache, off the request path.
+
+    A chunk is verified against its sidecar as it is read, so the cache only
+    ever serves good data, and is admitted only if it was not deleted or
+    replaced meanwhile (its inode is unchanged). Cached data lives in a
+    memfd where the platform has one: anonymous memory the page cache
+    cannot evict, which is still served with zero-copy sendfile. The memfd
+    is sealed once filled, as short-circuit reads hand it to clients.
+    """
+
+    def __init__(self, cache):
+        super().__init__(daemon=True)
+        self.cache = cache
+        self.pending = set()
+        self.queue = queue.Queue(maxsize=64)
+
+    def request(self, chunk_id):
+        if chunk_id in self.pending:
+            return
+        try:
+            self.queue.put_nowait(chunk_id)
+            self.pending.add(chunk_id)
+        except queue.Full:
+            pass  # Still hot next time if it matters
+
+    def run(self):
+        while True:
+            chunk_id = self.queue.get()
+            try:
+                self.load(chunk_id)
+            except FileNotFoundError:
+                pass  # Deleted meanwhile
+            except Exception as e:
+                print(f"[ERROR] Could not cache chunk {chunk_id}: {e}")
+            finally:
+                self.pending.discard(chunk_id)
+
+    def load(self, chunk_id):
+        filename = chunk_path(chunk_id)
+        with replace_lock:
+            f = open(filename, 'rb')
+            sidecar = read_sidecar(filename)
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            data = f.read()
+        if sidecar is not None:
+            verifier = StreamingVerifier(sidecar["checksums"], sidecar["algorithm"], sidecar["bytes_per_checksum"])
+            verifier.update(data)
+            verifier.finish()
+        pinned = data
+        if hasattr(os, "memfd_create"):
+            import fcntl
+            fd = os.memfd_create(f"chunk-{chunk_id}", os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+            pinned = os.fdopen(fd, "w+b", buffering=0)
+            pinned.write(data)
+            # Sealed, so local clients handed the memfd cannot change what every reader is served
+            fcntl.fcntl(fd, fcntl.F_ADD_SEALS,
+                        fcntl.F_SEAL_WRITE | fcntl.F_SEAL_GROW | fcntl.F_SEAL_SHRINK | fcntl.F_SEAL_SEAL)
+        with replace_lock:
+            if os.stat(filename).st_ino == inode and self.cache.put(chunk_id, (pinned, sidecar), len(data)):
+                print(f"[CACHE] Chunk {chunk_id} cached ({len(data)} bytes)")
+
+chunk_cache = None  # ChunkCache of hot chunks, created by start_server() when CACHE_BYTES > 0
+chunk_loader = None
+volumes = None  # VolumeSet of the STORAGE_DIR directories, created by start_server()
+scheduler = None  # TransferScheduler of MAX_STREAMS streams, created by start_server()
+send_throttle = None  # TokenBuckets pacing chunk data to BANDWIDTH, created by start_server() when it is set
+receive_throttle = None
+Gauge("dfs_datanode_queued_transfers", "Chunk transfers waiting for a stream",
+      function=lambda: scheduler.queued if scheduler else 0)
+
+def is_chunk(name):
+    return not name.endswith((META_SUFFIX, ".tmp")) and name != SCRUB_STATE
+
+def list_chunks():
+    """Return {chunk_id: size} for every chunk in the storage volumes."""
+    return {chunk_id: size for chunk_id, (_, size) in volumes.list(is_chunk).items()}
+
+class BlockReport:
+    """Chunks added and removed since the last block report the NameNode accepted.
+
+    The first report after startup (or whenever the NameNode asks for one)
+    is a full listing of the storage volumes; later reports are incremental. Deltas
+    are only dropped once a heartbeat carrying them has been acknowledged.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.added = set()
+        self.removed = set()
+        self.full_needed = True
+        self.used_bytes = 0
+
+    def chunk_added(self, chunk_id, size, old_size=0):
+        with self.lock:
+            self.added.add(chunk_id)
+            self.removed.discard(chunk_id)
+            self.used_bytes += size - old_size
+
+    def chunk_removed(self, chunk_id, size):
+        with self.lock:
+            self.removed.add(chunk_id)
+            self.added.discard(chunk_id)
+            self.used_bytes -= size
 
-# Ensure storage directory exists
-os.makedirs(STORAGE_DIR, exist_ok=True)
+    def request_full(self):
+        with self.lock:
+            self.full_needed = True
+
+    def build(self):
+        """Return (report, token); pass the token to acknowledge() once the NameNode accepted it."""
+        with self.lock:
+            token = (set(self.added), set(self.removed))
+            full = self.full_needed
+        if full:
+            chunks = list_chunks()
+            with self.lock:
+                self.used_bytes = sum(chunks.values())
+            return {"full": True, "chunks": list(chunks)}, token
+        return {"added": list(token[0]), "removed": list(token[1])}, token
+
+    def acknowledge(self, report, token):
+        with self.lock:
+            if report.get("full"):
+                self.full_needed = False
+            self.added -= token[0]
+            self.removed -= token[1]
+
+block_report = BlockReport()
+Gauge("dfs_datanode_stored_bytes", "Bytes of chunks stored", function=lambda: block_report.used_bytes)
+Gauge("dfs_datanode_cache_bytes", "Bytes of chunks in the read cache",
+      function=lambda: chunk_cache.stats()["used_bytes"] if chunk_cache is not None else 0)
+Counter("dfs_datanode_cache_hits_total", "Reads served from the read cache",
+        function=lambda: chunk_cache.stats()["hits"] if chunk_cache is not None else 0)
+Counter("dfs_datanode_cache_misses_total", "Reads of chunks not in the read cache",
+        function=lambda: chunk_cache.stats()["misses"] if chunk_cache is not None else 0)
 
 def get_local_ip():
     """Get the local IP address of the DataNode."""
@@ -22,90 +236,728 @@ def get_local_ip():
         return s.getsockname()[0]
 
 def send_heartbeat():
-    """Send periodic heartbeats to the NameNode."""
-    datanode_ip = get_local_ip()  # Get the actual IP address
+    """Send periodic heartbeats to the NameNode over a persistent connection."""
+    datanode_ip = ADVERTISE_HOST or get_local_ip()  # Get the actual IP address
     while True:
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((NAMENODE_HOST, NAMENODE_PORT))
+            # Loops a second time straight away if the NameNode asks for a full block report
+            while True:
+                inflight, throughput = transfer_stats.snapshot()
+                capacity, free, tiers = volumes.usage()
+                report, token = block_report.build()
                 heartbeat_message = {
                     "action": "heartbeat",
                     "datanode_host": datanode_ip,  # Use the actual IP address
-                    "datanode_port": DATANODE_PORT
+                    "datanode_port": DATANODE_PORT,
+                    "rack": RACK,
+                    "capacity_bytes": capacity,
+                    "used_bytes": block_report.used_bytes,
+                    "free_bytes": free,
+                    "storage": tiers,
+                    "inflight": inflight,
+                    "throughput": throughput,
+                    "block_report": report
                 }
-                data = json.dumps(heartbeat_message).encode()
-                s.sendall(len(data).to_bytes(4, byteorder='big'))
-                s.sendall(data)
+                if DOMAIN_SOCKET:
+                    heartbeat_message["domain_socket"] = DOMAIN_SOCKET
+                if chunk_cache is not None:
+                    heartbeat_message["cache"] = chunk_cache.stats()
+                    heartbeat_message["cached_chunks"] = chunk_cache.keys()
+                response = default_pool.call(NAMENODE_HOST, NAMENODE_PORT, heartbeat_message)
+                block_report.acknowledge(report, token)
+                for command in response.get("commands", []):
+                    run_command(command)
+                if not response.get("send_full_report"):
+                    break
+                block_report.request_full()
         except Exception as e:
             print(f"[ERROR] Failed to send heartbeat: {e}")
         time.sleep(HEARTBEAT_INTERVAL)
 
+def run_command(command):
+    """Carry out a command the NameNode sent in a heartbeat response."""
+    if command["command"] == "replicate":
+        threading.Thread(target=replicate_chunk, args=(command["chunk_id"], command["target"], command.get("tier")),
+                         daemon=True).start()
+    elif command["command"] == "delete":
+        # The chunk's file was deleted or overwritten
+        if delete_chunk(command["chunk_id"]):
+            print(f"[DELETE] Chunk {command['chunk_id']} deleted")
+    else:
+        log.warning("Unknown command: %s", command["command"])
+
+def delete_chunk(chunk_id, inode=None):
+    """Remove a stored chunk and its sidecar. Returns False if it was not there.
+
+    With `inode`, only that file is removed; a chunk replaced by a fresh
+    upload since is left alone.
+    """
+    filename = chunk_path(chunk_id)
+    with replace_lock:
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return False
+        if inode is not None and stat.st_ino != inode:
+            return False
+        os.remove(filename)
+        volumes.removed(chunk_id)
+        try:
+            os.remove(sidecar_path(filename))
+        except FileNotFoundError:
+            pass
+        if chunk_cache is not None:
+            chunk_cache.invalidate(chunk_id)
+    block_report.chunk_removed(chunk_id, stat.st_size)
+    return True
+
+def replicate_chunk(chunk_id, target, tier=None):
+    """Copy a stored chunk straight to another DataNode (re-replication), onto a volume of `tier` if given."""
+    transfer_stats.begin()
+    size = 0
+    try:
+        filename = chunk_path(chunk_id)
+        with replace_lock:
+            f = open(filename, 'rb')
+            sidecar = read_sidecar(filename)
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            with default_pool.connection(target["host"], target["port"], PIPELINE_TIMEOUT) as s:
+                message = {
+                    "message_type": "file_chunk",
+                    "chunk_id": chunk_id,
+                    "chunk_size": size,
+                    "pipeline": [],
+                    "priority": "replication",
+                    "admission": True
+                }
+                if tier is not None:
+                    message["tier"] = tier
+                send_message(s, message)
+                resp = recv_message(s)
+                if resp and resp.get("status") == "ok":
+                    send_range(s, f, 0, size, "replication")
+                    resp = recv_message(s)
+        if not resp or resp.get("status") != "success":
+            raise ConnectionError(f"target answered {resp}")
+        if sidecar and resp.get("checksums") not in (None, sidecar["checksums"]):
+            raise ChecksumError("target's checksums do not match ours")
+        REPLICATED_BYTES.inc(size)
+        print(f"[REPLICATE] Chunk {chunk_id} copied to {target['host']}:{target['port']}")
+    except Exception as e:
+        print(f"[ERROR] Failed to replicate {chunk_id} to {target['host']}:{target['port']}: {e}")
+    finally:
+        transfer_stats.end(size)
+
+def check_chunk_id(chunk_id):
+    """Reject chunk IDs with path components or the suffixes of other files."""
+    if (not chunk_id or os.path.basename(chunk_id) != chunk_id or chunk_id in (".", "..")
+            or not is_chunk(chunk_id)):
+        raise ValueError(f"Invalid chunk ID: {chunk_id!r}")
+
+def chunk_path(chunk_id):
+    """Map a chunk ID to its file in the volume holding it."""
+    check_chunk_id(chunk_id)
+    return volumes.path(chunk_id)
+
+def serve_chunk(message, conn, priority="interactive"):
+    """Stream a stored chunk (or a byte range of it), sent at the `priority` of send_throttle.
+
+    Replies with an 8-byte big-endian length followed by the raw bytes.
+    Chunks in the read cache are sent from memory; others go from the page
+    cache straight to the socket with sendfile, never through Python
+    buffers, so it is the client that verifies them: if the request asks
+    for "checksums", a message with the stored checksums of the sub-blocks
+    covering the range is sent first. A missing chunk raises, which drops
+    the connection so the client falls back to another replica. Returns
+    the bytes sent.
+    """
+    chunk_id = message["chunk_id"]
+    filename = chunk_path(chunk_id)
+    cached = chunk_cache.get(chunk_id) if chunk_cache is not None else None
+    if cached is not None:
+        data, sidecar = cached  # A memfd is closed once evicted and no longer being sent
+        size = len(data) if isinstance(data, bytes) else os.fstat(data.fileno()).st_size
+        offset, length = chunk_range(message, size)
+        if message.get("checksums"):
+            send_message(conn, range_checksums(sidecar, offset, length))
+        conn.sendall(length.to_bytes(8, byteorder='big'))
+        send_range(conn, data, offset, length, priority)
+        SENT_BYTES.labels("cache").inc(length)
+        log.debug("Chunk %s served from cache (%d bytes from offset %d)", chunk_id, length, offset)
+        return length
+    with replace_lock:
+        f = open(filename, 'rb')
+        sidecar = read_sidecar(filename) if message.get("checksums") else None
+    with f:
+        chunk_size = os.fstat(f.fileno()).st_size
+        offset, length = chunk_range(message, chunk_size)
+        if message.get("checksums"):
+            send_message(conn, range_checksums(sidecar, offset, length))
+        conn.sendall(length.to_bytes(8, byteorder='big'))
+        send_range(conn, f, offset, length, priority)
+    if chunk_cache is not None and chunk_cache.should_load(chunk_id, chunk_size):
+        chunk_loader.request(chunk_id)
+    SENT_BYTES.labels("disk").inc(length)
+    log.debug("Chunk %s served (%d bytes from offset %d)", chunk_id, length, offset)
+    return length
+
+def send_range(conn, source, offset, length, priority):
+    """Send `length` bytes of a file (with sendfile) or of bytes from `offset`, paced by send_throttle."""
+    step = THROTTLE_STEP if send_throttle is not None else length
+    for position in range(offset, offset + length, max(step, 1)):
+        n = min(step, offset + length - position)
+        if send_throttle is not None:
+            send_throttle.consume(n, priority)
+        if isinstance(source, bytes):
+            conn.sendall(memoryview(source)[position:position + n])
+        else:
+            conn.sendfile(source, position, n)
+
+def pass_chunk(message, conn):
+    """Hand a client on this host an open descriptor of a chunk to map, instead of streaming it.
+
+    The reply carries the chunk's size and all its stored checksums (as
+    range_checksums of the whole chunk) with the descriptor attached.
+    Chunks in the read cache are passed as their memfd. Returns the size.
+    """
+    chunk_id = message["chunk_id"]
+    filename = chunk_path(chunk_id)
+    cached = chunk_cache.get(chunk_id) if chunk_cache is not None else None
+    if cached is not None and not isinstance(cached[0], bytes):
+        data, sidecar = cached
+        size = os.fstat(data.fileno()).st_size
+        send_fds_message(conn, dict(range_checksums(sidecar, 0, size), status="ok", size=size), [data.fileno()])
+        SHORT_CIRCUIT_READS.labels("cache").inc()
+        return size
+    with replace_lock:
+        f = open(filename, 'rb')
+        sidecar = read_sidecar(filename)
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        send_fds_message(conn, dict(range_checksums(sidecar, 0, size), status="ok", size=size), [f.fileno()])
+    if chunk_cache is not None and chunk_cache.should_load(chunk_id, size):
+        chunk_loader.request(chunk_id)
+    SHORT_CIRCUIT_READS.labels("disk").inc()
+    log.debug("Chunk %s passed to a local client (%d bytes)", chunk_id, size)
+    return size
+
+def chunk_range(message, chunk_size):
+    """The (offset, length) a get_file request asks for, clamped to the chunk."""
+    offset = min(max(message.get("offset", 0), 0), chunk_size)
+    length = message.get("length")
+    if length is None or length < 0 or offset + length > chunk_size:
+        length = chunk_size - offset
+    return offset, length
+
+def range_checksums(sidecar, offset, length):
+    """The stored checksums of the sub-blocks overlapping [offset, offset + length)."""
+    if sidecar is None:
+        return {"checksums": None}  # Stored before checksums existed; the scrubber will add them
+    bytes_per_checksum = sidecar["bytes_per_checksum"]
+    first = offset // bytes_per_checksum
+    last = -(-(offset + length) // bytes_per_checksum)
+    return {
+        "algorithm": sidecar["algorithm"],
+        "bytes_per_checksum": bytes_per_checksum,
+        "checksums": sidecar["checksums"][first:last]
+    }
+
+def store_chunk(message, conn):
+    """Receive a chunk, forwarding it to the rest of the pipeline while writing it.
+
+    The chunk is checksummed as it arrives and the checksums are written to
+    a sidecar file. It goes to a volume of the "tier" the message asks for
+    if there is one, and is written by that volume's I/O threads in
+    WRITE_SIZE pieces while the next piece is received. With BANDWIDTH set,
+    receiving and forwarding are paced by the throttles. Returns (failed,
+    checksums): the pipeline targets that did not store the chunk intact,
+    so the client can push those replicas directly, and the checksums, so
+    the sender can check what arrived.
+    """
+    chunk_id = message["chunk_id"]
+    check_chunk_id(chunk_id)
+    filesize = message["chunk_size"]
+    pipeline = message.get("pipeline", [])
+    priority = priority_of(message, "bulk")
+    # The next DataNode takes the stream without asking: this pipeline holds one here already
+    forward = {key: value for key, value in message.items() if key != "admission"}
+
+    # Skip unreachable DataNodes so one dead node does not cut off the rest of the pipeline
+    downstream = None
+    failed = []
+    while pipeline and downstream is None:
+        target = pipeline[0]
+        try:
+            downstream = default_pool.acquire(target["host"], target["port"], PIPELINE_TIMEOUT)
+            send_message(downstream, dict(forward, pipeline=pipeline[1:], forwarded=True))
+        except OSError as e:
+            print(f"[ERROR] Pipeline to {target['host']}:{target['port']} failed: {e}")
+            if downstream:
+                default_pool.release(target["host"], target["port"], downstream, reusable=False)
+                downstream = None
+            failed.append(target)
+            pipeline = pipeline[1:]
+
+    reusable = False
+    tmp_name = None
+    writer = None
+    volume = volumes.choose(chunk_id, filesize, message.get("tier"))
+    filename = volume.file(chunk_id)
+    try:
+        old_size = os.path.getsize(filename) if os.path.exists(filename) else 0
+        checksum = StreamingChecksum()
+        # Written under a temporary name so readers and the scrubber never see a partial chunk
+        tmp_name = f"{filename}.{threading.get_ident()}.tmp"
+        writer = ChunkWriter(volume, tmp_name, filesize)
+        bytes_received = 0
+        while bytes_received < filesize:
+            # Fill one write buffer, forwarding and checksumming each piece as it arrives
+            buf = writer.buffer()
+            view = memoryview(buf)
+            want = min(len(buf), filesize - bytes_received)
+            filled = 0
+            while filled < want:
+                n = conn.recv_into(view[filled:], min(RECV_BUFFER_SIZE, want - filled))
+                if not n:
+                    raise ConnectionError("Client disconnected during file upload")
+                piece = view[filled:filled + n]
+                if receive_throttle is not None:
+                    receive_throttle.consume(n, priority)
+                if downstream:
+                    try:
+                        if send_throttle is not None:
+                            send_throttle.consume(n, priority)
+                        downstream.sendall(piece)
+                    except OSError as e:
+                        print(f"[ERROR] Pipeline forward of {chunk_id} failed: {e}")
+                        default_pool.release(target["host"], target["port"], downstream, reusable=False)
+                        downstream = None
+                        failed += pipeline
+                checksum.update(piece)
+                filled += n
+            writer.write(buf, filled)
+            bytes_received += filled
+        writer, finished = None, writer
+        finished.close()
+        RECEIVED_BYTES.inc(bytes_received)
+        checksums = checksum.finish()
+        with replace_lock:
+            write_sidecar(filename, checksums, checksum.algorithm)
+            os.replace(tmp_name, filename)
+            volumes.added(chunk_id, volume)
+            if chunk_cache is not None:
+                chunk_cache.invalidate(chunk_id)
+        scrubber.chunk_verified(chunk_id)
+        block_report.chunk_added(chunk_id, filesize, old_size)
+        if SYNC_WRITES:
+            volume.sync([filename, sidecar_path(filename)])
+
+        if downstream:
+            try:
+                resp = recv_message(downstream)
+                if resp is None:
+                    raise ConnectionError("Connection closed by peer")
+                reusable = True
+                if resp.get("status") != "success":
+                    failed += pipeline
+                elif resp.get("checksums") not in (None, checksums):
+                    # The next node received different bytes and forwarded them on
+                    print(f"[ERROR] Pipeline copy of {chunk_id} on {target['host']}:{target['port']} is corrupt")
+                    failed += pipeline
+                else:
+                    failed += resp.get("failed", [])
+            except (OSError, ValueError) as e:
+                print(f"[ERROR] No pipeline ack for {chunk_id}: {e}")
+                failed += pipeline
+    finally:
+        if writer is not None:
+            try:
+                writer.close()
+            except OSError:
+                pass  # The upload failed already; that error is the one to report
+        volumes.release(volume, filesize)
+        if failed:
+            PIPELINE_FAILURES.inc()
+        if downstream:
+            default_pool.release(target["host"], target["port"], downstream, reusable)
+        if tmp_name and os.path.exists(tmp_name):
+            os.remove(tmp_name)  # The upload was cut short
+    return failed, checksums
+
+class Scrubber(threading.Thread):
+    """Background re-verification of stored chunks against their checksums.
+
+    Each pass walks the chunks stored when it began, in chunk ID order, and
+    re-reads each one at most SCRUB_RATE bytes/s so the scan does not
+    compete with client I/O; chunks written since the pass began are
+    skipped, as they were verified when written. Passes start SCRUB_PERIOD
+    apart (or back to back if one takes longer). The pass's start and the
+    last chunk done are saved in SCRUB_STATE, so a restarted DataNode
+    carries on where it left off. Corrupt replicas are deleted and reported
+    to the NameNode, which re-replicates them from a good copy. Chunks
+    stored before checksums existed get a sidecar.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.lock = threading.Lock()
+        self.last_verified = {}  # chunk ID -> time last written or verified (since startup)
+        self.started = None  # When the current pass began
+        self.cursor = None  # Last chunk ID the current pass is done with
+
+    def chunk_verified(self, chunk_id):
+        with self.lock:
+            self.last_verified[chunk_id] = time.time()
+
+    def state_path(self):
+        return os.path.join(volumes.volumes[0].path, SCRUB_STATE)
+
+    def load_state(self):
+        try:
+            with open(self.state_path()) as f:
+                state = json.load(f)
+            self.started, self.cursor = float(state["started"]), state["cursor"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"[SCRUB] Ignoring damaged {SCRUB_STATE}: {e}")
+
+    def save_state(self):
+        path = self.state_path()
+        with open(path + ".tmp", "w") as f:
+            json.dump({"started": self.started, "cursor": self.cursor}, f)
+        os.replace(path + ".tmp", path)
+
+    def run(self):
+        self.load_state()
+        while True:
+            try:
+                if self.started is None:
+                    self.started, self.cursor = time.time(), None
+                    self.save_state()
+                self.scrub_pass()
+            except Exception as e:
+                print(f"[ERROR] Scrub pass failed: {e}")
+                time.sleep(60)
+                continue
+            wait = self.started + SCRUB_PERIOD - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self.started = None
+
+    def scrub_pass(self):
+        """Scrub the chunks after the cursor that were not verified since the pass began."""
+        for chunk_id in sorted(c for c in list_chunks() if self.cursor is None or c > self.cursor):
+            with self.lock:
+                due = self.last_verified.get(chunk_id, 0) < self.started
+            if not due:
+                continue
+            try:
+                self.scrub(chunk_id)
+            except Exception as e:
+                print(f"[ERROR] Scrubbing {chunk_id} failed: {e}")  # Tried again next pass
+            self.cursor = chunk_id
+            self.save_state()
+
+    def scrub(self, chunk_id):
+        filename = chunk_path(chunk_id)
+        buf = bytearray(RECV_BUFFER_SIZE)
+        start = time.monotonic()
+        scanned = 0
+        try:
+            with replace_lock:
+                f = open(filename, 'rb')
+            with f:
+                inode = os.fstat(f.fileno()).st_ino
+                try:
+                    with replace_lock:
+                        sidecar = read_sidecar(filename)
+                    if sidecar is None:
+                        checker = StreamingChecksum()
+                    elif sidecar["algorithm"] not in ALGORITHMS:
+                        print(f"[SCRUB] Cannot verify {chunk_id}: {sidecar['algorithm']} is not available")
+                        self.chunk_verified(chunk_id)
+                        return
+                    else:
+                        checker = StreamingVerifier(sidecar["checksums"], sidecar["algorithm"],
+                                                    sidecar["bytes_per_checksum"])
+                    while True:
+                        n = f.readinto(buf)
+                        if not n:
+                            break
+                        checker.update(memoryview(buf)[:n])
+                        scanned += n
+                        # Pace the scan to SCRUB_RATE
+                        delay = start + scanned / SCRUB_RATE - time.monotonic()
+                        if delay > 0:
+                            time.sleep(delay)
+                    checksums = checker.finish()
+                except (ValueError, KeyError, TypeError) as e:
+                    # A mismatch, or a sidecar that is itself damaged
+                    quarantine_chunk(chunk_id, str(e) or type(e).__name__, inode)
+                    return
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)  # Cold data: keep it out of the cache
+        except FileNotFoundError:
+            return  # Deleted meanwhile
+        if sidecar is None:
+            with replace_lock:
+                if os.stat(filename).st_ino == inode:
+                    write_sidecar(filename, checksums, checker.algorithm)
+                    print(f"[SCRUB] Chunk {chunk_id} had no checksums; sidecar written")
+        self.chunk_verified(chunk_id)
+
+scrubber = Scrubber()
+
+def quarantine_chunk(chunk_id, reason, inode):
+    """Delete a corrupt replica and report it so the NameNode restores it from a good copy.
+
+    `inode` is the file that was found corrupt; if the chunk has been
+    replaced by a fresh upload since, nothing is removed.
+    """
+    if not delete_chunk(chunk_id, inode):
+        return
+    print(f"[ERROR] Chunk {chunk_id} was corrupt ({reason}); removed it")
+    try:
+        default_pool.call(NAMENODE_HOST, NAMENODE_PORT, {
+            "action": "report_corrupt_chunk",
+            "chunk_id": chunk_id,
+            "datanode": {"host": ADVERTISE_HOST or get_local_ip(), "port": DATANODE_PORT}
+        })
+    except Exception as e:
+        print(f"[ERROR] Could not report corrupt chunk {chunk_id}: {e}")  # The block report still carries it
+
+MESSAGE_TYPES = ("hello", "file_chunk", "get_file", "request_fd")
+
+def admit(message, conn, priority):
+    """Take a stream for a chunk transfer, waiting in the scheduler's queue if need be.
+
+    A sender that asked for "admission" is told {"status": "ok"} before any
+    data moves, or {"status": "busy", "retry_after"} if no stream came free
+    in time, and False is returned; other senders are cut off (Busy is
+    raised). The later legs of a pipeline are admitted at once.
+    """
+    tenant = message.get("tenant") or conn.getpeername()[0]
+    start = time.perf_counter()
+    try:
+        scheduler.admit(priority, tenant, wait=not message.get("forwarded"))
+    except Busy as e:
+        REFUSED.labels(priority).inc()
+        if not message.get("admission"):
+            raise
+        send_message(conn, {"status": "busy", "message": str(e), "retry_after": e.retry_after})
+        return False
+    ADMISSION_WAIT.labels(priority).observe(time.perf_counter() - start)
+    if message.get("admission"):
+        try:
+            send_message(conn, {"status": "ok"})
+        except OSError:
+            scheduler.release(priority)
+            raise
+    return True
+
 def process_message(message, conn):
-    if message["message_type"] == "file_chunk":
+    if message["message_type"] == "hello":
+        return hello_response(message)
+
+    elif message["message_type"] == "file_chunk":
         chunk_id = message["chunk_id"]
-        filename = os.path.join(STORAGE_DIR, chunk_id)
-        filesize = message["chunk_size"]
-        
-        # Receive the file data
-        with open(filename, 'wb') as f:
-            bytes_received = 0
-            while bytes_received < filesize:
-                chunk = conn.recv(min(4096, filesize - bytes_received))
-                if not chunk:
-                    raise ConnectionError("Client disconnected during file upload")
-                f.write(chunk)
-                bytes_received += len(chunk)
-        
-        print(f"[UPLOAD] Chunk {chunk_id} received and stored.")
-        return {"status": "success", "message": f"Chunk {chunk_id} stored successfully"}
-    
+        priority = priority_of(message, "bulk")
+        if not admit(message, conn, priority):
+            return None  # Told it is busy
+        transfer_stats.begin()
+        try:
+            with tracer.span("datanode.store_chunk", message.get("trace"), chunk_id=chunk_id,
+                             bytes=message["chunk_size"], pipeline=len(message.get("pipeline", []))) as span:
+                if span:
+                    message = dict(message, trace=span.context())  # The next DataNode's span is a child of ours
+                failed, checksums = store_chunk(message, conn)
+                span.set(failed=len(failed))
+        finally:
+            transfer_stats.end(message["chunk_size"])
+            scheduler.release(priority)
+        log.debug("Chunk %s received and stored", chunk_id)
+        return {"status": "success", "message": f"Chunk {chunk_id} stored successfully", "failed": failed,
+                "checksums": checksums}
+
+    elif message["message_type"] == "get_file":
+        priority = priority_of(message, "interactive")
+        if not admit(message, conn, priority):
+            return None
+        transfer_stats.begin()
+        sent = 0
+        try:
+            with tracer.span("datanode.serve_chunk", message.get("trace"), chunk_id=message["chunk_id"]) as span:
+                sent = serve_chunk(message, conn, priority)
+                span.set(bytes=sent)
+        finally:
+            transfer_stats.end(sent)
+            scheduler.release(priority)
+        return None  # The chunk stream is the whole response
+
     else:
-        print(f"[DEBUG] Unknown message type: {message['message_type']}")
+        log.warning("Unknown message type: %s", message["message_type"])
         return {"status": "error", "message": "Unknown message type"}
 
 def handle_client(conn, addr):
-    print(f"[DataNode] Connected by {addr}")
+    log.debug("Connected by %s", addr)
+    CONNECTIONS.inc()
     try:
         while True:
-            # Receive the length of the incoming message
-            length_bytes = conn.recv(4)
-            if not length_bytes:
-                break
-            message_length = int.from_bytes(length_bytes, byteorder='big')
-            
-            # Receive the actual message
-            data = conn.recv(message_length)
-            if not data:
+            # Receive the next message; None means the client closed the connection
+            message = recv_message(conn)
+            if message is None:
                 break
-            message = json.loads(data.decode('utf-8'))
-            print(f"[DEBUG] Received message: {message}")
-            
+            log.debug("Received message: %s", message)
+
             # Process the message
+            start = time.perf_counter()
             response = process_message(message, conn)
-            
+            kind = message["message_type"]
+            REQUEST_SECONDS.labels(kind if kind in MESSAGE_TYPES else "unknown").observe(time.perf_counter() - start)
+
             # Send the response
-            response_data = json.dumps(response).encode('utf-8')
-            conn.sendall(len(response_data).to_bytes(4, byteorder='big') + response_data)
+            if response is not None:
+                if "request_id" in message:
+                    response["request_id"] = message["request_id"]
+                send_message(conn, response)
     except Exception as e:
         print(f"[ERROR] {e}")
     finally:
         conn.close()
-        print(f"[DataNode] Disconnected from {addr}")
+        CONNECTIONS.dec()
+        log.debug("Disconnected from %s", addr)
+
+def handle_local_client(conn):
+    """Answer short-circuit requests from a client on this host, one chunk per message."""
+    CONNECTIONS.inc()
+    try:
+        while True:
+            message = recv_message(conn)
+            if message is None:
+                break
+            start = time.perf_counter()
+            try:
+                with tracer.span("datanode.pass_chunk", message.get("trace"), chunk_id=message["chunk_id"]) as span:
+                    span.set(bytes=pass_chunk(message, conn))
+            except (OSError, ValueError, KeyError) as e:
+                send_message(conn, {"status": "error", "message": str(e)})  # The client reads over TCP instead
+            REQUEST_SECONDS.labels("request_fd").observe(time.perf_counter() - start)
+    except Exception as e:
+        print(f"[ERROR] {e}")
+    finally:
+        conn.close()
+        CONNECTIONS.dec()
+
+def serve_short_circuit():
+    """Accept short-circuit read connections on DOMAIN_SOCKET."""
+    if os.path.exists(DOMAIN_SOCKET):
+        os.remove(DOMAIN_SOCKET)  # Left behind by a previous run
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.bind(DOMAIN_SOCKET)
+        s.listen()
+        print(f"[DataNode] Short-circuit reads on {DOMAIN_SOCKET}")
+        while True:
+            conn, _ = s.accept()
+            threading.Thread(target=handle_local_client, args=(conn,), daemon=True).start()
 
 def start_server():
     """Start the DataNode server."""
+    global chunk_cache, chunk_loader, volumes, scheduler, send_throttle, receive_throttle
+    volumes = VolumeSet(parse_volumes(STORAGE_DIR), VOLUME_POLICY)
+    scheduler = TransferScheduler(MAX_STREAMS)
+    if BANDWIDTH > 0:
+        send_throttle, receive_throttle = TokenBucket(BANDWIDTH), TokenBucket(BANDWIDTH)
+    for volume in volumes.volumes:
+        os.makedirs(volume.path, exist_ok=True)
+        for name in os.listdir(volume.path):
+            if name.endswith(".tmp"):
+                os.remove(os.path.join(volume.path, name))  # Left over from uploads cut short by a crash
+        print(f"[DataNode] Volume {volume.path} ({volume.tier})")
+    volumes.index(is_chunk)
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.bind((DATANODE_HOST, DATANODE_PORT))
         s.listen()
         print(f"[DataNode] Listening on {DATANODE_HOST}:{DATANODE_PORT}")
+        if METRICS_PORT:
+            metrics.serve(METRICS_HOST, METRICS_PORT, pages={"/traces": tracer.recent})
+            print(f"[DataNode] Metrics at http://{METRICS_HOST}:{METRICS_PORT}/metrics")
         
         # Start heartbeat thread
         threading.Thread(target=send_heartbeat, daemon=True).start()
+        if SCRUB_RATE > 0:
+            scrubber.start()
+        if CACHE_BYTES > 0:
+            chunk_cache = ChunkCache(CACHE_BYTES)
+            chunk_loader = ChunkLoader(chunk_cache)
+            chunk_loader.start()
+        if DOMAIN_SOCKET:
+            threading.Thread(target=serve_short_circuit, daemon=True).start()
         
         while True:
             conn, addr = s.accept()
+            # Replies are often several small frames in a row; Nagle would hold the later ones for an ACK
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             thread = threading.Thread(target=handle_client, args=(conn, addr))
             thread.start()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DataNode server")
+    parser.add_argument("--port", type=int, default=DATANODE_PORT)
+    parser.add_argument("--storage-dir", default=STORAGE_DIR,
+                        help="comma-separated data directories, each optionally prefixed with its storage tier, "
+                             "e.g. [SSD]/mnt/nvme/dfs,/mnt/hdd1/dfs (untagged ones are HDD)")
+    parser.add_argument("--volume-policy", default=VOLUME_POLICY, choices=VOLUME_POLICIES,
+                        help="how new chunks are spread over the directories of a tier")
+    parser.add_argument("--sync-writes", action="store_true",
+                        help="fsync every chunk before acknowledging it (batched per directory)")
+    parser.add_argument("--namenode-host", default=NAMENODE_HOST)
+    parser.add_argument("--namenode-port", type=int, default=NAMENODE_PORT)
+    parser.add_argument("--advertise-host", default=ADVERTISE_HOST,
+                        help="address reported to the NameNode (default: detected local IP)")
+    parser.add_argument("--rack", default=RACK, help="rack/zone label used for replica placement")
+    parser.add_argument("--heartbeat-interval", type=float, default=HEARTBEAT_INTERVAL)
+    parser.add_argument("--scrub-rate", type=int, default=SCRUB_RATE,
+                        help="bytes/s the background scrubber may read (0 disables it)")
+    parser.add_argument("--scrub-period", type=float, default=SCRUB_PERIOD,
+                        help="seconds between verifications of the same chunk")
+    parser.add_argument("--cache-mb", type=int, default=CACHE_BYTES // (1024 * 1024),
+                        help="memory for the hot-chunk read cache in MB (0 disables it)")
+    parser.add_argument("--bandwidth-mb", type=float, default=BANDWIDTH / (1024 * 1024),
+                        help="MB/s of chunk data this DataNode sends, and receives, at most (0: no limit)")
+    parser.add_argument("--max-streams", type=int, default=MAX_STREAMS,
+                        help="chunk transfers served at once; more wait their turn, reads and re-replication first")
+    parser.add_argument("--domain-socket", default=DOMAIN_SOCKET,
+                        help="Unix socket path through which clients on this host map chunks directly")
+    parser.add_argument("--metrics-host", default=METRICS_HOST)
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="serve /metrics and /traces over HTTP on this port (0 disables it)")
+    parser.add_argument("--trace-file", help="append the spans of traced requests to this file as JSON lines")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="DEBUG logs every message received and chunk transferred")
+    args = parser.parse_args()
+    try:
+        parse_volumes(args.storage_dir)
+    except VolumeError as e:
+        parser.error(str(e))
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    DATANODE_PORT = args.port
+    STORAGE_DIR = args.storage_dir
+    VOLUME_POLICY = args.volume_policy
+    SYNC_WRITES = args.sync_writes
+    NAMENODE_HOST = args.namenode_host
+    NAMENODE_PORT = args.namenode_port
+    ADVERTISE_HOST = args.advertise_host
+    RACK = args.rack
+    HEARTBEAT_INTERVAL = args.heartbeat_interval
+    SCRUB_RATE = args.scrub_rate
+    SCRUB_PERIOD = args.scrub_period
+    CACHE_BYTES = args.cache_mb * 1024 * 1024
+    BANDWIDTH = int(args.bandwidth_mb * 1024 * 1024)
+    MAX_STREAMS = max(1, args.max_streams)
+    DOMAIN_SOCKET = os.path.abspath(args.domain_socket) if args.domain_socket else None  # Advertised to clients
+    METRICS_HOST = args.metrics_host
+    METRICS_PORT = args.metrics_port
+    tracer.configure(service=f"datanode:{DATANODE_PORT}", path=args.trace_file)
     start_server()
\ No newline at end of file
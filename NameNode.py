@@ -1,155 +1,821 @@
 # namenode.py
-import socket
-import threading
+import argparse
+import asyncio
 import json
-import os
+import logging
+import sys
 import time
+import metrics
+from editlog import EditLog, Checkpointer, load_snapshot, list_segments, read_segment
+from erasure import ErasureError, parse_policy
+from lease import LEASE_TIMEOUT, LeaseError, LeaseManager
+from metrics import COUNT_BUCKETS, Counter, Gauge, Histogram
+from namespace import (LISTING_LIMIT, INodeFile, Namespace, NamespaceError, block_key, block_name,
+                       compression_records, dedup_records, flat_targets, intern_tier, is_directory,
+                       normalize_path)
+from placement import DEFAULT_RACK, PlacementPolicy, node_id
+from protocol import FRAME_HEADER, MAGIC, decode_frame, encode_frame, hello_response
+from replication import ReplicationMonitor
+from tracing import Tracer
+from volumes import TIERS
 
-FILE_METADATA = {}  # File metadata
-BLOCK_METADATA = {}  # Block metadata
+NAMESPACE = Namespace()  # Directory tree of files and their chunk metadata
+BLOCK_METADATA = {}  # Block metadata: block key -> tuple of (interned) IDs of live DataNodes reporting it
+DATANODE_BLOCKS = {}  # DataNode ID -> block keys in its latest block reports
 DATANODE_STATUS = {}  # Datanode health status
-METADATA_FILE = "namenode_metadata.json"
+CACHED_BLOCKS = {}  # DataNode ID -> block keys it holds in its read cache (as of its last heartbeat)
+# Bumped whenever the namespace or any replica set changes; a client holding
+# chunk locations of an older generation knows fresh ones may differ. Seeded
+# from the clock so generations never repeat across restarts.
+LOCATION_GENERATION = time.time_ns()
+# First block (or legacy chunk ID) of a file -> when it was last written or
+# read. Kept in memory only: after a restart every file counts as accessed
+# at STARTED, so nothing looks cold until it has gone unread that long.
+ACCESS_TIMES = {}
+STARTED = time.time()
+METADATA_FILE = "namenode_metadata.json"  # Checkpointed snapshot of NAMESPACE
+EDITS_DIR = "namenode_edits"  # Write-ahead edit log segments
+CHECKPOINT_INTERVAL = 300  # Fold the edit log into the snapshot every 5 minutes...
+CHECKPOINT_EDITS = 10000  # ...or as soon as this many edits are pending
+REPLICATION = 2  # Replicas per chunk
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024  # Chunk size assumed for files uploaded without one
 HOST = '0.0.0.0'
 PORT = 5000
-metadata_lock = threading.Lock()
+LISTEN_BACKLOG = 4096  # Pending connections the kernel may queue
+DEAD_NODE_TIMEOUT = 30  # A DataNode silent for this many seconds is declared dead
+HEARTBEAT_CHECK_INTERVAL = 5  # How often to look for dead DataNodes
+REPLICATION_INTERVAL = 3  # How often to schedule re-replication of under-replicated chunks
+MAX_REPLICATION_STREAMS = 2  # Concurrent re-replication copies a DataNode may take part in
+REPLICATION_TIMEOUT = 300  # Seconds before an unconfirmed copy is rescheduled
+MAX_BLOCKS_PER_REQUEST = 64  # Blocks one add_block request may allocate
+LEASE_CHECK_INTERVAL = 5  # How often to look for expired write leases
+COLD_FILE_AGE = 7 * 24 * 3600  # Files unread for this many seconds are offered for conversion to EC
+METRICS_HOST = '127.0.0.1'  # Where /metrics and /traces are served...
+METRICS_PORT = 0  # ...if this is set
+edit_log = None  # Opened by load_metadata()
+metadata_writer = None  # Started by serve()
+placement_policy = PlacementPolicy(REPLICATION)
+replication_monitor = ReplicationMonitor(REPLICATION, MAX_REPLICATION_STREAMS, REPLICATION_TIMEOUT,
+                                         startup_delay=DEAD_NODE_TIMEOUT)
+lease_manager = LeaseManager(LEASE_TIMEOUT)
+log = logging.getLogger("namenode")
+tracer = Tracer("namenode")  # Records spans of requests that carry a trace context
+
+# Requests process_message handles; others are counted as "unknown"
+ACTIONS = frozenset({"hello", "upload", "create", "add_block", "add_chunks", "complete", "renew_lease", "abandon",
+                     "download", "upload_complete", "heartbeat", "report_corrupt_chunk", "mkdir", "ls", "rename",
+                     "replace", "cold_files", "delete"})
+RPC_SECONDS = Histogram("dfs_namenode_rpc_seconds", "Time to process a request, by action", ["action"])
+RPC_ERRORS = Counter("dfs_namenode_rpc_errors_total", "Requests answered with an error, by action", ["action"])
+CONNECTIONS = Gauge("dfs_namenode_connections", "Open client and DataNode connections")
+EDIT_QUEUE = Gauge("dfs_namenode_edit_queue_depth", "Edits waiting for the metadata writer",
+                   function=lambda: metadata_writer.queue.qsize() if metadata_writer else 0)
+EDIT_WAIT = Histogram("dfs_namenode_edit_wait_seconds", "Time from submitting an edit until it is applied")
+EDIT_BATCH = Histogram("dfs_namenode_edit_batch_size", "Edits applied per metadata writer batch",
+                       buckets=COUNT_BUCKETS)
+EDIT_SYNC = Histogram("dfs_namenode_edit_sync_seconds", "Time to fsync a batch of edits")
+Gauge("dfs_namenode_files", "Files in the namespace", function=lambda: NAMESPACE.file_count)
+Gauge("dfs_namenode_blocks", "Blocks with at least one reported replica", function=lambda: len(BLOCK_METADATA))
+Gauge("dfs_namenode_missing_blocks", "Blocks with no live replica", function=lambda: len(replication_monitor.missing))
+Gauge("dfs_namenode_pending_replications", "Blocks being re-replicated",
+      function=lambda: len(replication_monitor.pending))
+Gauge("dfs_namenode_live_datanodes", "DataNodes sending heartbeats", function=lambda: len(DATANODE_STATUS))
+Gauge("dfs_namenode_open_leases", "Files being written", function=lambda: len(lease_manager.leases))
+DATANODE_THROUGHPUT = Gauge("dfs_namenode_datanode_throughput_bytes_per_second",
+                            "Bytes/s a DataNode moved between its last two heartbeats", ["datanode"])
+DATANODE_INFLIGHT = Gauge("dfs_namenode_datanode_inflight_transfers", "Transfers in progress on a DataNode as of its last "
+                          "heartbeat", ["datanode"])
+
+def apply_edit(namespace, record):
+    """Apply one edit log record to a Namespace. Returns False if it was a no-op.
+
+    Raises NamespaceError if the edit is not valid against the current tree.
+    """
+    op = record["op"]
+    if op in ("add_file", "complete_file"):
+        # Records from before the hierarchical namespace carry a flat "name"
+        path = record.get("path") or record["name"]
+        if op == "add_file":
+            if "meta" in record:
+                # Written before integer block IDs: a metadata dict with per-chunk IDs
+                return namespace.add_file(path, INodeFile.from_json(record["meta"]))
+            extents = record.get("extents")
+            dedup = "fingerprints" in record  # Targets are kept per shared block (see Namespace.add_file)
+            inode = INodeFile(record["size"], record["chunk_size"], record["first_block"], record["num_blocks"],
+                              () if dedup else flat_targets(record["targets"]), record.get("complete", False),
+                              extents=tuple(map(tuple, extents)) if extents else None, ec=record.get("ec"),
+                              compression=compression_records(record.get("compression")),
+                              tier=intern_tier(record.get("tier")),
+                              **dedup_records(record.get("lengths"), record.get("fingerprints")))
+            return namespace.add_file(path, inode, reused=record.get("reused", ()),
+                                      chunk_targets=record["targets"] if dedup else None)
+        return namespace.complete_file(path)
+    elif op == "reserve_blocks":
+        if "count" in record:
+            # Submitted by a handler: hand out the next `count` block IDs, logged as the new high-water mark
+            first = namespace.allocate_blocks(record.pop("count"))
+            record["next_block_id"] = namespace.next_block_id
+            return first
+        namespace.next_block_id = max(namespace.next_block_id, record["next_block_id"])
+        return True
+    elif op == "mkdir":
+        return namespace.mkdir(record["path"])
+    elif op == "rename":
+        return namespace.rename(record["src"], record["dst"])
+    elif op == "replace":
+        return namespace.replace(record["src"], record["dst"], record.get("first_chunk"))
+    elif op == "delete":
+        return namespace.delete(record["path"], record.get("recursive", False))
+    return False
 
 def load_metadata():
-    global FILE_METADATA
-    if os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, "r") as f:
-            FILE_METADATA = json.load(f)
-            print(f"[NameNode] Metadata loaded: {len(FILE_METADATA)} entries")
-
-def save_metadata():
-    with metadata_lock:
-        with open(METADATA_FILE, "w") as f:
-            json.dump(FILE_METADATA, f, indent=2)
-            print("[NameNode] Metadata saved.")
-
-def handle_client(conn, addr):
-    print(f"[NameNode] Connected by {addr}")
+    """Load the last checkpoint and replay the edit log written since."""
+    global NAMESPACE, edit_log
+    files, last_txid = load_snapshot(METADATA_FILE)
+    NAMESPACE = Namespace.from_snapshot(files)
+    replayed = 0
+    for _, path in list_segments(EDITS_DIR):
+        for record in read_segment(path):
+            if record["txid"] > last_txid:
+                apply_edit(NAMESPACE, record)
+                last_txid = record["txid"]
+                replayed += 1
+    NAMESPACE.on_chunks_removed = invalidate_chunks
+    lease_manager.on_reclaim = invalidate_chunks
+    replication_monitor.replicas_of = wanted_replicas
+    replication_monitor.tier_of = storage_tier
+    edit_log = EditLog(EDITS_DIR)
+    edit_log.open(last_txid)
+    print(f"[NameNode] Metadata loaded: {NAMESPACE.file_count} files ({replayed} edits replayed)")
+
+class MetadataWriter:
+    """The single task allowed to mutate NAMESPACE.
+
+    Handlers submit edits and await the result. The writer applies queued
+    edits in order, appends them to the edit log, and syncs each batch with
+    one fsync on a worker thread so the event loop never blocks on disk.
+    Because every mutation happens on this one task, no lock is needed.
+    """
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    async def submit(self, op, **fields):
+        """Apply an edit durably. Returns False if it did not change anything.
+
+        A reserve_blocks edit submitted with a `count` returns the first of
+        the block IDs it reserved.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((dict(op=op, **fields), future, time.perf_counter()))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            results = []
+            last_txid = None
+            now = time.perf_counter()
+            EDIT_BATCH.observe(len(batch))
+            for record, future, submitted in batch:
+                EDIT_WAIT.observe(now - submitted)
+                try:
+                    changed = apply_edit(NAMESPACE, record)
+                    if changed:
+                        last_txid = edit_log.append(**record)
+                    results.append((future, changed, None))
+                except Exception as e:
+                    results.append((future, None, e))
+            sync_error = None
+            if last_txid is not None:
+                try:
+                    with EDIT_SYNC.time():
+                        await loop.run_in_executor(None, edit_log.sync, last_txid)
+                except Exception as e:
+                    sync_error = e
+            for future, changed, error in results:
+                error = error or (sync_error if changed else None)
+                if future.done():
+                    continue
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(changed)
+
+async def respond(writer, message, framing):
+    start = time.perf_counter()
+    action = message.get("action")
+    action = action if isinstance(action, str) and action in ACTIONS else "unknown"  # Clients cannot add labels at will
+    with tracer.span(f"namenode.{action}", message.get("trace")) as span:
+        try:
+            response = await process_message(message)
+        except (NamespaceError, LeaseError) as e:
+            response = {"status": "error", "message": str(e)}
+        except Exception as e:
+            # A malformed request: still answer it, or a multiplexed client waits out its timeout
+            print(f"[ERROR] {message.get('action')} request failed: {e!r}")
+            log.debug("Failed request: %s", message, exc_info=True)
+            response = {"status": "error", "message": f"Bad request: {e!r}"}
+        span.set(status=response.get("status"))
+    RPC_SECONDS.labels(action).observe(time.perf_counter() - start)
+    if response.get("status") == "error":
+        RPC_ERRORS.labels(action).inc()
+    if "request_id" in message:
+        response["request_id"] = message["request_id"]
+    writer.write(encode_frame(response, *framing))
+    await writer.drain()
+
+async def read_message(reader):
+    """Read one message in either framing. Returns (message, (version, codec)), or (None, None) at EOF."""
+    try:
+        start = await reader.readexactly(4)
+    except asyncio.IncompleteReadError:
+        return None, None
+    if start[0] != MAGIC:
+        data = await reader.readexactly(int.from_bytes(start, byteorder='big'))
+        return json.loads(data), (1, 0)
+    header = start + await reader.readexactly(FRAME_HEADER.size - 4)
+    body = await reader.readexactly(FRAME_HEADER.unpack(header)[5])
+    message, version, codec = decode_frame(header, body)
+    return message, (version, codec)
+
+async def handle_client(reader, writer):
+    addr = writer.get_extra_info("peername")
+    log.debug("Connected by %s", addr)
+    CONNECTIONS.inc()
+    pending = set()
     try:
         while True:
-            length_bytes = conn.recv(4)
-            if not length_bytes:
-                break
-            message_length = int.from_bytes(length_bytes, byteorder='big')
-            data = conn.recv(message_length)
-            if not data:
+            message, framing = await read_message(reader)
+            if message is None:
                 break
-            message = json.loads(data.decode('utf-8'))
-            print(f"[DEBUG] Received message: {message}")
-            
-            # Process the message
-            response = process_message(message)
-            
-            # Send the response
-            response_data = json.dumps(response).encode('utf-8')
-            conn.sendall(len(response_data).to_bytes(4, byteorder='big') + response_data)
+            log.debug("Received message: %s", message)
+
+            if "request_id" in message:
+                # Multiplexed client: answer out of order as each request completes
+                task = asyncio.create_task(respond(writer, message, framing))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            else:
+                await respond(writer, message, framing)
+        if pending:
+            await asyncio.wait(pending)
     except Exception as e:
         print(f"[ERROR] {e}")
     finally:
-        conn.close()
-        print(f"[NameNode] Disconnected from {addr}")
+        for task in pending:
+            task.cancel()
+        writer.close()
+        CONNECTIONS.dec()
+        log.debug("Disconnected from %s", addr)
 
-def process_message(message):
+async def process_message(message):
     response = {}
 
-    # Handle upload request
+    # Protocol negotiation: the first request on a client's connection
+    if message["action"] == "hello":
+        response = hello_response(message)
+
+    # Handle upload request: the whole file allocated at once (clients without write sessions)
     if message["action"] == "upload":
-        filename = message["name"]
+        filename = normalize_path(message["name"])
         filesize = message["filesize"]
         num_chunks = message["num_chunks"]
+        chunk_size = message.get("chunk_size", DEFAULT_CHUNK_SIZE)
         
         # Allocate DataNodes for each chunk
+        placements = allocate_datanodes(num_chunks, chunk_size)
+        if placements is None:
+            response = {"status": "error", "message": "Not enough DataNodes available"}
+            return response
+        # Chunk IDs do not depend on the path, so renames never touch DataNodes
+        first_block = await metadata_writer.submit("reserve_blocks", count=num_chunks)
         chunk_allocations = []
-        for i in range(num_chunks):
-            chunk_id = f"{filename}_chunk_{i}"
-            datanodes = allocate_datanodes()  # Function to select DataNodes
-            if not datanodes:
-                response = {"status": "error", "message": "Not enough DataNodes available"}
-                return response
+        for i, datanodes in enumerate(placements):
             chunk_allocations.append({
-                "chunk_id": chunk_id,
+                "chunk_id": block_name(first_block + i),
                 "datanodes": [{"host": dn["host"], "port": dn["port"]} for dn in datanodes]
             })
         
         # Store file metadata
-        with metadata_lock:
-            FILE_METADATA[filename] = {
-                "size": filesize,
-                "chunks": chunk_allocations
-            }
-        save_metadata()
+        await metadata_writer.submit("add_file", path=filename, size=filesize, chunk_size=chunk_size,
+                                     first_block=first_block, num_blocks=num_chunks,
+                                     targets=[[node_id(dn) for dn in datanodes] for datanodes in placements])
         
         response = {
             "status": "ok",
             "chunk_allocations": chunk_allocations
         }
-        print(f"[DEBUG] Chunk Allocations Sent to Client: {chunk_allocations}")
+        log.debug("Chunk allocations sent to client: %s", chunk_allocations)
+
+    # Handle write sessions: create opens a lease, add_block allocates chunks in batches as
+    # the client streams (committing those its pipelines acknowledged), complete adds the file.
+    # Erasure-coded files ("ec": policy name) are allocated whole stripes, one cell per DataNode
+    if message["action"] == "create":
+        path = normalize_path(message["path"])
+        chunk_size = message.get("chunk_size", DEFAULT_CHUNK_SIZE)
+        if not isinstance(chunk_size, int) or chunk_size <= 0:
+            raise LeaseError(f"Invalid chunk size: {chunk_size!r}")
+        if is_directory(NAMESPACE.lookup(path)):
+            raise NamespaceError(f"Is a directory: {path}")
+        try:
+            ec = parse_policy(message["ec"]) if message.get("ec") else None
+        except ErasureError as e:
+            raise LeaseError(str(e))
+        dedup = bool(message.get("dedup"))
+        if ec is not None and dedup:
+            raise LeaseError("Erasure-coded files cannot be deduplicated")
+        tier = message.get("tier")
+        if tier is not None and tier not in TIERS:
+            raise LeaseError(f"Unknown storage tier {tier!r} (expected one of {', '.join(TIERS)})")
+        lease = lease_manager.open(path, message.get("holder", "anonymous"), chunk_size, ec=ec, dedup=dedup,
+                                   tier=tier)
+        response = {"status": "ok", "lease_id": lease.lease_id, "lease_timeout": lease_manager.timeout}
+
+    if message["action"] == "add_block":
+        lease = lease_manager.get(message["lease_id"])
+        commit_chunks(lease, message.get("committed", []))
+        count = max(1, min(message.get("count", 1), MAX_BLOCKS_PER_REQUEST))
+        if lease.ec is not None:
+            # `count` stripes; each cell is one "chunk" stored on one DataNode of its stripe
+            width = lease.ec.data + lease.ec.parity
+            count = max(1, min(count, MAX_BLOCKS_PER_REQUEST // width))
+            stripes = allocate_datanodes(count, lease.chunk_size, width, lease.tier)
+            placements = None if stripes is None else [[dn] for stripe in stripes for dn in stripe]
+        else:
+            placements = allocate_datanodes(count, lease.chunk_size, tier=lease.tier)
+        if placements is None:
+            return {"status": "error", "message": "Not enough DataNodes available"}
+        # Logged before any client sees them, so no block ID handed out is reused after a restart
+        first_block = await metadata_writer.submit("reserve_blocks", count=len(placements))
+        check_lease(lease)
+        lease_manager.add_blocks(lease, first_block,
+                                 [tuple(sys.intern(node_id(dn)) for dn in datanodes) for datanodes in placements])
+        response = {
+            "status": "ok",
+            "chunk_allocations": [{"chunk_id": block_name(first_block + i),
+                                   "datanodes": [{"host": dn["host"], "port": dn["port"]} for dn in datanodes]}
+                                  for i, datanodes in enumerate(placements)]
+        }
+
+    # Deduplicated files declare their next chunks by fingerprint and size instead. Chunks whose
+    # content a file (or this one) already stored are listed with that block as "duplicate" and no
+    # DataNodes: the client does not send them
+    if message["action"] == "add_chunks":
+        lease = lease_manager.get(message["lease_id"])
+        if not lease.dedup:
+            raise LeaseError(f"{lease.path} is not being written deduplicated")
+        commit_chunks(lease, message.get("committed", []))
+        declared = []
+        for chunk in message.get("chunks", [])[:MAX_BLOCKS_PER_REQUEST]:
+            try:
+                digest, size = bytes.fromhex(chunk["fingerprint"]), chunk["size"]
+            except (KeyError, TypeError, ValueError):
+                raise LeaseError(f"Invalid chunk declaration: {chunk!r}")
+            if len(digest) != 32 or not isinstance(size, int) or not 0 < size <= lease.chunk_size:
+                raise LeaseError(f"Invalid chunk declaration: {chunk!r}")
+            declared.append((digest, size))
+        if not declared:
+            raise LeaseError("No chunks declared")
+        while True:
+            new = {}  # Digest -> index among the blocks to allocate
+            for digest, size in declared:
+                if NAMESPACE.find_block(digest, size) is None and lease.digests.get(digest) is None:
+                    new.setdefault(digest, len(new))
+            placements = allocate_datanodes(len(new), lease.chunk_size, tier=lease.tier) if new else []
+            if placements is None:
+                return {"status": "error", "message": "Not enough DataNodes available"}
+            first_block = await metadata_writer.submit("reserve_blocks", count=len(new)) if new else None
+            check_lease(lease)
+            # A file deleted meanwhile may have taken the only copy of some content: then start over
+            if all(digest in new or lease.digests.get(digest) is not None or NAMESPACE.find_block(digest, size)
+                   is not None for digest, size in declared):
+                break
+        allocations = []
+        for digest, size in declared:
+            block = NAMESPACE.find_block(digest, size)
+            if block is not None:
+                lease_manager.reuse(lease, block, digest, size)
+            elif lease.digests.get(digest) is not None:
+                block = lease.digests[digest]
+                lease_manager.reuse(lease, block)
+            else:
+                i = new[digest]
+                datanodes = placements[i]
+                lease_manager.add_blocks(lease, first_block + i, [tuple(sys.intern(node_id(dn)) for dn in datanodes)],
+                                         [(digest, size)])
+                allocations.append({"chunk_id": block_name(first_block + i),
+                                    "datanodes": [{"host": dn["host"], "port": dn["port"]} for dn in datanodes]})
+                continue
+            allocations.append({"chunk_id": block_name(block), "datanodes": [], "duplicate": True})
+        response = {"status": "ok", "chunk_allocations": allocations}
+
+    if message["action"] == "complete":
+        lease = lease_manager.get(message["lease_id"])
+        commit_chunks(lease, message.get("committed", []))
+        blocks, unused, size = lease.layout()
+        if message.get("size", size) != size:
+            raise LeaseError(f"Committed chunks of {lease.path} hold {size} bytes, not {message['size']}")
+        lease.completing = True  # Kept until the file is in the namespace, so block reports keep its chunks
+        invalidate_chunks(unused)
+        inode = INodeFile.from_blocks(size, lease.chunk_size, blocks)
+        # EC policy, storage tier, per-chunk compression and deduplicated chunks, if any
+        layout = {"ec": lease.ec.name} if lease.ec is not None else {}
+        if lease.tier is not None:
+            layout["tier"] = lease.tier
+        compression = [lease.compression.get(block) for block in blocks]
+        if any(compression):
+            layout["compression"] = compression
+        if lease.dedup:
+            layout.update(lengths=[lease.lengths[block] for block in blocks],
+                          fingerprints=[lease.fingerprints[block][0].hex() for block in blocks],
+                          reused=sorted(lease.reused.intersection(blocks)))
+        try:
+            await metadata_writer.submit("add_file", path=lease.path, size=size, chunk_size=lease.chunk_size,
+                                         first_block=inode.first_block, num_blocks=inode.num_blocks,
+                                         extents=inode.extents, targets=[lease.targets.get(b, ()) for b in blocks],
+                                         complete=True, **layout)
+        except NamespaceError:
+            lease_manager.reclaim(lease)  # The file was not added: its chunks go
+            raise
+        finally:
+            lease_manager.release(lease)  # Already done by reclaim() if that ran
+        if blocks:
+            ACCESS_TIMES[blocks[0]] = time.time()
+        response = {"status": "ok", "message": f"Wrote {lease.path} ({size} bytes)"}
+
+    if message["action"] == "renew_lease":
+        response = {"status": "ok", "leases": lease_manager.renew(message["holder"])}
+
+    if message["action"] == "abandon":
+        lease = lease_manager.leases.get(message["lease_id"])
+        if lease is not None:
+            print(f"[NameNode] Write of {lease.path} abandoned by {lease.holder}")
+            lease_manager.reclaim(lease)
+        response = {"status": "ok"}
 
     # Handle download request
     if message["action"] == "download":
-        filename = message["name"]
-        with metadata_lock:
-            if filename in FILE_METADATA:
-                response = {
-                    "status": "ok",
-                    "chunks": FILE_METADATA[filename]["chunks"]
-                }
-            else:
-                response = {"status": "error", "message": "File not found"}
+        inode = NAMESPACE.get_file(message["name"])
+        if inode is not None:
+            chunks, parity = chunk_locations(inode)
+            response = {
+                "status": "ok",
+                "size": inode.size,
+                "chunk_size": inode.chunk_size or DEFAULT_CHUNK_SIZE,
+                "chunks": chunks,
+                "generation": LOCATION_GENERATION
+            }
+            if inode.ec is not None:
+                response["ec"] = inode.ec
+                response["parity"] = parity
+            if inode.dedup:
+                response["lengths"] = inode.lengths.tolist()
+            first = next(iter(inode.blocks()), None)
+            if first is not None:
+                ACCESS_TIMES[first] = time.time()
+        else:
+            response = {"status": "error", "message": "File not found"}
 
     # Handle upload complete request
     if message["action"] == "upload_complete":
-        filename = message["filename"]
+        filename = normalize_path(message["filename"])
         filesize = message["filesize"]
         
-        print(f"[DEBUG] Received upload_complete request: {message}")
-        print(f"[DEBUG] Current FILE_METADATA: {FILE_METADATA}")
-        
-        with metadata_lock:
-            if filename in FILE_METADATA:
-                FILE_METADATA[filename]["status"] = "complete"
-                save_metadata()
-                response = {"status": "ok", "message": f"Upload of {filename} confirmed"}
-            else:
-                response = {"status": "error", "message": "File metadata not found"}
+        log.debug("Received upload_complete request: %s", message)
+
+        if await metadata_writer.submit("complete_file", path=filename):
+            response = {"status": "ok", "message": f"Upload of {filename} confirmed"}
+        else:
+            response = {"status": "error", "message": "File metadata not found"}
 
     # Handle heartbeat
     if message["action"] == "heartbeat":
         datanode_host = message["datanode_host"]
         datanode_port = message["datanode_port"]
-        datanode_id = f"{datanode_host}:{datanode_port}"
+        datanode_id = sys.intern(f"{datanode_host}:{datanode_port}")
+        known = datanode_id in DATANODE_STATUS
         DATANODE_STATUS[datanode_id] = {
             "host": datanode_host,
             "port": datanode_port,
+            "rack": message.get("rack", DEFAULT_RACK),
+            "capacity_bytes": message.get("capacity_bytes"),
+            "used_bytes": message.get("used_bytes"),
+            "free_bytes": message.get("free_bytes"),
+            "inflight": message.get("inflight", 0),
+            "throughput": message.get("throughput", 0),
+            "cache": message.get("cache"),
+            "storage": message.get("storage"),
+            "domain_socket": message.get("domain_socket"),
             "last_heartbeat": time.time()
         }
-        print(f"[DEBUG] Heartbeat received from {datanode_id}")
+        placement_policy.heartbeat(DATANODE_STATUS[datanode_id])
+        if not known:
+            locations_changed()
+        report = message.get("block_report")
+        if report is not None:
+            apply_block_report(datanode_id, report)
+        if "cached_chunks" in message:
+            CACHED_BLOCKS[datanode_id] = {block_key(chunk_id) for chunk_id in message["cached_chunks"]}
+        DATANODE_THROUGHPUT.labels(datanode_id).set(message.get("throughput", 0))
+        DATANODE_INFLIGHT.labels(datanode_id).set(message.get("inflight", 0))
+        log.debug("Heartbeat received from %s", datanode_id)
         response = {"status": "success"}
+        if not known and not (report and report.get("full")):
+            # A (re-)registering node must tell us everything it stores
+            response["send_full_report"] = True
+        commands = replication_monitor.take_commands(datanode_id)
+        if commands:
+            response["commands"] = commands
+
+    # Handle a replica found corrupt by a client read or a DataNode scrub
+    if message["action"] == "report_corrupt_chunk":
+        datanode = message["datanode"]
+        datanode_id = f"{datanode['host']}:{datanode['port']}"
+        chunk_id = message["chunk_id"]
+        print(f"[NameNode] Corrupt replica of {chunk_id} reported on {datanode_id}")
+        if block_key(chunk_id) in DATANODE_BLOCKS.get(datanode_id, ()):
+            # Stop handing it out; the replication monitor restores the lost copy
+            apply_block_report(datanode_id, {"removed": [chunk_id]})
+        response = {"status": "ok"}
+
+    # Handle namespace requests
+    if message["action"] == "mkdir":
+        path = normalize_path(message["path"])
+        created = await metadata_writer.submit("mkdir", path=path)
+        response = {"status": "ok", "message": f"Created {path}" if created else f"{path} already exists"}
+
+    if message["action"] == "ls":
+        entries, has_more = NAMESPACE.listing(message.get("path", "/"), message.get("start_after"),
+                                              min(message.get("limit", LISTING_LIMIT), LISTING_LIMIT))
+        response = {"status": "ok", "entries": entries, "has_more": has_more}
+
+    if message["action"] == "rename":
+        src = normalize_path(message["src"])
+        dst = normalize_path(message["dst"])
+        await metadata_writer.submit("rename", src=src, dst=dst)
+        locations_changed()
+        response = {"status": "ok", "message": f"Renamed {src} to {dst}"}
+
+    # Swap a rewritten copy (e.g. an EC conversion) in for the file it was made from
+    if message["action"] == "replace":
+        src = normalize_path(message["src"])
+        dst = normalize_path(message["dst"])
+        await metadata_writer.submit("replace", src=src, dst=dst, first_chunk=message.get("first_chunk"))
+        locations_changed()
+        response = {"status": "ok", "message": f"Replaced {dst} with {src}"}
+
+    # Replicated files nobody has read for `older_than` seconds: candidates for erasure coding
+    if message["action"] == "cold_files":
+        cutoff = time.time() - message.get("older_than", COLD_FILE_AGE)
+        min_size = message.get("min_size", 1)
+        limit = min(message.get("limit", LISTING_LIMIT), LISTING_LIMIT)
+        files = []
+        for path, inode in NAMESPACE.iter_files(message.get("path", "/")):
+            if not inode.complete or inode.ec is not None or inode.size < min_size:
+                continue
+            if ACCESS_TIMES.get(next(iter(inode.blocks()), None), STARTED) < cutoff:
+                files.append({"path": path, "size": inode.size, "chunk_size": inode.chunk_size})
+                if len(files) >= limit:
+                    break
+        response = {"status": "ok", "files": files, "replication": REPLICATION}
+
+    if message["action"] == "delete":
+        path = normalize_path(message["path"])
+        if await metadata_writer.submit("delete", path=path, recursive=message.get("recursive", False)):
+            locations_changed()
+            response = {"status": "ok", "message": f"Deleted {path}"}
+        else:
+            response = {"status": "error", "message": f"No such file or directory: {path}"}
     
     return response
 
-def allocate_datanodes():
-    """Allocate DataNodes for a chunk (replication factor = 2)."""
+def locations_changed():
+    global LOCATION_GENERATION
+    LOCATION_GENERATION += 1
+
+def add_replica(block, datanode_id):
+    replicas = BLOCK_METADATA.get(block, ())
+    if datanode_id not in replicas:
+        BLOCK_METADATA[block] = replicas + (datanode_id,)
+        locations_changed()
+
+def remove_replica(block, datanode_id):
+    replicas = BLOCK_METADATA.get(block)
+    if replicas is not None and datanode_id in replicas:
+        BLOCK_METADATA[block] = tuple(dn for dn in replicas if dn != datanode_id)
+        locations_changed()
+
+def apply_block_report(datanode_id, report):
+    """Update the block -> live replica index from a full or incremental block report."""
+    blocks = DATANODE_BLOCKS.setdefault(datanode_id, set())
+    if report.get("full"):
+        reported = {block_key(chunk_id) for chunk_id in report.get("chunks", [])}
+        removed = blocks - reported
+        added = reported - blocks
+    else:
+        removed = [block_key(chunk_id) for chunk_id in report.get("removed", [])]
+        added = [block_key(chunk_id) for chunk_id in report.get("added", [])]
+    for block in removed:
+        blocks.discard(block)
+        remove_replica(block, datanode_id)
+        if NAMESPACE.is_live(block):
+            replication_monitor.check(block)
+    for block in added:
+        if not NAMESPACE.is_live(block) and lease_manager.owner(block) is None:
+            # Left over from a deleted or overwritten file, or an abandoned write
+            replication_monitor.invalidate(block, [datanode_id])
+            continue
+        blocks.add(block)
+        add_replica(block, datanode_id)
+        replication_monitor.chunk_reported(block, datanode_id)
+    if report.get("full"):
+        # After a (re-)registration, check every chunk the node holds
+        for block in blocks:
+            replication_monitor.check(block)
+
+def check_lease(lease):
+    """Raise LeaseError if `lease` was completed, abandoned or reclaimed (while a handler awaited an edit)."""
+    if lease_manager.leases.get(lease.lease_id) is not lease:
+        raise LeaseError(f"The lease on {lease.path} is gone")
+
+def commit_chunks(lease, committed):
+    """Record chunks whose replica pipelines acknowledged the client's data."""
+    for chunk in committed:
+        lease_manager.commit(lease, block_key(chunk["chunk_id"]), chunk["size"], chunk.get("compression"))
+
+def invalidate_chunks(blocks):
+    """Forget the blocks of removed files and have the DataNodes holding them delete them."""
+    if blocks:
+        locations_changed()
+    for block in blocks:
+        ACCESS_TIMES.pop(block, None)
+        holders = BLOCK_METADATA.pop(block, ())
+        for datanode_id in holders:
+            DATANODE_BLOCKS.get(datanode_id, set()).discard(block)
+        replication_monitor.invalidate(block, holders)
+
+def expire_dead_datanodes(now=None):
+    """Forget DataNodes whose heartbeats stopped, along with the replicas they held."""
+    cutoff = (now or time.time()) - DEAD_NODE_TIMEOUT
+    for datanode_id, status in list(DATANODE_STATUS.items()):
+        if status["last_heartbeat"] < cutoff:
+            del DATANODE_STATUS[datanode_id]
+            CACHED_BLOCKS.pop(datanode_id, None)
+            DATANODE_THROUGHPUT.remove(datanode_id)
+            DATANODE_INFLIGHT.remove(datanode_id)
+            locations_changed()
+            for block in DATANODE_BLOCKS.pop(datanode_id, ()):
+                remove_replica(block, datanode_id)
+                replication_monitor.check(block)
+            replication_monitor.node_dead(datanode_id)
+            print(f"[NameNode] DataNode {datanode_id} declared dead (no heartbeat for {DEAD_NODE_TIMEOUT}s)")
+
+async def monitor_datanodes():
+    while True:
+        await asyncio.sleep(HEARTBEAT_CHECK_INTERVAL)
+        expire_dead_datanodes()
+
+async def monitor_leases():
+    while True:
+        await asyncio.sleep(LEASE_CHECK_INTERVAL)
+        for lease in lease_manager.expire():
+            print(f"[NameNode] Lease on {lease.path} held by {lease.holder} expired; "
+                  f"reclaimed {len(lease.blocks)} chunk(s)")
+
+async def monitor_replication():
+    while True:
+        await asyncio.sleep(REPLICATION_INTERVAL)
+        replication_monitor.schedule(BLOCK_METADATA, DATANODE_STATUS, placement_policy, DEFAULT_CHUNK_SIZE)
+
+def live_replicas(inode, index, block):
+    """The live DataNodes holding chunk `index` of a file.
+
+    Uses the block-report index; chunks no live node has reported yet (for
+    example just after an upload) fall back to their allocation (for a
+    deduplicated file, that of the file which first stored it), filtered
+    to DataNodes that are still alive. Replicas held in a DataNode's read
+    cache are listed first and marked "cached", so clients read them from
+    memory rather than disk. DataNodes that serve short-circuit reads carry
+    their "domain_socket", for clients on the same host.
+    """
+    replicas = BLOCK_METADATA.get(block)
+    if replicas is None:
+        replicas = NAMESPACE.shared[block][3] if inode.dedup else inode.chunk_targets(index)
+    live = []
+    for dn in replicas:
+        status = DATANODE_STATUS.get(dn)
+        if status is None:
+            continue
+        datanode = {"host": status["host"], "port": status["port"]}
+        if status.get("domain_socket"):
+            datanode["domain_socket"] = status["domain_socket"]
+        if block in CACHED_BLOCKS.get(dn, ()):
+            datanode["cached"] = True
+            live.insert(0, datanode)
+        else:
+            live.append(datanode)
+    return live
+
+def chunk_locations(inode):
+    """The JSON chunk list of a download response, and for an EC file the parity cells of each stripe.
+
+    An EC file's chunks are its data cells, in file order; cells past the
+    end of the file are left out. Returns (chunks, parity or None).
+    """
+    cells = [{"chunk_id": block_name(block), "datanodes": live_replicas(inode, i, block)}
+             for i, block in enumerate(inode.blocks())]
+    if inode.ec is None:
+        if inode.compression is not None:
+            for i, cell in enumerate(cells):
+                cell["compression"] = inode.chunk_compression(i)
+        return cells, None
+    policy = parse_policy(inode.ec)
+    width = policy.data + policy.parity
+    stripes = [cells[i:i + width] for i in range(0, len(cells), width)]
+    chunks = [cell for stripe in stripes for cell in stripe[:policy.data]]
+    return chunks[:-(-inode.size // inode.chunk_size)], [stripe[policy.data:] for stripe in stripes]
+
+def wanted_replicas(block):
+    """Replicas a block should have: one for cells of erasure-coded files, REPLICATION otherwise."""
+    owner = NAMESPACE.owner(block) or lease_manager.owner(block)
+    return 1 if owner is not None and owner.ec is not None else REPLICATION
+
+def storage_tier(block):
+    """The storage tier the file owning a block is pinned to, or None."""
+    owner = NAMESPACE.owner(block) or lease_manager.owner(block)
+    return owner.tier if owner is not None else None
+
+def allocate_datanodes(num_chunks, chunk_size, width=None, tier=None):
+    """Choose REPLICATION DataNodes for each of `num_chunks` chunks (or `width` for each EC stripe),
+    preferring ones with volumes of `tier` if given, or None if too few are registered."""
     datanodes = list(DATANODE_STATUS.values())  # Get the list of available DataNodes
-    if len(datanodes) < 2:
+    placements = placement_policy.allocate(datanodes, num_chunks, chunk_size, width, tier)
+    if placements is None:
         print("[ERROR] Not enough DataNodes available for replication")
-        return []  # Return an empty list if there aren't enough DataNodes
-    print(f"[DEBUG] Registered DataNodes: {DATANODE_STATUS}")
-    return datanodes[:2]  # Select the first 3 DataNodes
+    return placements
+
+async def serve():
+    global metadata_writer
+    metadata_writer = MetadataWriter()
+    writer_task = asyncio.create_task(metadata_writer.run())
+    monitor_task = asyncio.create_task(monitor_datanodes())
+    replication_task = asyncio.create_task(monitor_replication())
+    lease_task = asyncio.create_task(monitor_leases())
+    server = await asyncio.start_server(handle_client, HOST, PORT, backlog=LISTEN_BACKLOG)
+    print(f"[NameNode] Listening on {HOST}:{PORT}")
+    if METRICS_PORT:
+        metrics.serve(METRICS_HOST, METRICS_PORT, pages={"/traces": tracer.recent})
+        print(f"[NameNode] Metrics at http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        writer_task.cancel()
+        monitor_task.cancel()
+        replication_task.cancel()
+        lease_task.cancel()
 
 def start_server():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((HOST, PORT))
-        s.listen()
-        print(f"[NameNode] Listening on {HOST}:{PORT}")
-        while True:
-            conn, addr = s.accept()
-            thread = threading.Thread(target=handle_client, args=(conn, addr))
-            thread.start()
+    try:
+        import uvloop
+        uvloop.install()
+        print("[NameNode] Using uvloop event loop")
+    except ImportError:
+        pass
+    asyncio.run(serve())
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NameNode server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--dead-node-timeout", type=float, default=DEAD_NODE_TIMEOUT,
+                        help="seconds without a heartbeat before a DataNode is declared dead")
+    parser.add_argument("--lease-timeout", type=float, default=LEASE_TIMEOUT,
+                        help="seconds a write lease survives without renewal")
+    parser.add_argument("--metrics-host", default=METRICS_HOST)
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="serve /metrics and /traces over HTTP on this port (0 disables it)")
+    parser.add_argument("--trace-file", help="append the spans of traced requests to this file as JSON lines")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="DEBUG logs every message received")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    HOST = args.host
+    PORT = args.port
+    METRICS_HOST = args.metrics_host
+    METRICS_PORT = args.metrics_port
+    tracer.configure(path=args.trace_file)
+    DEAD_NODE_TIMEOUT = args.dead_node_timeout
+    HEARTBEAT_CHECK_INTERVAL = min(HEARTBEAT_CHECK_INTERVAL, DEAD_NODE_TIMEOUT / 3)
+    replication_monitor = ReplicationMonitor(REPLICATION, MAX_REPLICATION_STREAMS, REPLICATION_TIMEOUT,
+                                             startup_delay=DEAD_NODE_TIMEOUT)
+    lease_manager = LeaseManager(args.lease_timeout)
+    LEASE_CHECK_INTERVAL = min(LEASE_CHECK_INTERVAL, args.lease_timeout / 3)
     load_metadata()
+    Checkpointer(edit_log, METADATA_FILE, apply_edit, CHECKPOINT_INTERVAL, CHECKPOINT_EDITS,
+                 decode=Namespace.from_snapshot, encode=Namespace.to_snapshot).start()
     start_server()
@@ -1,10 +1,8 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import os
-import socket, json
 import threading
-import time
-import math
+from client import DFSClient
 
 NAMENODE_HOST = '192.168.164.58'  # or the IP of the NameNode
 NAMENODE_PORT = 5000
@@ -17,6 +15,7 @@ class FileStorageClientGUI:
 
         self.selected_path = tk.StringVar()
         self.upload_history = []
+        self.client = DFSClient(NAMENODE_HOST, NAMENODE_PORT)
 
         # Set up UI
         self.create_widgets()
@@ -76,51 +75,6 @@ class FileStorageClientGUI:
         if folder_path:
             self.selected_path.set(folder_path)
 
-    def send_request(self, message):
-        """Send a request to the NameNode and get response"""
-        try:
-            # Update status
-            self.status_var.set(f"Connecting to NameNode...")
-            self.root.update_idletasks()
-            
-            # Create a new connection
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(10)  # 10-second timeout
-                s.connect((NAMENODE_HOST, NAMENODE_PORT))
-                
-                # Send the message
-                print(f"[DEBUG] Sending request to NameNode: {message}")
-                data = json.dumps(message).encode()
-                s.sendall(len(data).to_bytes(4, byteorder='big'))  # Send length prefix
-                s.sendall(data)  # Send the message
-                
-                # Receive response length
-                length_bytes = s.recv(4)
-                if not length_bytes:
-                    raise ConnectionError("Connection closed by server")
-                    
-                length = int.from_bytes(length_bytes, byteorder='big')
-                
-                # Receive response data
-                response_data = b''
-                remaining = length
-                while remaining > 0:
-                    chunk = s.recv(min(4096, remaining))
-                    if not chunk:
-                        raise ConnectionError("Connection closed by server")
-                    response_data += chunk
-                    remaining -= len(chunk)
-                
-                # Update status
-                self.status_var.set("Ready")
-                
-                return json.loads(response_data.decode())
-                
-        except Exception as e:
-            self.status_var.set(f"Error: {str(e)}")
-            messagebox.showerror("Connection Error", f"Failed to communicate with NameNode: {str(e)}")
-            return None
-
     def upload(self):
         path = self.selected_path.get()
         if not path:
@@ -131,8 +85,6 @@ class FileStorageClientGUI:
         
         if os.path.isfile(path):
             file_size = os.path.getsize(path)
-            chunk_size = 64 * 1024 * 1024  # 64 MB
-            num_chunks = math.ceil(file_size / chunk_size)
             
             # Show progress dialog
             progress_window = tk.Toplevel(self.root)
@@ -143,91 +95,19 @@ class FileStorageClientGUI:
             progress.pack(pady=10)
             status_label = tk.Label(progress_window, text="Requesting upload...")
             status_label.pack(pady=5)
+
+            def show_progress(sent, total):
+                percent = min(100, sent * 100 / total) if total else 100
+                text = f"Sent {sent // (1024 * 1024)} of {total // (1024 * 1024)} MB"
+                progress_window.after(0, lambda: (progress.config(value=percent), status_label.config(text=text)))
             
             # Run upload in background thread
             def do_upload():
                 try:
-                    # Step 1: Request upload from NameNode
-                    response = self.send_request({
-                        "action": "upload",
-                        "name": name,
-                        "filesize": file_size,
-                        "num_chunks": num_chunks
-                    })
-                    
-                    print(f"[DEBUG] NameNode response: {response}")
-
-                    if not response:
-                        progress_window.destroy()
-                        return
-                    
-                    if response.get("status") != "ok":
-                        progress_window.destroy()
-                        messagebox.showerror("Upload Error", response.get("message", "Unknown error"))
-                        return
-                    
-                    chunk_allocations = response.get("chunk_allocations", [])
-                    if not chunk_allocations or len(chunk_allocations) != num_chunks:
-                        progress_window.destroy()
-                        messagebox.showerror("Upload Error", "Invalid chunk allocation from NameNode")
-                        return
-                    
-                    print(f"[DEBUG] Chunk Allocations Sent to Client: {chunk_allocations}")
-
-                    # Step 2: Upload each chunk to the assigned DataNodes
-                    with open(path, 'rb') as f:
-                        for i, allocation in enumerate(chunk_allocations):
-                            chunk_data = f.read(chunk_size)
-                            chunk_id = allocation["chunk_id"]
-                            datanodes = allocation["datanodes"]
-                            
-                            for datanode in datanodes:
-                                try:
-                                    print(f"[DEBUG] Connecting to DataNode: {datanode['host']}:{datanode['port']}")
-                                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                                        s.settimeout(20)
-                                        s.connect((datanode['host'], datanode['port']))
-                                        
-                                        # Send metadata
-                                        metadata = json.dumps({
-                                            "message_type": "file_chunk",
-                                            "chunk_id": chunk_id,
-                                            "filename": name,
-                                            "chunk_index": i,
-                                            "chunk_size": len(chunk_data)
-                                        }).encode()
-                                        
-                                        s.sendall(len(metadata).to_bytes(4, byteorder='big'))
-                                        s.sendall(metadata)
-                                        s.sendall(chunk_data)
-                                        
-                                        # Get confirmation
-                                        resp_len = int.from_bytes(s.recv(4), byteorder='big')
-                                        resp = s.recv(resp_len).decode()
-                                        
-                                        if "success" not in resp.lower():
-                                            raise Exception(f"Chunk {i} upload failed to DataNode {datanode['host']}:{datanode['port']}: {resp}")
-                                
-                                except Exception as e:
-                                    print(f"[ERROR] Failed to upload chunk {i} to DataNode {datanode['host']}:{datanode['port']}: {e}")
-                                    raise
-                    
-                    # Step 3: Confirm upload with NameNode
-                    confirmation = self.send_request({
-                        "action": "upload_complete",
-                        "filename": name,
-                        "filesize": file_size
-                    })
-                    
-                    print(f"[DEBUG] Upload confirmation response: {confirmation}")
-
-                    if confirmation and confirmation.get("status") == "ok":
-                        self.upload_history.append((name, "File", file_size // 1024))
-                        self.history_tree.insert("", tk.END, values=(name, "File", file_size // 1024))
-                        messagebox.showinfo("Upload", f"'{name}' uploaded successfully.")
-                    else:
-                        messagebox.showerror("Upload Error", "Failed to confirm upload with NameNode")
-                
+                    self.client.put(path, "/" + name, progress=show_progress)
+                    self.upload_history.append((name, "File", file_size // 1024))
+                    self.history_tree.insert("", tk.END, values=(name, "File", file_size // 1024))
+                    messagebox.showinfo("Upload", f"'{name}' uploaded successfully.")
                 except Exception as e:
                     print(f"[ERROR] An error occurred during upload: {e}")
                     messagebox.showerror("Upload Error", f"An error occurred: {str(e)}")
@@ -239,7 +119,35 @@ class FileStorageClientGUI:
             
         else:
             # Handle folder upload
-            messagebox.showinfo("Not Implemented", "Folder upload not fully implemented yet.")
+            folder_size_kb = self.get_folder_size_kb(path)
+
+            progress_window = tk.Toplevel(self.root)
+            progress_window.title("Uploading")
+            progress_window.geometry("300x150")
+            tk.Label(progress_window, text=f"Uploading folder {name}...").pack(pady=10)
+            progress = ttk.Progressbar(progress_window, orient="horizontal", length=250, mode="determinate")
+            progress.pack(pady=10)
+            status_label = tk.Label(progress_window, text="Requesting upload...")
+            status_label.pack(pady=5)
+
+            def show_progress(sent, total):
+                percent = min(100, sent * 100 / total) if total else 100
+                text = f"Sent {sent // (1024 * 1024)} of {total // (1024 * 1024)} MB"
+                progress_window.after(0, lambda: (progress.config(value=percent), status_label.config(text=text)))
+
+            def do_upload_folder():
+                try:
+                    uploaded = self.client.put(path, "/" + name, progress=show_progress)
+                    self.upload_history.append((name, "Folder", folder_size_kb))
+                    self.history_tree.insert("", tk.END, values=(name, "Folder", folder_size_kb))
+                    messagebox.showinfo("Upload", f"Folder '{name}' uploaded successfully ({len(uploaded)} files).")
+                except Exception as e:
+                    print(f"[ERROR] An error occurred during folder upload: {e}")
+                    messagebox.showerror("Upload Error", f"An error occurred: {str(e)}")
+                finally:
+                    progress_window.destroy()
+
+            threading.Thread(target=do_upload_folder, daemon=True).start()
 
     def download(self):
         selected = self.history_tree.focus()
@@ -249,6 +157,9 @@ class FileStorageClientGUI:
 
         file_info = self.history_tree.item(selected)["values"]
         filename = file_info[0]
+        if file_info[1] == "Folder":
+            messagebox.showinfo("Not Implemented", "Folder download not implemented yet.")
+            return
 
         # Ask user where to save the file
         save_path = filedialog.asksaveasfilename(
@@ -269,86 +180,20 @@ class FileStorageClientGUI:
         status_label = tk.Label(progress_window, text="Requesting file location...")
         status_label.pack(pady=5)
         
+        def show_progress(received, total):
+            percent = min(100, received * 100 / total) if total else 100
+            progress_window.after(0, lambda: progress.config(value=percent))
+
         # Run download in background thread
         def do_download():
             try:
-                # Step 1: Request file metadata from NameNode
-                response = self.send_request({
-                    "action": "download",
-                    "name": filename
-                })
-                
-                if not response:
-                    progress_window.destroy()
-                    return
-                    
-                if response.get("status") != "ok":
-                    progress_window.destroy()
-                    messagebox.showerror("Download Error", response.get("message", "File not found"))
-                    return
-                
-                # Step 2: Get chunk information
-                chunks = response.get("chunks", [])
-                if not chunks:
-                    progress_window.destroy()
-                    messagebox.showerror("Download Error", "No chunk information available")
-                    return
-                
-                # Step 3: Download each chunk and reconstruct the file
-                with open(save_path, 'wb') as f:
-                    for i, chunk in enumerate(chunks):
-                        chunk_id = chunk["chunk_id"]
-                        datanodes = chunk["datanodes"]
-                        
-                        # Try downloading from the first available DataNode
-                        success = False
-                        for datanode in datanodes:
-                            try:
-                                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                                    s.connect((datanode["host"], datanode["port"]))
-                                    
-                                    # Request the chunk
-                                    request = json.dumps({
-                                        "message_type": "get_file",
-                                        "chunk_id": chunk_id
-                                    }).encode()
-                                    
-                                    s.sendall(len(request).to_bytes(4, byteorder='big'))  # Send request length
-                                    s.sendall(request)  # Send request
-                                    
-                                    # Get chunk size
-                                    size_bytes = s.recv(8)
-                                    chunk_size = int.from_bytes(size_bytes, byteorder='big')
-                                    
-                                    # Download chunk data
-                                    bytes_received = 0
-                                    while bytes_received < chunk_size:
-                                        chunk_data = s.recv(min(8192, chunk_size - bytes_received))
-                                        if not chunk_data:
-                                            raise ConnectionError("DataNode disconnected during chunk download")
-                                        f.write(chunk_data)
-                                        bytes_received += len(chunk_data)
-                                    
-                                    success = True
-                                    break  # Exit loop if chunk is successfully downloaded
-                            except Exception as e:
-                                print(f"[ERROR] Failed to download chunk {chunk_id} from {datanode['host']}:{datanode['port']}: {e}")
-                        
-                        if not success:
-                            progress_window.destroy()
-                            messagebox.showerror("Download Error", f"Failed to download chunk {chunk_id}")
-                            return
-                        
-                        # Update progress
-                        progress_window.after(0, lambda: progress.config(value=((i + 1) / len(chunks)) * 100))
-                
-                # Close progress dialog
-                progress_window.destroy()
+                self.client.get("/" + filename, save_path, progress=show_progress)
                 messagebox.showinfo("Download Complete", f"'{filename}' downloaded successfully.")
-            
             except Exception as e:
-                progress_window.destroy()
+                print(f"[ERROR] An error occurred during download: {e}")
                 messagebox.showerror("Download Error", f"An error occurred: {str(e)}")
+            finally:
+                progress_window.destroy()
         
         # Start download thread
         threading.Thread(target=do_download, daemon=True).start()
@@ -0,0 +1,98 @@
+"""Cost of per-chunk checksums on the write and read paths.
+
+Reports raw CRC throughput for each available algorithm, the DataNode's
+receive-and-write loop with and without streaming checksums, and a
+DownloadEngine read from a loopback DataNode with and without verification.
+
+    python benchmarks/bench_checksum.py [--file-mb 256] [--chunk-mb 64] [--reads 3]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, start_datanode, stop  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+from checksum import ALGORITHMS, BYTES_PER_CHECKSUM, StreamingChecksum, write_sidecar  # noqa: E402
+from transfer import BUFFER_SIZE, DownloadEngine  # noqa: E402
+
+
+def crc_throughput(data, algorithm):
+    crc = ALGORITHMS[algorithm]
+    view = memoryview(data)
+    start = time.perf_counter()
+    for i in range(0, len(data), BYTES_PER_CHECKSUM):
+        crc(view[i:i + BYTES_PER_CHECKSUM])
+    return len(data) / (time.perf_counter() - start)
+
+
+def write_loop(data, path, checksum):
+    """The DataNode's store loop minus the socket: BUFFER_SIZE writes, optionally checksummed."""
+    view = memoryview(data)
+    start = time.perf_counter()
+    with open(path, "wb") as f:
+        state = StreamingChecksum() if checksum else None
+        for i in range(0, len(data), BUFFER_SIZE):
+            f.write(view[i:i + BUFFER_SIZE])
+            if state:
+                state.update(view[i:i + BUFFER_SIZE])
+        if state:
+            state.finish()
+    return len(data) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--file-mb", type=int, default=256)
+    parser.add_argument("--chunk-mb", type=int, default=64)
+    parser.add_argument("--reads", type=int, default=3)
+    args = parser.parse_args()
+    file_size = args.file_mb * 1024 * 1024
+    chunk_size = args.chunk_mb * 1024 * 1024
+    num_chunks = -(-file_size // chunk_size)
+    data = os.urandom(file_size)
+
+    for algorithm in ALGORITHMS:
+        print(f"{algorithm + ' raw':<32} {crc_throughput(data, algorithm) / 1e6:>9.1f} MB/s")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "write.bin")
+        for label, checksum in (("write loop, no checksums", False), ("write loop, streaming checksums", True)):
+            rates = [write_loop(data, path, checksum) for _ in range(args.reads)]
+            print(f"{label:<32} {max(rates) / 1e6:>9.1f} MB/s")
+
+        storage = os.path.join(workdir, "dn")
+        os.makedirs(storage)
+        for i in range(num_chunks):
+            chunk = data[i * chunk_size:(i + 1) * chunk_size]
+            chunk_path = os.path.join(storage, f"bench_chunk_{i}")
+            with open(chunk_path, "wb") as f:
+                f.write(chunk)
+            checksum = StreamingChecksum()
+            checksum.update(chunk)
+            write_sidecar(chunk_path, checksum.finish())
+
+        proc, port = start_datanode(storage, extra_args=["--scrub-rate", "0"])
+        try:
+            def request(message):
+                chunks = [{"chunk_id": f"bench_chunk_{i}", "datanodes": [{"host": "127.0.0.1", "port": port}]}
+                          for i in range(num_chunks)]
+                return {"status": "ok", "size": file_size, "chunk_size": chunk_size, "chunks": chunks}
+
+            out = os.path.join(workdir, "out.bin")
+            for label, verify in (("download, no verification", False), ("download, verified", True)):
+                rates = []
+                for _ in range(args.reads):
+                    start = time.perf_counter()
+                    DownloadEngine(request, verify=verify).download("bench", out)
+                    rates.append(file_size / (time.perf_counter() - start))
+                print(f"{label:<32} {max(rates) / 1e6:>9.1f} MB/s")
+        finally:
+            stop(proc)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Zipfian chunk reads with and without the DataNode's hot-chunk cache.
+
+Two parts:
+
+  policy    ChunkCache (TinyLFU admission over a segmented LRU) against a
+            plain LRU of the same byte budget, replaying a Zipf-distributed
+            trace of --chunks chunks with a one-off sequential scan of
+            --scan-chunks cold chunks every --scan-every reads
+  datanode  one loopback DataNode serving the same kind of trace to
+            --clients concurrent readers, once without a cache and once
+            with --cache-mb; hit rates come from the DataNode's heartbeats,
+            which a stub NameNode records. With --evict-page-cache the chunk
+            files are dropped from the OS page cache every 100 reads, as
+            they would be on a busy node whose RAM is taken by other data
+
+    python benchmarks/bench_chunk_cache.py [--chunks 200] [--chunk-mb 4] [--cache-mb 64] [--reads 4000] [--skew 1.0]
+"""
+import argparse
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, free_port, start_datanode, stop, wait_for_port  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+from checksum import StreamingChecksum, write_sidecar  # noqa: E402
+from chunkcache import ChunkCache  # noqa: E402
+from protocol import default_pool, recv_exact, recv_message, send_message  # noqa: E402
+
+
+class LRUCache:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.used = 0
+
+    def access(self, key, size):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return True
+        self.entries[key] = size
+        self.used += size
+        while self.used > self.capacity:
+            self.used -= self.entries.popitem(last=False)[1]
+        return False
+
+
+def trace(args, seed):
+    """Chunk IDs to read: Zipf-popular chunks interrupted by scans of chunks read only once."""
+    rng = random.Random(seed)
+    popular = [f"hot_{i}" for i in range(args.chunks)]
+    weights = [1 / (rank + 1) ** args.skew for rank in range(args.chunks)]
+    reads = []
+    scanned = 0
+    while len(reads) < args.reads:
+        reads += rng.choices(popular, weights, k=args.scan_every)
+        reads += [f"cold_{scanned + i}" for i in range(args.scan_chunks)]
+        scanned += args.scan_chunks
+    return reads[:args.reads], scanned
+
+
+def run_policy(args):
+    chunk_size = args.chunk_mb * 1024 * 1024
+    reads, _ = trace(args, 1)
+    lru = LRUCache(args.cache_mb * 1024 * 1024)
+    lru_hits = sum(lru.access(key, chunk_size) for key in reads)
+    cache = ChunkCache(args.cache_mb * 1024 * 1024)
+    for key in reads:
+        if cache.get(key) is None and cache.should_load(key, chunk_size):
+            cache.put(key, None, chunk_size)
+    stats = cache.stats()
+    print(f"policy: {len(reads)} reads, {args.cache_mb} MB budget "
+          f"({args.cache_mb // args.chunk_mb} of {args.chunks} hot chunks)")
+    print(f"  {'LRU':<10} hit rate {lru_hits / len(reads):6.1%}")
+    print(f"  {'TinyLFU':<10} hit rate {stats['hit_rate']:6.1%}  "
+          f"(admitted {stats['admitted']}, rejected {stats['rejected']}, evicted {stats['evicted']})")
+
+
+def stub_namenode(port, heartbeats):
+    """Accepts heartbeats and keeps the latest one; there is no namespace to check reports against."""
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", port))
+    srv.listen()
+
+    def serve(conn):
+        with conn:
+            while True:
+                message = recv_message(conn)
+                if message is None:
+                    return
+                heartbeats.append(message)
+                send_message(conn, {"status": "success", "request_id": message.get("request_id")})
+
+    def accept_loop():
+        while True:
+            conn, _ = srv.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+    threading.Thread(target=accept_loop, daemon=True).start()
+
+
+def read_chunk(port, chunk_id):
+    with default_pool.connection("127.0.0.1", port, 20) as s:
+        send_message(s, {"message_type": "get_file", "chunk_id": chunk_id})
+        length = int.from_bytes(recv_exact(s, 8), byteorder='big')
+        recv_exact(s, length)
+    return length
+
+
+def run_datanode(args, storage_dir, reads, cache_mb):
+    namenode_port = free_port()
+    heartbeats = []
+    stub_namenode(namenode_port, heartbeats)
+    wait_for_port(namenode_port)
+    proc, port = start_datanode(storage_dir, namenode_port=namenode_port,
+                                extra_args=["--heartbeat-interval", "0.5", "--scrub-rate", "0",
+                                            "--cache-mb", str(cache_mb)])
+    files = [entry.path for entry in os.scandir(storage_dir)]
+    position = 0
+    lock = threading.Lock()
+    total = 0
+
+    def client():
+        nonlocal position, total
+        while True:
+            with lock:
+                if position >= len(reads):
+                    return
+                chunk_id = reads[position]
+                position += 1
+                if args.evict_page_cache and position % 100 == 0:
+                    for path in files:
+                        with open(path, "rb") as f:
+                            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+            n = read_chunk(port, chunk_id)
+            with lock:
+                total += n
+
+    try:
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(args.clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        time.sleep(1.5)  # One more heartbeat with the final counters
+        cache = next((hb["cache"] for hb in reversed(heartbeats) if "cache" in hb), None)
+        hit_rate = f"{cache['hit_rate']:.1%}" if cache else "-"
+        label = f"cache {cache_mb} MB" if cache_mb else "no cache"
+        print(f"  {label:<14} {len(reads) / elapsed:8.0f} reads/s {total / elapsed / 1e6:9.1f} MB/s  hit rate {hit_rate}")
+    finally:
+        stop(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=200, help="popular chunks")
+    parser.add_argument("--chunk-mb", type=int, default=4)
+    parser.add_argument("--cache-mb", type=int, default=64)
+    parser.add_argument("--reads", type=int, default=4000)
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of chunk popularity")
+    parser.add_argument("--scan-every", type=int, default=200, help="popular reads between scans")
+    parser.add_argument("--scan-chunks", type=int, default=20, help="cold chunks read by each scan")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--evict-page-cache", action="store_true")
+    args = parser.parse_args()
+
+    run_policy(args)
+
+    reads, scanned = trace(args, 2)
+    chunk_size = args.chunk_mb * 1024 * 1024
+    with tempfile.TemporaryDirectory() as storage_dir:
+        for chunk_id in [f"hot_{i}" for i in range(args.chunks)] + [f"cold_{i}" for i in range(scanned)]:
+            data = os.urandom(chunk_size)
+            path = os.path.join(storage_dir, chunk_id)
+            with open(path, "wb") as f:
+                f.write(data)
+            checksum = StreamingChecksum()
+            checksum.update(data)
+            write_sidecar(path, checksum.finish())
+        print(f"datanode: {len(reads)} reads of {args.chunk_mb} MB chunks by {args.clients} clients"
+              f"{', page cache evicted every 100 reads' if args.evict_page_cache else ''}")
+        for cache_mb in (0, args.cache_mb):
+            run_datanode(args, storage_dir, reads, cache_mb)
+
+
+if __name__ == "__main__":
+    main()
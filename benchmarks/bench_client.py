@@ -0,0 +1,90 @@
+"""End-to-end client throughput, driven through the `dfs` CLI.
+
+Starts a loopback NameNode and --datanodes DataNodes, then times
+`dfs.py put`, `dfs.py get` and `dfs.py get ... -` (a sequential read through
+the prefetching stream API, written to stdout) on a --file-mb random file,
+each in a fresh process as a user would run them. Each transfer is checked
+against the source by SHA-256.
+
+    python benchmarks/bench_client.py [--datanodes 3] [--file-mb 256] [--chunk-mb 16] [--runs 3]
+"""
+import argparse
+import hashlib
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, start_datanode, start_namenode, stop  # noqa: E402
+
+DFS = os.path.join(REPO_DIR, "dfs.py")
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def dfs(namenode, args, **kwargs):
+    """Run one dfs.py command and return (seconds, completed process)."""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, DFS, "--namenode", namenode, *args], check=True, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--datanodes", type=int, default=3)
+    parser.add_argument("--file-mb", type=int, default=256)
+    parser.add_argument("--chunk-mb", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        namenode, port = start_namenode(workdir)
+        datanodes = [start_datanode(os.path.join(workdir, f"dn{i}"), namenode_port=port)[0]
+                     for i in range(args.datanodes)]
+        try:
+            time.sleep(2)  # First heartbeats
+            address = f"127.0.0.1:{port}"
+            options = ["--chunk-mb", str(args.chunk_mb), "--workers", str(args.workers)]
+            src = os.path.join(workdir, "src.bin")
+            with open(src, "wb") as f:
+                for _ in range(args.file_mb):
+                    f.write(os.urandom(1024 * 1024))
+            expected = sha256_file(src)
+            size = os.path.getsize(src)
+            dst = os.path.join(workdir, "dst.bin")
+
+            times = {"put": [], "get": [], "stream": []}
+            for run in range(args.runs):
+                remote = f"/bench/run{run}.bin"
+                elapsed, _ = dfs(address, options + ["put", src, remote])
+                times["put"].append(elapsed)
+                elapsed, _ = dfs(address, options + ["get", remote, dst])
+                times["get"].append(elapsed)
+                assert sha256_file(dst) == expected, "get returned different bytes"
+                elapsed, result = dfs(address, options + ["get", remote, "-"], stdout=subprocess.PIPE)
+                times["stream"].append(elapsed)
+                assert hashlib.sha256(result.stdout).hexdigest() == expected, "stream returned different bytes"
+
+            print(f"{args.file_mb} MB file, {args.chunk_mb} MB chunks, {args.datanodes} DataNodes, "
+                  f"{args.workers} workers, median of {args.runs} runs (includes process start-up)")
+            for name, samples in times.items():
+                median = statistics.median(samples)
+                print(f"  {name:<7} {median:7.2f}s  {size / median / 1e6:8.1f} MB/s")
+        finally:
+            for proc in datanodes:
+                stop(proc)
+            stop(namenode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+"""End-to-end cluster benchmarks with JSON results, for comparing commits.
+
+Each workload runs against a fresh loopback cluster: a NameNode and
+--datanodes DataNodes, each process with its own port and storage
+directory (see localcluster.py).
+
+  small_files      --small-files files of --small-kb KB put, then read back,
+                   by --clients threads: files/s and per-file latency
+  large_files      --large-files files of --large-mb MB put and read back one
+                   at a time: MB/s
+  mixed            --clients writers of --mixed-kb KB files and as many readers
+                   of files written beforehand, for --duration seconds
+  heartbeat_storm  the latency of NameNode metadata requests (ls, file
+                   lookups) for --duration seconds with only the real
+                   DataNodes' heartbeats, then with --fake-datanodes more
+                   nodes heartbeating back to back from --storm-threads
+                   threads
+  datanode_failure a --failure-mb file is being written when one DataNode is
+                   killed. The harness records whether that write survives,
+                   how long until a retried write succeeds, and how long
+                   until the files written before the crash are fully
+                   replicated again
+
+Every workload also records the NameNode's CPU time, CPU use and resident
+memory (from /proc, on Linux). Results go to --output as JSON along with
+the commit they were measured on; --compare prints how they differ from
+an earlier run's file.
+
+    python benchmarks/bench_cluster.py [--workloads small_files,large_files] [--output results.json]
+    python benchmarks/bench_cluster.py --compare before.json --output after.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, kill, process_usage, start_datanode, start_namenode, stop  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+from client import DFSClient  # noqa: E402
+from protocol import recv_message, send_message  # noqa: E402
+from transfer import TransferError  # noqa: E402
+
+WORKLOADS = ["small_files", "large_files", "mixed", "heartbeat_storm", "datanode_failure"]
+REPLICATION = 2
+
+
+def latency_summary(seconds):
+    """Count and p50/p99/max in milliseconds of a list of latencies in seconds."""
+    if not seconds:
+        return {"count": 0}
+    ms = sorted(s * 1000 for s in seconds)
+    return {"count": len(ms), "p50_ms": round(statistics.median(ms), 3),
+            "p99_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.99))], 3), "max_ms": round(ms[-1], 3)}
+
+
+class Cluster:
+    """A NameNode and DataNodes on loopback, stopped on exit."""
+
+    def __init__(self, workdir, datanodes, namenode_args=(), datanode_args=()):
+        self.workdir = workdir
+        self.namenode, self.port = start_namenode(workdir, extra_args=namenode_args)
+        self.datanodes = {}  # port -> process
+        for i in range(datanodes):
+            proc, port = start_datanode(os.path.join(workdir, f"dn{i}"), namenode_port=self.port,
+                                        extra_args=datanode_args)
+            self.datanodes[port] = proc
+
+    def client(self, **kwargs):
+        return DFSClient("127.0.0.1", self.port, **kwargs)
+
+    def kill_datanode(self, port):
+        kill(self.datanodes.pop(port))
+
+    def close(self):
+        for proc in self.datanodes.values():
+            stop(proc)
+        stop(self.namenode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@contextlib.contextmanager
+def namenode_usage(cluster, result):
+    """Record the NameNode's CPU time, CPU share and memory over the block into result["namenode"]."""
+    before = process_usage(cluster.namenode)
+    start = time.perf_counter()
+    yield
+    after = process_usage(cluster.namenode)
+    if before is not None and after is not None:
+        cpu = after["cpu_seconds"] - before["cpu_seconds"]
+        result["namenode"] = {"cpu_seconds": round(cpu, 3),
+                              "cpu_percent": round(100 * cpu / (time.perf_counter() - start), 1),
+                              "rss_mb": round(after["rss_bytes"] / 2**20, 1),
+                              "peak_rss_mb": round(after["peak_rss_bytes"] / 2**20, 1)}
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def put(client, path, data):
+    client.put_stream(io.BytesIO(data), path)
+
+
+def read(client, path):
+    with client.open(path) as f:
+        return f.read()
+
+
+def run_small_files(cluster, args):
+    client = cluster.client()
+    data = os.urandom(args.small_kb * 1024)
+    paths = [f"/small/{i // 1000}/{i}" for i in range(args.small_files)]
+    result = {"files": args.small_files, "file_kb": args.small_kb, "clients": args.clients}
+    with namenode_usage(cluster, result), ThreadPoolExecutor(max_workers=args.clients) as pool:
+        start = time.perf_counter()
+        puts = list(pool.map(lambda path: timed(put, client, path, data), paths))
+        put_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        gets = list(pool.map(lambda path: timed(read, client, path), paths))
+        get_elapsed = time.perf_counter() - start
+    result["put"] = {"files_per_s": round(len(paths) / put_elapsed, 1), **latency_summary(puts)}
+    result["get"] = {"files_per_s": round(len(paths) / get_elapsed, 1), **latency_summary(gets)}
+    return result
+
+
+def run_large_files(cluster, args):
+    client = cluster.client()
+    source = os.path.join(cluster.workdir, "large.bin")
+    with open(source, "wb") as f:
+        for _ in range(args.large_mb):
+            f.write(os.urandom(2**20))
+    size = args.large_mb * 2**20
+    result = {"files": args.large_files, "file_mb": args.large_mb}
+    puts, gets = [], []
+    with namenode_usage(cluster, result):
+        for i in range(args.large_files):
+            puts.append(timed(client.put, source, f"/large/{i}"))
+            gets.append(timed(client.get, f"/large/{i}", os.path.join(cluster.workdir, "copy.bin")))
+            os.remove(os.path.join(cluster.workdir, "copy.bin"))
+    result["put"] = {"mb_per_s": round(size * len(puts) / sum(puts) / 1e6, 1), **latency_summary(puts)}
+    result["get"] = {"mb_per_s": round(size * len(gets) / sum(gets) / 1e6, 1), **latency_summary(gets)}
+    return result
+
+
+def run_mixed(cluster, args):
+    client = cluster.client()
+    data = os.urandom(args.mixed_kb * 1024)
+    existing = [f"/mixed/seed/{i}" for i in range(max(args.clients * 4, 16))]
+    for path in existing:
+        put(client, path, data)
+    latencies = {"put": [], "get": []}
+    stop = threading.Event()
+    errors = []
+
+    def writer(n):
+        i = 0
+        while not stop.is_set():
+            latencies["put"].append(timed(put, client, f"/mixed/w{n}/{i}", data))
+            i += 1
+
+    def reader(n):
+        rng = random.Random(n)
+        while not stop.is_set():
+            latencies["get"].append(timed(read, client, rng.choice(existing)))
+
+    def guarded(fn, n):
+        try:
+            fn(n)
+        except Exception as e:
+            errors.append(repr(e))
+            stop.set()
+
+    result = {"writers": args.clients, "readers": args.clients, "file_kb": args.mixed_kb, "duration_s": args.duration}
+    with namenode_usage(cluster, result):
+        threads = [threading.Thread(target=guarded, args=(fn, n)) for fn in (writer, reader) for n in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    for kind, seconds in latencies.items():
+        result[kind] = {"ops_per_s": round(len(seconds) / args.duration, 1),
+                        "mb_per_s": round(len(seconds) * len(data) / args.duration / 1e6, 2), **latency_summary(seconds)}
+    if errors:
+        result["errors"] = errors[:5]
+    return result
+
+
+def metadata_latencies(client, duration):
+    """Latencies of alternating ls and file-lookup requests made back to back for `duration` seconds."""
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        client.request({"action": "ls", "path": "/storm"})
+        client.request({"action": "download", "name": "/storm/file"})
+        latencies.append((time.perf_counter() - start) / 2)
+    return latencies
+
+
+def heartbeat_storm(port, nodes, stop, sent):
+    """Heartbeat as each of `nodes` (fake (host, port) pairs) in turn on one connection until `stop` is set."""
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        reported = set()
+        while not stop.is_set():
+            for host, fake_port in nodes:
+                message = {"action": "heartbeat", "datanode_host": host, "datanode_port": fake_port,
+                           "capacity_bytes": 2**40, "used_bytes": 0, "free_bytes": 2**40, "inflight": 0,
+                           "throughput": 0, "block_report": None}
+                if (host, fake_port) not in reported:
+                    message["block_report"] = {"full": True, "chunks": []}
+                    reported.add((host, fake_port))
+                send_message(s, message)
+                recv_message(s)
+                sent[0] += 1
+                if stop.is_set():
+                    return
+
+
+def run_heartbeat_storm(cluster, args):
+    client = cluster.client()
+    put(client, "/storm/file", os.urandom(4096))
+    result = {"fake_datanodes": args.fake_datanodes, "threads": args.storm_threads, "duration_s": args.duration}
+    result["quiet"] = latency_summary(metadata_latencies(client, args.duration / 2))
+    # Fake nodes advertise addresses nothing listens on; this workload never writes after they register
+    nodes = [(f"127.1.{i // 250}.{i % 250 + 1}", 9) for i in range(args.fake_datanodes)]
+    stop, sent = threading.Event(), [0]
+    with namenode_usage(cluster, result):
+        threads = [threading.Thread(target=heartbeat_storm, args=(cluster.port, nodes[i::args.storm_threads], stop,
+                                                                  sent))
+                   for i in range(args.storm_threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        latencies = metadata_latencies(client, args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    result["storm"] = latency_summary(latencies)
+    result["heartbeats_per_s"] = round(sent[0] / elapsed, 1)
+    return result
+
+
+def replica_counts(client, path):
+    response = client.request({"action": "download", "name": path})
+    return [len(chunk["datanodes"]) for chunk in response["chunks"]]
+
+
+def run_datanode_failure(cluster, args):
+    chunk_size = 4 * 2**20
+    client = cluster.client(chunk_size=chunk_size)
+    before = [os.urandom(args.failure_mb * 2**20 // 4) for _ in range(4)]
+    for i, data in enumerate(before):
+        put(client, f"/failure/before/{i}", data)
+    time.sleep(args.heartbeat_interval * 3)  # Block reports of the chunks written so far
+    data = os.urandom(args.failure_mb * 2**20)
+    victim = random.Random(0).choice(sorted(cluster.datanodes))
+    killed = []
+
+    def progress(sent, total):
+        if not killed and sent >= len(data) * 0.3:
+            killed.append(time.perf_counter())
+            cluster.kill_datanode(victim)
+
+    result = {"datanodes": args.datanodes, "file_mb": args.failure_mb, "dead_node_timeout_s": args.dead_node_timeout}
+    with namenode_usage(cluster, result):
+        start = time.perf_counter()
+        try:
+            client.put_stream(io.BytesIO(data), "/failure/during", progress=progress)
+            result["write_during_failure"] = {"ok": True, "seconds": round(time.perf_counter() - start, 3)}
+        except TransferError as e:
+            result["write_during_failure"] = {"ok": False, "seconds": round(time.perf_counter() - start, 3),
+                                              "error": str(e)}
+        # Retry as an application would until a write succeeds (the NameNode still places replicas
+        # on the dead node until it is declared dead)
+        attempts = 1
+        while not result["write_during_failure"]["ok"]:
+            attempts += 1
+            try:
+                put(client, "/failure/during", data)
+                break
+            except TransferError:
+                if time.perf_counter() - killed[0] > args.max_wait:
+                    raise
+                time.sleep(0.5)
+        result["written_after_s"] = round(time.perf_counter() - killed[0], 3)
+        result["attempts"] = attempts
+        while min(min(replica_counts(client, f"/failure/before/{i}")) for i in range(len(before))) < REPLICATION:
+            if time.perf_counter() - killed[0] > args.max_wait:
+                result["rereplicated_after_s"] = None
+                break
+            time.sleep(0.2)
+        else:
+            result["rereplicated_after_s"] = round(time.perf_counter() - killed[0], 3)
+    result["data_intact"] = (read(client, "/failure/during") == data
+                             and all(read(client, f"/failure/before/{i}") == d for i, d in enumerate(before)))
+    return result
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def flatten(value, prefix=""):
+    """{"a.b.c": number} for every number in nested dicts."""
+    if isinstance(value, dict):
+        return {k: v for key, child in value.items() for k, v in flatten(child, f"{prefix}{key}.").items()}
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix[:-1]: value}
+    return {}
+
+
+def compare(old, new):
+    """Print each number of both runs' workloads with its change."""
+    print(f"compared with {old.get('commit', '?')[:12]} ({old.get('timestamp', '?')})")
+    old_values, new_values = flatten(old["workloads"]), flatten(new["workloads"])
+    width = max(map(len, new_values), default=10)
+    for key, value in new_values.items():
+        if key not in old_values:
+            continue
+        before = old_values[key]
+        change = f"{(value - before) / before:+8.1%}" if before else ""
+        print(f"  {key:<{width}} {before:>12} {value:>12} {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help=f"comma-separated subset of {WORKLOADS}")
+    parser.add_argument("--datanodes", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=8, help="threads of concurrent clients")
+    parser.add_argument("--small-files", type=int, default=1000)
+    parser.add_argument("--small-kb", type=int, default=4)
+    parser.add_argument("--large-files", type=int, default=2)
+    parser.add_argument("--large-mb", type=int, default=256)
+    parser.add_argument("--mixed-kb", type=int, default=1024)
+    parser.add_argument("--duration", type=float, default=10, help="seconds of the timed workloads")
+    parser.add_argument("--fake-datanodes", type=int, default=500)
+    parser.add_argument("--storm-threads", type=int, default=8)
+    parser.add_argument("--failure-mb", type=int, default=64)
+    parser.add_argument("--heartbeat-interval", type=float, default=1)
+    parser.add_argument("--dead-node-timeout", type=float, default=6)
+    parser.add_argument("--max-wait", type=float, default=120, help="give up on recovery after this many seconds")
+    parser.add_argument("--output", help="write the results here as JSON (default: stdout)")
+    parser.add_argument("--compare", metavar="JSON", help="results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    commit, dirty = git_commit()
+    results = {"commit": commit, "dirty": dirty, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+               "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+               "args": vars(args), "workloads": {}}
+    runners = {"small_files": run_small_files, "large_files": run_large_files, "mixed": run_mixed,
+               "heartbeat_storm": run_heartbeat_storm, "datanode_failure": run_datanode_failure}
+    for name in args.workloads.split(","):
+        if name not in runners:
+            parser.error(f"unknown workload {name!r}; choose from {WORKLOADS}")
+        with tempfile.TemporaryDirectory() as workdir, \
+                Cluster(workdir, args.datanodes, ["--dead-node-timeout", str(args.dead_node_timeout)],
+                        ["--heartbeat-interval", str(args.heartbeat_interval)]) as cluster:
+            time.sleep(args.heartbeat_interval * 2)  # First heartbeats register the DataNodes
+            print(f"[bench] {name}...", file=sys.stderr)
+            # The client's messages would end up in the JSON on stdout; workloads run threads, so redirect once
+            with contextlib.redirect_stdout(sys.stderr):
+                results["workloads"][name] = runners[name](cluster, args)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
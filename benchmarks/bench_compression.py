@@ -0,0 +1,155 @@
+"""Chunk compression: codec ratios and speeds, the worker pool, and end-to-end transfers.
+
+  codecs   compressed size and compress/decompress MB/s (one core) of each
+           installed codec on COMPRESSION_FRAME frames of several kinds of
+           data, with the sampled ratio and the codec "auto" picks for it
+  pool     compressing one --chunk-mb chunk of text frame by frame in this
+           thread against a pool of --workers processes
+  cluster  a loopback NameNode and 3 DataNodes; a --file-mb text file is put
+           and read back with and without --compress auto, reporting MB/s
+           and the bytes the DataNodes store
+
+    python benchmarks/bench_compression.py [--chunk-mb 16] [--file-mb 64] [--workers N]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, start_datanode, start_namenode, stop  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+from client import DFSClient  # noqa: E402
+from compression import (CODECS, COMPRESSION_FRAME, choose_codec, compress_frame, decompress_frame,  # noqa: E402
+                         sample_ratio)
+
+
+def log_lines(size, seed=1):
+    """Application-log-like text: repetitive structure, varying numbers."""
+    rng = random.Random(seed)
+    levels = [b"INFO", b"INFO", b"INFO", b"DEBUG", b"WARN"]
+    lines = []
+    total = 0
+    while total < size:
+        line = b"2026-10-%02d %02d:%02d:%02d %s request=%08x latency_ms=%d path=/api/v1/items/%d\n" % (
+            rng.randint(1, 28), rng.randrange(24), rng.randrange(60), rng.randrange(60), rng.choice(levels),
+            rng.getrandbits(32), rng.randrange(2000), rng.randrange(100000))
+        lines.append(line)
+        total += len(line)
+    return b"".join(lines)[:size]
+
+
+def datasets(size):
+    text = log_lines(size)
+    return {
+        "log text": text,
+        "random": os.urandom(size),
+        "half random": text[:size // 2] + os.urandom(size - size // 2),
+        "zeros": bytes(size),
+    }
+
+
+def rate(fn, nbytes, min_seconds=0.2):
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return nbytes * runs / elapsed / 1e6
+
+
+def run_codecs():
+    print(f"codecs: {COMPRESSION_FRAME >> 20} MB frames, one core")
+    print(f"  {'data':<12} {'sampled':>8} {'auto':<10} {'codec':<9} {'ratio':>6} {'comp MB/s':>10} {'decomp MB/s':>12}")
+    for label, data in datasets(COMPRESSION_FRAME).items():
+        ratio = sample_ratio(lambda view, position: data[position:position + len(view)], len(data))
+        choice = choose_codec(ratio)
+        sampled, auto = f"{ratio:.2f}", f"{choice[0]}-{choice[1]}" if choice else "raw"
+        for name, (_, _, fast, strong) in CODECS.items():
+            for level in sorted({fast, strong}):
+                frame = compress_frame(name, level, data)
+                comp = rate(lambda: compress_frame(name, level, data), len(data))
+                decomp = rate(lambda: decompress_frame(name, frame, len(data)), len(data))
+                print(f"  {label:<12} {sampled:>8} {auto:<10} {f'{name}-{level}':<9} {len(frame) / len(data):6.2f} "
+                      f"{comp:10.0f} {decomp:12.0f}")
+                label = sampled = auto = ""  # Only on the first row of each kind of data
+
+
+def run_pool(args):
+    chunk = log_lines(args.chunk_mb * 1024 * 1024, seed=2)
+    frames = [chunk[i:i + COMPRESSION_FRAME] for i in range(0, len(chunk), COMPRESSION_FRAME)]
+    name, level = choose_codec(0.0)
+    print(f"pool: one {args.chunk_mb} MB chunk of log text with {name}-{level}, {os.cpu_count()} CPUs")
+
+    start = time.perf_counter()
+    for frame in frames:
+        compress_frame(name, level, frame)
+    print(f"  {'this thread':<16} {len(chunk) / (time.perf_counter() - start) / 1e6:8.0f} MB/s")
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        list(pool.map(compress_frame, [name] * args.workers, [level] * args.workers, frames))  # Start the workers
+        start = time.perf_counter()
+        list(pool.map(compress_frame, [name] * len(frames), [level] * len(frames), frames))
+        print(f"  {f'{args.workers} processes':<16} {len(chunk) / (time.perf_counter() - start) / 1e6:8.0f} MB/s")
+
+
+def stored_bytes(workdir):
+    return sum(entry.stat().st_size for i in range(3) for entry in os.scandir(os.path.join(workdir, f"dn{i}"))
+               if entry.is_file() and not entry.name.endswith(".meta"))
+
+
+def run_cluster(args):
+    data = log_lines(args.file_mb * 1024 * 1024, seed=3)
+    print(f"cluster: {args.file_mb} MB of log text, 3 DataNodes, 2 replicas")
+    print(f"  {'compression':<12} {'put MB/s':>9} {'get MB/s':>9} {'stored MB':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, "source")
+        with open(source, "wb") as f:
+            f.write(data)
+        namenode, port = start_namenode(workdir)
+        datanodes = [start_datanode(os.path.join(workdir, f"dn{i}"), namenode_port=port) for i in range(3)]
+        try:
+            time.sleep(2)  # First heartbeats
+            for compression in (None, "auto"):
+                client = DFSClient("127.0.0.1", port, chunk_size=16 * 1024 * 1024, compression=compression)
+                before = stored_bytes(workdir)
+                path = f"/bench/{compression or 'raw'}.log"
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    client.put(source, path)
+                    put = time.perf_counter() - start
+                    start = time.perf_counter()
+                    client.get(path, os.path.join(workdir, "copy"))
+                    get = time.perf_counter() - start
+                with open(os.path.join(workdir, "copy"), "rb") as f:
+                    assert f.read() == data, "read back different bytes"
+                print(f"  {compression or 'none':<12} {len(data) / put / 1e6:9.1f} {len(data) / get / 1e6:9.1f} "
+                      f"{(stored_bytes(workdir) - before) / 1e6:10.1f}")
+        finally:
+            for proc, _ in datanodes:
+                stop(proc)
+            stop(namenode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunk-mb", type=int, default=16)
+    parser.add_argument("--file-mb", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    run_codecs()
+    print()
+    run_pool(args)
+    print()
+    run_cluster(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Chunk read throughput from a loopback DataNode.
+
+Serves chunks with the DataNode's sendfile path and, for comparison, from a
+minimal in-process server that reads each chunk into Python and sendall()s
+it (the copy-through-userspace approach sendfile avoids).
+
+    python benchmarks/bench_datanode_read.py [--chunk-mb 64] [--reads 10]
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import free_port, start_datanode, stop, wait_for_port  # noqa: E402
+
+CHUNK_ID = "bench_chunk_0"
+
+
+def fetch(port, chunk_id, buf, offset=0, length=None):
+    """Fetch a chunk range with the get_file protocol into a preallocated buffer."""
+    request = {"message_type": "get_file", "chunk_id": chunk_id, "offset": offset}
+    if length is not None:
+        request["length"] = length
+    data = json.dumps(request).encode()
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        s.sendall(len(data).to_bytes(4, byteorder='big') + data)
+        size = int.from_bytes(s.recv(8, socket.MSG_WAITALL), byteorder='big')
+        view = memoryview(buf)
+        received = 0
+        while received < size:
+            n = s.recv_into(view[received:size])
+            if not n:
+                raise ConnectionError("DataNode disconnected")
+            received += n
+    return size
+
+
+def buffered_server(port, storage_dir, stop_event):
+    """Baseline server: read the whole chunk into memory, then sendall()."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as srv:
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        srv.bind(("127.0.0.1", port))
+        srv.listen()
+        srv.settimeout(0.2)
+        while not stop_event.is_set():
+            try:
+                conn, _ = srv.accept()
+            except socket.timeout:
+                continue
+            with conn:
+                conn.settimeout(None)
+                length_bytes = conn.recv(4, socket.MSG_WAITALL)
+                if len(length_bytes) < 4:
+                    continue  # readiness probe
+                length = int.from_bytes(length_bytes, byteorder='big')
+                message = json.loads(conn.recv(length, socket.MSG_WAITALL))
+                with open(os.path.join(storage_dir, message["chunk_id"]), "rb") as f:
+                    f.seek(message.get("offset", 0))
+                    payload = f.read() if message.get("length") is None else f.read(message["length"])
+                conn.sendall(len(payload).to_bytes(8, byteorder='big'))
+                conn.sendall(payload)
+
+
+def measure(label, port, reads, chunk_size, buf, length=None):
+    # Warm the page cache so both servers are measured on the same footing
+    fetch(port, CHUNK_ID, buf, length=length)
+    start = time.perf_counter()
+    total = 0
+    for i in range(reads):
+        offset = 0 if length is None else (i * length) % (chunk_size - length + 1)
+        total += fetch(port, CHUNK_ID, buf, offset=offset, length=length)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {total / elapsed / 1e6:>10.1f} MB/s  ({reads} reads, {elapsed:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunk-mb", type=int, default=64)
+    parser.add_argument("--reads", type=int, default=10)
+    parser.add_argument("--range-kb", type=int, default=1024, help="size of ranged reads")
+    args = parser.parse_args()
+    chunk_size = args.chunk_mb * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as storage_dir:
+        with open(os.path.join(storage_dir, CHUNK_ID), "wb") as f:
+            f.write(os.urandom(chunk_size))
+        buf = bytearray(chunk_size)
+
+        proc, port = start_datanode(storage_dir)
+        try:
+            measure("DataNode sendfile, full chunk", port, args.reads, chunk_size, buf)
+            measure(f"DataNode sendfile, {args.range_kb} KB ranges", port, args.reads * 16, chunk_size, buf,
+                    length=args.range_kb * 1024)
+        finally:
+            stop(proc)
+
+        stop_event = threading.Event()
+        port = free_port()
+        server = threading.Thread(target=buffered_server, args=(port, storage_dir, stop_event), daemon=True)
+        server.start()
+        wait_for_port(port)
+        try:
+            measure("read()+sendall(), full chunk", port, args.reads, chunk_size, buf)
+        finally:
+            stop_event.set()
+            server.join()
+
+
+if __name__ == "__main__":
+    main()
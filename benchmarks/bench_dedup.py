@@ -0,0 +1,148 @@
+"""Deduplication: chunking speed, dedup ratio on versioned data, and stored bytes end to end.
+
+  chunking  content-defined chunking (dedup.split) MB/s of one thread on
+            --data-mb of random data, with and without NumPy, and the chunk
+            sizes it produces
+  versions  --versions successive versions of a --data-mb file, each with a
+            few small insertions, deletions and overwrites; the share of each
+            version's bytes already stored by earlier ones with fixed-size
+            chunks of CDC_AVG_SIZE against content-defined chunks
+  cluster   a loopback NameNode and 3 DataNodes; the same versions are put
+            with and without --dedup, reporting put MB/s and the bytes the
+            DataNodes store
+
+    python benchmarks/bench_dedup.py [--data-mb 64] [--versions 5]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, start_datanode, start_namenode, stop  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+import dedup  # noqa: E402
+from client import DFSClient  # noqa: E402
+from dedup import CDC_AVG_SIZE, fingerprint, split  # noqa: E402
+
+EDITS = 8  # Edits between one version and the next
+
+
+def versions(size, count, seed=1):
+    """`count` versions of a random file, each an edited copy of the one before."""
+    rng = random.Random(seed)
+    data = bytearray(rng.randbytes(size))
+    result = [bytes(data)]
+    for _ in range(count - 1):
+        for _ in range(EDITS):
+            position = rng.randrange(len(data))
+            kind = rng.randrange(3)
+            if kind == 0:
+                data[position:position] = rng.randbytes(rng.randrange(1, 4096))
+            elif kind == 1:
+                del data[position:position + rng.randrange(1, 4096)]
+            else:
+                data[position:position + 100] = rng.randbytes(100)
+        result.append(bytes(data))
+    return result
+
+
+def fixed_chunks(data):
+    view = memoryview(data)
+    return [view[i:i + CDC_AVG_SIZE] for i in range(0, len(data), CDC_AVG_SIZE)]
+
+
+def run_chunking(args):
+    data = os.urandom(args.data_mb * 1024 * 1024)
+    numpy = dedup.np
+    variants = [("numpy", numpy), ("pure", None)] if numpy is not None else [("pure", None)]
+    print(f"chunking: {args.data_mb} MB of random data, one thread")
+    print(f"  {'hash':<6} {'MB/s':>8} {'chunks':>7} {'mean KB':>8} {'stdev KB':>9}")
+    for label, module in variants:
+        dedup.np = module
+        try:
+            # The pure-Python scan is slow; time it on a slice
+            sample = data if module is not None else data[:max(CDC_AVG_SIZE * 4, len(data) // 16)]
+            start = time.perf_counter()
+            sizes = [len(chunk) for chunk in split([sample])]
+            elapsed = time.perf_counter() - start
+        finally:
+            dedup.np = numpy
+        print(f"  {label:<6} {len(sample) / elapsed / 1e6:8.1f} {len(sizes):7} {statistics.mean(sizes) / 1024:8.0f} "
+              f"{statistics.pstdev(sizes) / 1024:9.0f}")
+
+
+def run_versions(args, files):
+    print(f"versions: {len(files)} versions of a {args.data_mb} MB file, {EDITS} small edits each; "
+          f"share of each version already stored")
+    print(f"  {'version':<8} {'fixed':>7} {'cdc':>7}")
+    seen = {"fixed": set(), "cdc": set()}
+    for number, data in enumerate(files):
+        shares = []
+        for label, chunker in (("fixed", fixed_chunks), ("cdc", lambda data: list(split([data])))):
+            duplicate = 0
+            for chunk in chunker(data):
+                digest = fingerprint(chunk)
+                if digest in seen[label]:
+                    duplicate += len(chunk)
+                seen[label].add(digest)
+            shares.append(duplicate / len(data))
+        print(f"  {number:<8} {shares[0]:7.1%} {shares[1]:7.1%}")
+
+
+def stored_bytes(workdir):
+    return sum(entry.stat().st_size for i in range(3) for entry in os.scandir(os.path.join(workdir, f"dn{i}"))
+               if entry.is_file() and not entry.name.endswith(".meta"))
+
+
+def run_cluster(args, files):
+    print(f"cluster: the {len(files)} versions, 3 DataNodes, 2 replicas")
+    print(f"  {'dedup':<6} {'put MB/s':>9} {'stored MB':>10} {'of written':>11}")
+    with tempfile.TemporaryDirectory() as workdir:
+        namenode, port = start_namenode(workdir)
+        datanodes = [start_datanode(os.path.join(workdir, f"dn{i}"), namenode_port=port) for i in range(3)]
+        try:
+            time.sleep(2)  # First heartbeats
+            for enabled in (False, True):
+                client = DFSClient("127.0.0.1", port, chunk_size=CDC_AVG_SIZE * 4, dedup=enabled)
+                before = stored_bytes(workdir)
+                elapsed = 0
+                for number, data in enumerate(files):
+                    path = f"/bench/{'dedup' if enabled else 'plain'}/v{number}"
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        start = time.perf_counter()
+                        client.put_stream(io.BytesIO(data), path)
+                        elapsed += time.perf_counter() - start
+                        with client.open(path) as f:
+                            assert f.read() == data, "read back different bytes"
+                written = sum(map(len, files))
+                stored = stored_bytes(workdir) - before
+                print(f"  {'yes' if enabled else 'no':<6} {written / elapsed / 1e6:9.1f} {stored / 1e6:10.1f} "
+                      f"{stored / written:10.2f}x")
+        finally:
+            for proc, _ in datanodes:
+                stop(proc)
+            stop(namenode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-mb", type=int, default=64)
+    parser.add_argument("--versions", type=int, default=5)
+    args = parser.parse_args()
+    run_chunking(args)
+    print()
+    files = versions(args.data_mb * 1024 * 1024, args.versions)
+    run_versions(args, files)
+    print()
+    run_cluster(args, files)
+
+
+if __name__ == "__main__":
+    main()
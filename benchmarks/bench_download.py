@@ -0,0 +1,140 @@
+"""Sequential vs parallel, hedged downloads from N loopback DataNodes.
+
+Chunks are written straight into each DataNode's storage directory and a
+stub NameNode returns their locations. One extra "slow" replica (a server
+that waits --slow-ms before answering) is listed first for every chunk to
+show how hedged reads route around a straggler.
+
+    python benchmarks/bench_download.py [--datanodes 3] [--file-mb 256] [--chunk-mb 16] [--slow-ms 500]
+"""
+import argparse
+import hashlib
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, free_port, start_datanode, stop, wait_for_port  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+from checksum import StreamingChecksum, read_sidecar, write_sidecar  # noqa: E402
+from protocol import hello_response, recv_message, send_message  # noqa: E402
+from transfer import DownloadEngine  # noqa: E402
+
+
+def slow_server(port, storage_dir, delay):
+    """A replica that answers get_file correctly, but only after `delay` seconds."""
+    def serve(conn):
+        with conn:
+            try:
+                message = recv_message(conn)
+                if message and message["message_type"] == "hello":
+                    send_message(conn, hello_response(message))
+                    message = recv_message(conn)
+                if message is None:
+                    return
+                time.sleep(delay)
+                if message.get("admission"):
+                    send_message(conn, {"status": "ok"})
+                path = os.path.join(storage_dir, message["chunk_id"])
+                if message.get("checksums"):
+                    send_message(conn, read_sidecar(path))
+                with open(path, "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    conn.sendall(size.to_bytes(8, byteorder='big'))
+                    conn.sendfile(f)
+            except OSError:
+                pass
+
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", port))
+    srv.listen()
+
+    def accept_loop():
+        while True:
+            conn, _ = srv.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+    threading.Thread(target=accept_loop, daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--datanodes", type=int, default=3)
+    parser.add_argument("--file-mb", type=int, default=256)
+    parser.add_argument("--chunk-mb", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--slow-ms", type=int, default=500)
+    args = parser.parse_args()
+    chunk_size = args.chunk_mb * 1024 * 1024
+    file_size = args.file_mb * 1024 * 1024
+    num_chunks = -(-file_size // chunk_size)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        dirs = [os.path.join(workdir, f"dn{i}") for i in range(args.datanodes)]
+        for d in dirs:
+            os.makedirs(d)
+        digest = hashlib.sha256()
+        for i in range(num_chunks):
+            data = os.urandom(min(chunk_size, file_size - i * chunk_size))
+            digest.update(data)
+            checksum = StreamingChecksum()
+            checksum.update(data)
+            for r in range(2):
+                path = os.path.join(dirs[(i + r) % len(dirs)], f"bench_chunk_{i}")
+                with open(path, "wb") as f:
+                    f.write(data)
+                write_sidecar(path, checksum.finish())
+        # The slow replica serves from a directory holding every chunk
+        slow_dir = os.path.join(workdir, "slow")
+        os.makedirs(slow_dir)
+        for i in range(num_chunks):
+            for suffix in ("", ".meta"):
+                os.link(os.path.join(dirs[i % len(dirs)], f"bench_chunk_{i}{suffix}"),
+                        os.path.join(slow_dir, f"bench_chunk_{i}{suffix}"))
+        slow_port = free_port()
+        slow_server(slow_port, slow_dir, args.slow_ms / 1000)
+        wait_for_port(slow_port)
+
+        procs, ports = [], []
+        try:
+            for d in dirs:
+                proc, port = start_datanode(d)
+                procs.append(proc)
+                ports.append(port)
+
+            def request(message, with_slow=False):
+                chunks = []
+                for i in range(num_chunks):
+                    datanodes = [{"host": "127.0.0.1", "port": ports[(i + r) % len(ports)]} for r in range(2)]
+                    if with_slow:
+                        datanodes.insert(0, {"host": "127.0.0.1", "port": slow_port})
+                    chunks.append({"chunk_id": f"bench_chunk_{i}", "datanodes": datanodes})
+                return {"status": "ok", "size": file_size, "chunk_size": chunk_size, "chunks": chunks}
+
+            out = os.path.join(workdir, "out.bin")
+            cases = [
+                ("sequential, no hedging", request, dict(max_workers=1, hedge=False)),
+                (f"parallel ({args.workers} workers)", request, dict(max_workers=args.workers)),
+                ("sequential, slow first replica", lambda m: request(m, True), dict(max_workers=1, hedge=False)),
+                (f"parallel + hedging, slow replica", lambda m: request(m, True), dict(max_workers=args.workers)),
+            ]
+            for label, req, options in cases:
+                engine = DownloadEngine(request=req, **options)
+                start = time.perf_counter()
+                engine.download("bench", out)
+                elapsed = time.perf_counter() - start
+                with open(out, "rb") as f:
+                    ok = hashlib.file_digest(f, "sha256").digest() == digest.digest()
+                print(f"{label:<36} {elapsed:>7.2f}s  {file_size / elapsed / 1e6:>8.1f} MB/s  "
+                      f"{'ok' if ok else 'CORRUPT'}")
+        finally:
+            for proc in procs:
+                stop(proc)
+
+
+if __name__ == "__main__":
+    main()
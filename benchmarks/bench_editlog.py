@@ -0,0 +1,94 @@
+"""Mutation latency of the NameNode as the namespace grows.
+
+Compares the edit log (one compact, group-committed record per mutation)
+against the old behaviour of rewriting the whole metadata file as indented
+JSON on every mutation.
+
+    python benchmarks/bench_editlog.py [--sizes 1000 10000 50000] [--ops 200]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import NameNode  # noqa: E402
+from namespace import INodeFile  # noqa: E402
+
+
+def make_file_meta(name):
+    return {
+        "size": 64 * 1024 * 1024,
+        "chunks": [{"chunk_id": f"{name}_chunk_0",
+                    "datanodes": [{"host": "127.0.0.1", "port": 6001}, {"host": "127.0.0.1", "port": 6002}]}],
+        "status": "complete",
+    }
+
+
+def setup_namenode(workdir, size):
+    NameNode.METADATA_FILE = os.path.join(workdir, "namenode_metadata.json")
+    NameNode.EDITS_DIR = os.path.join(workdir, "edits")
+    with contextlib.redirect_stdout(io.StringIO()):
+        NameNode.load_metadata()
+    for i in range(size):
+        NameNode.NAMESPACE.add_file(f"/existing_{i}", INodeFile.from_json(make_file_meta(f"existing_{i}")))
+    for port in (6001, 6002):
+        NameNode.DATANODE_STATUS[f"127.0.0.1:{port}"] = {"host": "127.0.0.1", "port": port, "last_heartbeat": time.time()}
+
+
+async def time_edit_log(ops):
+    NameNode.metadata_writer = NameNode.MetadataWriter()
+    writer_task = asyncio.create_task(NameNode.metadata_writer.run())
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(ops):
+            start = time.perf_counter()
+            await NameNode.process_message({"action": "upload", "name": f"new_{i}", "filesize": 1024, "num_chunks": 1})
+            samples.append(time.perf_counter() - start)
+    writer_task.cancel()
+    return samples
+
+
+def time_full_rewrite(ops, path, size):
+    files = {f"existing_{i}": make_file_meta(f"existing_{i}") for i in range(size)}
+    samples = []
+    for i in range(ops):
+        start = time.perf_counter()
+        files[f"legacy_{i}"] = make_file_meta(f"legacy_{i}")
+        with open(path, "w") as f:
+            json.dump(files, f, indent=2)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return statistics.mean(samples) * 1000, samples[int(len(samples) * 0.99) - 1] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--ops", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'namespace':>10} {'editlog mean':>13} {'editlog p99':>12} {'rewrite mean':>13} {'rewrite p99':>12}  (ms)")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            setup_namenode(workdir, size)
+            log_mean, log_p99 = summarize(asyncio.run(time_edit_log(args.ops)))
+            NameNode.edit_log.close()
+            # The legacy path is so slow at large sizes that fewer samples suffice
+            rewrite_ops = max(5, min(args.ops, 2000000 // max(size, 1)))
+            rw_mean, rw_p99 = summarize(time_full_rewrite(rewrite_ops, os.path.join(workdir, "legacy.json"), size))
+        print(f"{size:>10} {log_mean:>13.3f} {log_p99:>12.3f} {rw_mean:>13.3f} {rw_p99:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Erasure coding: codec throughput per core and degraded-read latency.
+
+  codec     Reed-Solomon encode and decode speed of one thread (one core) for
+            several policies, on --cell-mb cells. Decoding rebuilds `parity`
+            lost data cells, the worst case. Run with and without NumPy (the
+            vectorized XOR) when it is installed
+  degraded  a loopback NameNode and data + parity DataNodes; a --file-mb file
+            written with --policy is read in READ_WINDOW ranges, first with
+            every DataNode up, then with one killed so the ranges of its cells
+            are rebuilt from the rest of their stripes
+
+    python benchmarks/bench_erasure.py [--policy RS-3-2] [--cell-mb 4] [--file-mb 96] [--iterations 5]
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, kill, start_datanode, start_namenode, stop  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+import erasure  # noqa: E402
+from client import READ_WINDOW, DFSClient  # noqa: E402
+from erasure import encode, parse_policy, reconstruct  # noqa: E402
+
+CODEC_POLICIES = ["RS-3-2", "RS-6-3", "RS-10-4"]
+
+
+def codec_mbps(policy, cell_size, iterations):
+    """(encode, decode) MB/s of data cells for one thread."""
+    policy = parse_policy(policy)
+    cells = [os.urandom(cell_size) for _ in range(policy.data)]
+    parity = encode(policy, cells)
+    # Lose the first `parity` data cells; rebuild them from the others and the parity
+    survivors = {i: cell for i, cell in enumerate(cells) if i >= policy.parity}
+    survivors.update({policy.data + j: cell for j, cell in enumerate(parity)})
+    lost = list(range(min(policy.parity, policy.data)))
+    assert all(reconstruct(policy, survivors, lost, cell_size)[i] == cells[i] for i in lost)
+
+    def rate(fn):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        return policy.data * cell_size * iterations / (time.perf_counter() - start) / 1e6
+    return rate(lambda: encode(policy, cells)), rate(lambda: reconstruct(policy, survivors, lost, cell_size))
+
+
+def run_codec(args):
+    numpy = erasure.np
+    variants = [("numpy", numpy), ("pure", None)] if numpy is not None else [("pure", None)]
+    print(f"codec: {args.cell_mb} MB cells, MB/s of data per core")
+    print(f"  {'policy':<9} {'xor':<6} {'encode':>8} {'decode':>8}")
+    for policy in CODEC_POLICIES:
+        for label, module in variants:
+            erasure.np = module
+            try:
+                enc, dec = codec_mbps(policy, args.cell_mb * 1024 * 1024, args.iterations)
+            finally:
+                erasure.np = numpy
+            print(f"  {policy:<9} {label:<6} {enc:8.0f} {dec:8.0f}")
+
+
+def read_latencies(client, path, size, chunk_size):
+    """Seconds taken by each READ_WINDOW range read of the file, in order."""
+    engine = client.download_engine()
+    locations = engine.locate(path)
+    latencies = []
+    with ThreadPoolExecutor(max_workers=8) as attempt_pool:
+        for index in range(len(locations.chunks)):
+            chunk_length = min(chunk_size, size - index * chunk_size)
+            for offset in range(0, chunk_length, READ_WINDOW):
+                start = time.perf_counter()
+                length = min(READ_WINDOW, chunk_length - offset)
+                engine.read_range(attempt_pool, path, locations, index, offset, length)
+                latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def summary(label, latencies):
+    ms = sorted(latency * 1000 for latency in latencies)
+    p99 = ms[min(len(ms) - 1, int(len(ms) * 0.99))]
+    print(f"  {label:<26} {len(ms):>6} {statistics.median(ms):9.2f} {p99:9.2f} {max(ms):9.2f}")
+
+
+def run_degraded(args):
+    policy = parse_policy(args.policy)
+    cell_size = args.cell_mb * 1024 * 1024
+    with tempfile.TemporaryDirectory() as workdir:
+        namenode, port = start_namenode(workdir)
+        datanodes = [start_datanode(os.path.join(workdir, f"dn{i}"), namenode_port=port)
+                     for i in range(policy.data + policy.parity)]
+        try:
+            time.sleep(2)  # First heartbeats
+            client = DFSClient("127.0.0.1", port, chunk_size=cell_size, ec=policy)
+            data = os.urandom(args.file_mb * 1024 * 1024)
+            with contextlib.redirect_stdout(io.StringIO()):
+                size = client.put_stream(io.BytesIO(data), "/bench/ec.bin")
+                healthy = read_latencies(client, "/bench/ec.bin", size, cell_size)
+                # Kill the DataNode holding the most data cells
+                holders = [chunk["datanodes"][0]["port"] if chunk["datanodes"] else None
+                           for chunk in client.download_engine().locate("/bench/ec.bin").chunks]
+                victim = max((port for _, port in datanodes), key=holders.count)
+                kill(next(proc for proc, port in datanodes if port == victim))
+                lost = [i for i, port in enumerate(holders) if port == victim]
+                degraded = read_latencies(client, "/bench/ec.bin", size, cell_size)
+                with client.open("/bench/ec.bin") as f:
+                    assert f.read() == data, "degraded read returned different bytes"
+            windows = -(-cell_size // READ_WINDOW)
+            rebuilt = [latency for i, latency in enumerate(degraded) if i // windows in lost]
+            print(f"degraded: {args.file_mb} MB file in {policy.name}, {args.cell_mb} MB cells, "
+                  f"{READ_WINDOW >> 20} MB range reads; {len(lost)} data cells on the killed DataNode")
+            print(f"  {'reads':<26} {'count':>6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+            summary("all DataNodes up", healthy)
+            summary("one DataNode down: all", degraded)
+            if rebuilt:
+                summary("one DataNode down: rebuilt", rebuilt)
+        finally:
+            for proc, _ in datanodes:
+                stop(proc)
+            stop(namenode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--policy", default="RS-3-2", help="policy of the degraded-read test")
+    parser.add_argument("--cell-mb", type=int, default=4)
+    parser.add_argument("--file-mb", type=int, default=96)
+    parser.add_argument("--iterations", type=int, default=5, help="stripes encoded and decoded per codec test")
+    args = parser.parse_args()
+    run_codec(args)
+    print()
+    run_degraded(args)
+
+
+if __name__ == "__main__":
+    main()
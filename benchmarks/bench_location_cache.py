@@ -0,0 +1,76 @@
+"""Repeated-open workload with and without the client's chunk-location cache.
+
+Starts a loopback NameNode and --datanodes DataNodes, uploads --files small
+files and then opens and reads --opens of them, chosen with a Zipf-like
+skew (--skew) so that some files are reopened often. Each mode uses a fresh
+DFSClient; "off" asks the NameNode for every open, "on" uses a
+LocationCache. Reports NameNode requests, opens/s and the cache counters.
+
+    python benchmarks/bench_location_cache.py [--files 200] [--file-kb 64] [--opens 2000] [--skew 1.1]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, start_datanode, start_namenode, stop  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+from client import DFSClient  # noqa: E402
+
+
+def counting(request, counts):
+    def wrapped(message):
+        counts[message["action"]] = counts.get(message["action"], 0) + 1
+        return request(message)
+    return wrapped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--datanodes", type=int, default=3)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--file-kb", type=int, default=64)
+    parser.add_argument("--opens", type=int, default=2000)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of file popularity (0 = uniform)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        namenode, port = start_namenode(workdir)
+        datanodes = [start_datanode(os.path.join(workdir, f"dn{i}"), namenode_port=port)[0]
+                     for i in range(args.datanodes)]
+        try:
+            time.sleep(2)  # First heartbeats
+            writer = DFSClient("127.0.0.1", port, cache=None)
+            paths = [f"/bench/f{i:05d}" for i in range(args.files)]
+            for path in paths:
+                with writer.open(path, "wb") as f:
+                    f.write(os.urandom(args.file_kb * 1024))
+            rng = random.Random(1)
+            weights = [1 / (rank + 1) ** args.skew for rank in range(args.files)]
+            workload = rng.choices(paths, weights, k=args.opens)
+
+            print(f"{args.opens} opens of {args.files} files of {args.file_kb} KB (Zipf skew {args.skew})")
+            print(f"{'cache':<6} {'NN requests':>12} {'opens/s':>9} {'hit rate':>9}")
+            for mode in ("off", "on"):
+                client = DFSClient("127.0.0.1", port, cache=mode == "on")
+                counts = {}
+                client.request = counting(client.request, counts)
+                start = time.perf_counter()
+                for path in workload:
+                    with client.open(path) as f:
+                        f.read()
+                elapsed = time.perf_counter() - start
+                hit_rate = f"{client.cache.stats()['hit_rate']:.1%}" if client.cache else "-"
+                print(f"{mode:<6} {counts.get('download', 0):>12} {args.opens / elapsed:>9.0f} {hit_rate:>9}")
+        finally:
+            for proc in datanodes:
+                stop(proc)
+            stop(namenode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""NameNode memory and lookup cost of chunk metadata: per-chunk dicts vs compact inodes.
+
+Loads --chunks chunks (--chunks-per-file per file, each on --replication
+of --datanodes DataNodes) into the directory tree and the block-report
+index, in one of two layouts:
+
+  dicts    the old layout: a metadata dict per file with a dict per chunk
+           (string chunk ID plus a list of {host, port} dicts), a chunk ID
+           -> file index, and a set of DataNode IDs per chunk
+  compact  INodeFiles holding an integer block range and a flat tuple of
+           interned DataNode IDs, the range-start owner index, and a tuple
+           of DataNode IDs per block
+
+Each layout is built in a fresh subprocess, once under tracemalloc (bytes
+allocated) and once without (RSS growth from /proc/self/statm, plus the
+latency of building a download response and of looking up a block's owner).
+
+    python benchmarks/bench_metadata_memory.py [--chunks 1000000] [--chunks-per-file 10] [--lookups 100000]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import NameNode  # noqa: E402
+from namespace import Directory, INodeFile  # noqa: E402
+
+LAYOUTS = ("dicts", "compact")
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def file_path(i):
+    return f"/data/d{i % 1000}/part-{i:08d}"
+
+
+def build_dicts(args, datanodes):
+    """The pre-compaction NameNode state, built the way its upload and block report handlers did."""
+    root = Directory()
+    chunks = {}
+    block_index = {}
+    rng = random.Random(1)
+    for i in range(args.chunks // args.chunks_per_file):
+        file_id = f"{rng.getrandbits(128):032x}"
+        allocations = []
+        for c in range(args.chunks_per_file):
+            replicas = rng.sample(datanodes, args.replication)
+            chunk_id = f"{file_id}_chunk_{c}"
+            allocations.append({"chunk_id": chunk_id,
+                                "datanodes": [{"host": dn["host"], "port": dn["port"]} for dn in replicas]})
+            # One ID string per heartbeat was shared by all the chunks in that node's block report
+            block_index[chunk_id] = {dn["id"] for dn in replicas}
+        meta = {"size": args.chunks_per_file * NameNode.DEFAULT_CHUNK_SIZE,
+                "chunk_size": NameNode.DEFAULT_CHUNK_SIZE, "chunks": allocations, "status": "complete"}
+        parts = file_path(i).split("/")[1:]
+        node = root
+        for part in parts[:-1]:
+            child = node.children.get(part)
+            if child is None:
+                child = Directory()
+                node.add(part, child)
+            node = child
+        node.add(parts[-1], meta)
+        for chunk in allocations:
+            chunks[chunk["chunk_id"]] = meta
+    return root, chunks, block_index
+
+
+def build_compact(args, datanodes):
+    """The NameNode's own state, filled through its namespace and block-report index."""
+    rng = random.Random(1)
+    namespace = NameNode.NAMESPACE
+    for i in range(args.chunks // args.chunks_per_file):
+        first_block = namespace.allocate_blocks(args.chunks_per_file)
+        targets = []
+        for c in range(args.chunks_per_file):
+            replicas = [dn["id"] for dn in rng.sample(datanodes, args.replication)]
+            targets.append(replicas)
+            for datanode_id in replicas:
+                NameNode.add_replica(first_block + c, datanode_id)
+        namespace.add_file(file_path(i), INodeFile(args.chunks_per_file * NameNode.DEFAULT_CHUNK_SIZE,
+                                                   NameNode.DEFAULT_CHUNK_SIZE, first_block, args.chunks_per_file,
+                                                   NameNode.flat_targets(targets), complete=True))
+    return namespace
+
+
+def lookup_dicts(state, datanodes, path):
+    root, _, block_index = state
+    node = root
+    for part in path.split("/")[1:]:
+        node = node.children[part]
+    return [{"chunk_id": chunk["chunk_id"],
+             "datanodes": [{"host": datanodes[dn]["host"], "port": datanodes[dn]["port"]}
+                           for dn in block_index[chunk["chunk_id"]] if dn in datanodes]}
+            for chunk in node["chunks"]]
+
+
+def lookup_compact(namespace, path):
+    return NameNode.chunk_locations(namespace.get_file(path))
+
+
+def median_us(samples):
+    return statistics.median(samples) * 1e6
+
+
+def run_layout(args):
+    datanodes = [{"host": f"10.0.{i // 250}.{i % 250 + 1}", "port": 5001} for i in range(args.datanodes)]
+    for dn in datanodes:
+        dn["id"] = sys.intern(NameNode.node_id(dn))
+        NameNode.DATANODE_STATUS[dn["id"]] = {"host": dn["host"], "port": dn["port"], "last_heartbeat": time.time()}
+    if args.trace:
+        tracemalloc.start()
+    before = rss_bytes()
+    start = time.perf_counter()
+    state = build_dicts(args, datanodes) if args.layout == "dicts" else build_compact(args, datanodes)
+    result = {"build_s": time.perf_counter() - start}
+    if args.trace:
+        result["traced_bytes"] = tracemalloc.get_traced_memory()[0]
+        print(json.dumps(result))
+        return
+    after = rss_bytes()
+    result["rss_bytes"] = after - before if before is not None else None
+
+    rng = random.Random(2)
+    num_files = args.chunks // args.chunks_per_file
+    paths = [file_path(rng.randrange(num_files)) for _ in range(args.lookups)]
+    samples = []
+    for path in paths:
+        t = time.perf_counter()
+        if args.layout == "dicts":
+            lookup_dicts(state, NameNode.DATANODE_STATUS, path)
+        else:
+            lookup_compact(state, path)
+        samples.append(time.perf_counter() - t)
+    result["download_us"] = median_us(samples)
+
+    if args.layout == "dicts":
+        chunk_ids = list(state[1])
+        keys = [chunk_ids[rng.randrange(len(chunk_ids))] for _ in range(args.lookups)]
+        owner = state[1].get
+    else:
+        keys = [rng.randrange(1, state.next_block_id) for _ in range(args.lookups)]
+        owner = state.owner
+    samples = []
+    for key in keys:
+        t = time.perf_counter()
+        owner(key)
+        samples.append(time.perf_counter() - t)
+    result["owner_us"] = median_us(samples)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=1000000)
+    parser.add_argument("--chunks-per-file", type=int, default=10)
+    parser.add_argument("--datanodes", type=int, default=50)
+    parser.add_argument("--replication", type=int, default=NameNode.REPLICATION)
+    parser.add_argument("--lookups", type=int, default=100000)
+    parser.add_argument("--layout", choices=LAYOUTS, help=argparse.SUPPRESS)
+    parser.add_argument("--trace", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.layout:
+        run_layout(args)
+        return
+
+    common = [f"--chunks={args.chunks}", f"--chunks-per-file={args.chunks_per_file}",
+              f"--datanodes={args.datanodes}", f"--replication={args.replication}", f"--lookups={args.lookups}"]
+    print(f"{args.chunks} chunks in {args.chunks // args.chunks_per_file} files, "
+          f"{args.replication} replicas on {args.datanodes} DataNodes")
+    print(f"{'layout':<8} {'traced MB':>10} {'RSS MB':>8} {'B/chunk':>8} {'build s':>8} "
+          f"{'download us':>12} {'owner us':>9}")
+    for layout in LAYOUTS:
+        runs = []
+        for extra in (["--trace"], []):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), f"--layout={layout}"] + common + extra,
+                                    check=True, capture_output=True, text=True).stdout
+            runs.append(json.loads(output.splitlines()[-1]))
+        traced, timed = runs
+        rss = timed["rss_bytes"]
+        print(f"{layout:<8} {traced['traced_bytes'] / 1e6:>10.1f} "
+              f"{(rss / 1e6 if rss is not None else float('nan')):>8.1f} "
+              f"{traced['traced_bytes'] / args.chunks:>8.0f} {timed['build_s']:>8.2f} "
+              f"{timed['download_us']:>12.2f} {timed['owner_us']:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Instrumentation overhead: metric updates, tracing and debug logging on the request path.
+
+  record   ns per call (one thread) of the operations the request paths now
+           make: counter increments, histogram observations, acquiring the
+           DataNode's TimedLock against a plain Lock, starting spans of
+           untraced and traced requests, and a disabled debug log call
+           against the print of each message it replaced
+  cluster  a loopback NameNode and 3 DataNodes; --files small files are put
+           with the NameNode and DataNodes logging at INFO, then at DEBUG
+           (every message formatted, output discarded), then at INFO with
+           every upload traced; reports files/s and the NameNode's request
+           latency percentiles from /metrics
+
+    python benchmarks/bench_metrics.py [--files 300] [--file-kb 16]
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, free_port, start_datanode, start_namenode, stop  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+import transfer  # noqa: E402
+from client import DFSClient  # noqa: E402
+from metrics import Counter, Histogram, Registry, TimedLock  # noqa: E402
+from tracing import Tracer  # noqa: E402
+
+MESSAGE = {"action": "add_block", "lease_id": "0123456789abcdef", "count": 4,
+           "committed": [{"chunk_id": f"blk_{i}", "size": 67108864} for i in range(4)]}
+
+
+def ns_per_call(fn, calls=200000):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def run_record():
+    registry = Registry()
+    counter = Counter("bench_total", "", ["action"], registry=registry).labels("add_block")
+    histogram = Histogram("bench_seconds", "", ["action"], registry=registry).labels("add_block")
+    timed = TimedLock(Histogram("bench_wait_seconds", "", registry=registry))
+    plain = threading.Lock()
+    tracer = Tracer("bench")
+    context = {"trace_id": "0" * 32, "span_id": "0" * 16}
+    log = logging.getLogger("bench")
+    log.setLevel(logging.INFO)
+    devnull = open(os.devnull, "w")
+
+    def lock(lock):
+        with lock:
+            pass
+
+    def span(parent):
+        with tracer.span("bench", parent):
+            pass
+
+    rows = [
+        ("counter inc", lambda: counter.inc()),
+        ("histogram observe", lambda: histogram.observe(0.0012)),
+        ("threading.Lock", lambda: lock(plain)),
+        ("TimedLock", lambda: lock(timed)),
+        ("span, untraced request", lambda: span(None)),
+        ("span, traced request", lambda: span(context)),
+        ("log.debug (disabled)", lambda: log.debug("Received message: %s", MESSAGE)),
+        ("print of the message", lambda: print(f"[DEBUG] Received message: {MESSAGE}", file=devnull)),
+    ]
+    print("record: ns per call, one thread")
+    for label, fn in rows:
+        print(f"  {label:<24} {ns_per_call(fn):8.0f}")
+    devnull.close()
+
+
+def quantile(text, metric, q):
+    """The upper bound of the bucket holding quantile `q` of a histogram summed over its labels."""
+    buckets = {}
+    for bound, count in re.findall(rf'^{metric}_bucket{{.*le="([^"]+)"}} (\d+)$', text, re.M):
+        buckets[float(bound)] = buckets.get(float(bound), 0) + int(count)
+    total = buckets.get(float("inf"), 0)
+    return next((bound for bound, count in sorted(buckets.items()) if count >= q * total), float("nan"))
+
+
+def run_cluster(args):
+    data = os.urandom(args.file_kb * 1024)
+    print(f"cluster: {args.files} files of {args.file_kb} KB, 3 DataNodes, 2 replicas")
+    print(f"  {'mode':<16} {'files/s':>8} {'rpc p50 ms':>11} {'rpc p99 ms':>11}")
+    for mode, level, sample in (("info", "INFO", 0.0), ("debug", "DEBUG", 0.0), ("info, traced", "INFO", 1.0)):
+        with tempfile.TemporaryDirectory() as workdir:
+            metrics_port = free_port()
+            extra = ["--log-level", level]
+            namenode, port = start_namenode(workdir, extra_args=extra + ["--metrics-port", str(metrics_port)])
+            datanodes = [start_datanode(os.path.join(workdir, f"dn{i}"), namenode_port=port, extra_args=extra)
+                         for i in range(3)]
+            try:
+                time.sleep(2)  # First heartbeats
+                transfer.tracer.configure(sample_rate=sample)
+                client = DFSClient("127.0.0.1", port)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    for i in range(args.files):
+                        client.put_stream(io.BytesIO(data), f"/bench/{i}")
+                    elapsed = time.perf_counter() - start
+                text = urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics").read().decode()
+                p50, p99 = (quantile(text, "dfs_namenode_rpc_seconds", q) * 1000 for q in (0.5, 0.99))
+                print(f"  {mode:<16} {args.files / elapsed:8.1f} {p50:11.2f} {p99:11.2f}")
+            finally:
+                transfer.tracer.configure(sample_rate=0.0)
+                for proc, _ in datanodes:
+                    stop(proc)
+                stop(namenode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=300)
+    parser.add_argument("--file-kb", type=int, default=16)
+    args = parser.parse_args()
+    run_record()
+    print()
+    run_cluster(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Read latency while a bulk upload runs, with and without DataNode transfer scheduling.
+
+Starts a loopback NameNode and two DataNodes, writes a --read-mb file, then
+for each DataNode setup measures --pread-kb random reads by a "reader"
+tenant, --read-rate a second over TCP, for --seconds. A read's latency
+counts from when it was due, so reads held up behind a slow one count
+their wait too:
+
+  idle  with nothing else running
+  bulk  while a "bulk" tenant, in another process, uploads --file-mb files
+        with --bulk-workers chunk streams at once, over and over
+
+Setups:
+
+  unlimited  --max-streams 100000 and no bandwidth limit: every stream is
+             served at once, as before transfer scheduling
+  scheduled  --max-streams and --bandwidth-mb as given: bulk streams queue
+             behind reads and leave them the bandwidth
+
+Reports p50 and p99 read latency and the bulk upload's MB/s.
+
+    python benchmarks/bench_mixed_load.py [--seconds 10] [--read-rate 200] [--bulk-workers 16]
+                                          [--max-streams 8] [--bandwidth-mb 50]
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, start_datanode, start_namenode, stop  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+from client import DFSClient  # noqa: E402
+from locations import chunk_span, find_chunk  # noqa: E402
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def read_loop(client, path, length, rate, seconds):
+    """Random reads of `length` bytes, `rate` a second for `seconds`; returns their latencies."""
+    engine = client.download_engine()
+    locations = engine.locate(path)
+    rng = random.Random(1)
+    latencies = []
+    due = time.perf_counter()
+    deadline = due + seconds
+    with ThreadPoolExecutor(max_workers=4) as attempt_pool:
+        while due < deadline:
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            offset = rng.randrange(locations.size - length)
+            index, chunk_offset = find_chunk(locations, offset)
+            engine.read_range(attempt_pool, path, locations, index, chunk_offset,
+                              min(length, chunk_span(locations, index)[1] - chunk_offset))
+            latencies.append(time.perf_counter() - due)
+            due += 1 / rate
+    return latencies
+
+
+def bulk_loop(port, args, stop_event, uploaded):
+    """Upload (and delete) the same file over and over until told to stop, counting the bytes in `uploaded`."""
+    chunk_size = args.chunk_mb * 1024 * 1024
+    client = DFSClient("127.0.0.1", port, chunk_size=chunk_size, max_workers=args.bulk_workers,
+                       memory_budget=args.bulk_workers * chunk_size, tenant="bulk")
+    data = os.urandom(args.file_mb * 1024 * 1024)
+    n = 0
+    while not stop_event.is_set():
+        client.put_stream(io.BytesIO(data), f"/bulk/{n}")
+        client.delete(f"/bulk/{n}")
+        with uploaded.get_lock():
+            uploaded.value += len(data)
+        n += 1
+
+
+def run(args, workdir, label, datanode_args):
+    namenode, port = start_namenode(workdir)
+    datanodes = [start_datanode(os.path.join(workdir, label, f"dn{i}"), namenode_port=port,
+                                extra_args=datanode_args)[0] for i in range(2)]
+    try:
+        time.sleep(2)  # First heartbeats
+        chunk_size = args.chunk_mb * 1024 * 1024
+        reader = DFSClient("127.0.0.1", port, chunk_size=chunk_size, short_circuit=False, tenant="reader")
+        reader.put_stream(io.BytesIO(os.urandom(args.read_mb * 1024 * 1024)), "/read/file")
+        length = args.pread_kb * 1024
+        results = {}
+        results["idle"] = (read_loop(reader, "/read/file", length, args.read_rate, args.seconds), None)
+
+        # In its own process, so the reader does not wait on the uploader's threads for the GIL
+        # (spawned: a forked child would share the parent's pooled connections)
+        context = multiprocessing.get_context("spawn")
+        stop_event = context.Event()
+        uploaded = context.Value("q", 0)
+        uploader = context.Process(target=bulk_loop, args=(port, args, stop_event, uploaded), daemon=True)
+        uploader.start()
+        time.sleep(2)  # Let the upload get going
+        start, before = time.perf_counter(), uploaded.value
+        latencies = read_loop(reader, "/read/file", length, args.read_rate, args.seconds)
+        throughput = (uploaded.value - before) / (time.perf_counter() - start) / 1e6
+        stop_event.set()
+        uploader.join()
+        results["bulk"] = (latencies, throughput)
+        for phase, (latencies, throughput) in results.items():
+            bulk_text = f"{throughput:9.0f}" if throughput is not None else f"{'-':>9}"
+            print(f"{label:<10} {phase:<5} {len(latencies):7d} {percentile(latencies, 0.5) * 1000:8.2f} "
+                  f"{percentile(latencies, 0.99) * 1000:8.2f} {bulk_text}")
+    finally:
+        for datanode in datanodes:
+            stop(datanode)
+        stop(namenode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--read-mb", type=int, default=64)
+    parser.add_argument("--pread-kb", type=int, default=64)
+    parser.add_argument("--read-rate", type=float, default=200, help="reads per second")
+    parser.add_argument("--file-mb", type=int, default=64)
+    parser.add_argument("--chunk-mb", type=int, default=4)
+    parser.add_argument("--bulk-workers", type=int, default=16)
+    parser.add_argument("--max-streams", type=int, default=8)
+    parser.add_argument("--bandwidth-mb", type=float, default=50)
+    args = parser.parse_args()
+    print(f"{args.read_rate:g}/s {args.pread_kb} KB reads of a {args.read_mb} MB file; bulk: {args.bulk_workers} "
+          f"streams of {args.chunk_mb} MB chunks; scheduled: {args.max_streams} streams, {args.bandwidth_mb:g} MB/s "
+          f"per DataNode")
+    print(f"{'setup':<10} {'phase':<5} {'reads':>7} {'p50 ms':>8} {'p99 ms':>8} {'bulk MB/s':>9}")
+    with tempfile.TemporaryDirectory() as workdir:
+        run(args, workdir, "unlimited", ["--max-streams", "100000"])
+        run(args, workdir, "scheduled", ["--max-streams", str(args.max_streams),
+                                         "--bandwidth-mb", str(args.bandwidth_mb)])
+
+
+if __name__ == "__main__":
+    main()
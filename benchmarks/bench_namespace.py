@@ -0,0 +1,100 @@
+"""Path lookup and paged listing latency for large directories.
+
+Fills one directory with --entries files (plus --other files elsewhere in
+the tree) and times random path lookups, single listing pages and a full
+paged scan of the directory. For comparison, listing the same directory in
+the old flat layout (one dict keyed by full path) means scanning and
+sorting every key.
+
+    python benchmarks/bench_namespace.py [--entries 100000] [--other 100000] [--lookups 100000]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from namespace import LISTING_LIMIT, INodeFile, Namespace  # noqa: E402
+
+
+def make_inode(namespace):
+    return INodeFile(64 * 1024 * 1024, 64 * 1024 * 1024, namespace.allocate_blocks(1), 1,
+                     ("10.0.0.1:5001", "10.0.0.2:5001"), complete=True)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return (statistics.median(samples) * 1e6, samples[int(len(samples) * 0.99) - 1] * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--other", type=int, default=100000, help="files in other directories")
+    parser.add_argument("--lookups", type=int, default=100000)
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    namespace = Namespace()
+    flat = {}
+    start = time.perf_counter()
+    for i in range(args.entries):
+        path = f"/data/big/part-{rng.getrandbits(48):012x}"
+        namespace.add_file(path, make_inode(namespace))
+        flat[path] = namespace.get_file(path)
+    elapsed = time.perf_counter() - start
+    print(f"create {args.entries} files in one directory: {elapsed:.2f}s "
+          f"({elapsed / args.entries * 1e6:.1f} us/file)")
+    for i in range(args.other):
+        path = f"/logs/{i % 100}/file-{i}"
+        namespace.add_file(path, make_inode(namespace))
+        flat[path] = namespace.get_file(path)
+    names = namespace.lookup("/data/big").names
+
+    paths = [f"/data/big/{rng.choice(names)}" for _ in range(args.lookups)]
+    samples = []
+    for path in paths:
+        t = time.perf_counter()
+        namespace.lookup(path)
+        samples.append(time.perf_counter() - t)
+    p50, p99 = percentiles(samples)
+    print(f"{'lookup':<34} p50 {p50:>8.2f} us  p99 {p99:>8.2f} us")
+
+    samples = []
+    for _ in range(200):
+        cursor = rng.choice(names)
+        t = time.perf_counter()
+        entries, _ = namespace.listing("/data/big", cursor, LISTING_LIMIT)
+        json.dumps({"status": "ok", "entries": entries, "has_more": True})
+        samples.append(time.perf_counter() - t)
+    p50, p99 = percentiles(samples)
+    print(f"{f'listing page ({LISTING_LIMIT}, incl. JSON)':<34} p50 {p50:>8.2f} us  p99 {p99:>8.2f} us")
+
+    t = time.perf_counter()
+    cursor, pages, listed = None, 0, 0
+    while True:
+        entries, has_more = namespace.listing("/data/big", cursor, LISTING_LIMIT)
+        pages += 1
+        listed += len(entries)
+        if not has_more:
+            break
+        cursor = entries[-1]["name"]
+    elapsed = time.perf_counter() - t
+    print(f"{'full paged listing':<34} {elapsed * 1000:>8.1f} ms for {listed} entries in {pages} pages")
+
+    samples = []
+    for _ in range(5):
+        t = time.perf_counter()
+        prefix = "/data/big/"
+        children = sorted(p[len(prefix):] for p in flat if p.startswith(prefix) and "/" not in p[len(prefix):])
+        children[:LISTING_LIMIT]
+        samples.append(time.perf_counter() - t)
+    print(f"{'flat dict: one listing page':<34} {statistics.median(samples) * 1000:>8.1f} ms "
+          f"(scans all {len(flat)} paths)")
+
+
+if __name__ == "__main__":
+    main()
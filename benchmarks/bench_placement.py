@@ -0,0 +1,80 @@
+"""Placement balance and allocation cost for large files on a simulated cluster.
+
+Simulates --nodes DataNodes spread over --racks racks with uneven free space
+and load, allocates --files files of --chunks chunks each, and reports how
+evenly bytes land relative to each node's capacity, how many chunks keep
+all replicas in one rack, and how long allocation takes. Busy nodes are
+deliberately given less, so the weighted policy's fill CV is not zero.
+
+    python benchmarks/bench_placement.py [--nodes 100] [--racks 10] [--chunks 10000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from placement import PlacementPolicy, node_id  # noqa: E402
+
+CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def make_cluster(num_nodes, num_racks, rng):
+    nodes = []
+    for i in range(num_nodes):
+        nodes.append({
+            "host": f"10.0.{i // 250}.{i % 250 + 1}",
+            "port": 5001,
+            "rack": f"/rack-{i % num_racks}",
+            # Disks between 2 and 16 TB free, a few nodes busy serving reads
+            "free_bytes": rng.randint(2, 16) * 1024 ** 4,
+            "inflight": rng.choice([0, 0, 0, 1, 4]),
+            "throughput": rng.choice([0, 0, 50, 200]) * 1024 * 1024,
+        })
+    return nodes
+
+
+def report(label, nodes, allocations, elapsed, num_chunks):
+    counts = {node_id(n): 0 for n in nodes}
+    same_rack = 0
+    for replicas in allocations:
+        for n in replicas:
+            counts[node_id(n)] += 1
+        if len({n["rack"] for n in replicas}) == 1:
+            same_rack += 1
+    # Fill ratio = bytes placed per TB of free space; perfectly balanced placement makes it equal
+    fill = [counts[node_id(n)] * CHUNK_SIZE / n["free_bytes"] * 1024 ** 4 / 1024 ** 3 for n in nodes]
+    used = sum(1 for c in counts.values() if c)
+    print(f"{label:<22} {elapsed * 1000:>9.1f} ms  {elapsed / num_chunks * 1e6:>7.2f} us/chunk  "
+          f"nodes used {used:>3}/{len(nodes)}  max chunks/node {max(counts.values()):>6}  "
+          f"fill CV {statistics.pstdev(fill) / statistics.mean(fill):>5.2f}  "
+          f"single-rack chunks {same_rack / len(allocations):>6.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=100)
+    parser.add_argument("--racks", type=int, default=10)
+    parser.add_argument("--chunks", type=int, default=10000)
+    parser.add_argument("--files", type=int, default=5)
+    parser.add_argument("--replication", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    nodes = make_cluster(args.nodes, args.racks, rng)
+
+    policy = PlacementPolicy(args.replication, rng=random.Random(args.seed))
+    for label, allocate in (("first-N (old)", lambda n, c, s: [n[:args.replication] for _ in range(c)]),
+                            ("weighted + rack-aware", policy.allocate)):
+        allocations = []
+        start = time.perf_counter()
+        for _ in range(args.files):
+            allocations += allocate(nodes, args.chunks, CHUNK_SIZE)
+        elapsed = time.perf_counter() - start
+        report(label, nodes, allocations, elapsed / args.files, args.chunks)
+
+
+if __name__ == "__main__":
+    main()
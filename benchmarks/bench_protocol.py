@@ -0,0 +1,164 @@
+"""Wire protocol microbenchmarks: frame encode/decode, RPC round trips and bulk receive.
+
+  frames  encode and decode times of typical messages in v1 (length + JSON)
+          and v2 (binary header + JSON or, if installed, msgpack body)
+  rpc     request/response round trips over a socketpair in each framing
+  bulk    receiving --bulk-mb of raw chunk data: 4 KB recv() calls joined
+          with `data += piece` (how the original DataNode and client read)
+          against recv_into a preallocated buffer
+
+    python benchmarks/bench_protocol.py [--iterations 20000] [--bulk-mb 256]
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+import protocol  # noqa: E402
+from protocol import CODECS, FRAME_HEADER, decode_frame, encode_frame, recv_message, send_message  # noqa: E402
+
+MESSAGES = {
+    "get_file": {"message_type": "get_file", "chunk_id": "blk_1234567", "checksums": True,
+                 "offset": 4194304, "length": 4194304, "request_id": 17},
+    "download reply": {"status": "ok", "size": 1 << 30, "chunk_size": 64 << 20, "generation": 1792265861216221033,
+                       "chunks": [{"chunk_id": f"blk_{1000 + i}",
+                                   "datanodes": [{"host": "10.0.1.17", "port": 5001},
+                                                 {"host": "10.0.2.4", "port": 5001, "cached": True}]}
+                                  for i in range(16)], "request_id": 17},
+    "heartbeat": {"action": "heartbeat", "datanode_host": "10.0.1.17", "datanode_port": 5001,
+                  "rack": "/rack-1", "capacity_bytes": 4 << 40, "used_bytes": 1 << 40, "free_bytes": 3 << 40,
+                  "inflight": 3, "throughput": 123456789.0,
+                  "block_report": {"added": [f"blk_{i}" for i in range(1000)], "removed": []}, "request_id": 17},
+}
+
+
+def framings():
+    yield "v1 json", 1, 0
+    for codec, (name, _, _) in CODECS.items():
+        yield f"v2 {name}", 2, codec
+
+
+def per_call_us(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def bench_frames(iterations):
+    print(f"{'message':<16} {'framing':<12} {'bytes':>7} {'encode us':>10} {'decode us':>10}")
+    for label, message in MESSAGES.items():
+        n = max(100, iterations // (50 if label == "heartbeat" else 1))
+        for name, version, codec in framings():
+            frame = encode_frame(message, version, codec)
+            if version == 1:
+                def decode(body=frame[4:]):
+                    return protocol.json.loads(body)
+            else:
+                def decode(header=frame[:FRAME_HEADER.size], body=frame[FRAME_HEADER.size:]):
+                    return decode_frame(header, body)
+            assert (decode() if version == 1 else decode()[0]) == message
+            encode_us = per_call_us(lambda: encode_frame(message, version, codec), n)
+            decode_us = per_call_us(decode, n)
+            print(f"{label:<16} {name:<12} {len(frame):>7} {encode_us:>10.2f} {decode_us:>10.2f}")
+
+
+def bench_rpc(iterations):
+    message = MESSAGES["get_file"]
+    print(f"{'framing':<12} {'round trips/s':>14}")
+    for name, version, codec in framings():
+        client, server = socket.socketpair()
+        if version > 1:
+            protocol._framing[client] = (version, codec)
+
+        def echo():
+            while True:
+                request = recv_message(server)
+                if request is None:
+                    return
+                send_message(server, {"status": "ok", "request_id": request["request_id"]})
+        thread = threading.Thread(target=echo)
+        thread.start()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            send_message(client, message)
+            recv_message(client)
+        elapsed = time.perf_counter() - start
+        client.close()
+        thread.join()
+        server.close()
+        print(f"{name:<12} {iterations / elapsed:>14.0f}")
+
+
+def bench_bulk(size):
+    payload = memoryview(os.urandom(1 << 20))
+
+    def run(receive, nbytes):
+        sender, receiver = socket.socketpair()
+
+        def send():
+            remaining = nbytes
+            while remaining:
+                n = min(remaining, len(payload))
+                sender.sendall(payload[:n])
+                remaining -= n
+            sender.close()
+        thread = threading.Thread(target=send)
+        start = time.perf_counter()
+        thread.start()
+        received = receive(receiver, nbytes)
+        elapsed = time.perf_counter() - start
+        thread.join()
+        receiver.close()
+        assert received == nbytes
+        return nbytes / elapsed / 1e6
+
+    def concatenate(sock, nbytes):
+        data = b""
+        while len(data) < nbytes:
+            piece = sock.recv(4096)
+            if not piece:
+                break
+            data += piece
+        return len(data)
+
+    def recv_into(sock, nbytes):
+        buf = bytearray(1 << 20)
+        view = memoryview(buf)
+        received = 0
+        while received < nbytes:
+            n = sock.recv_into(view, min(len(buf), nbytes - received))
+            if not n:
+                break
+            received += n
+        return received
+
+    # Concatenation is quadratic, so it gets a smaller transfer
+    small = min(size, 32 << 20)
+    print(f"{'receive loop':<28} {'MB':>6} {'MB/s':>9}")
+    print(f"{'4 KB recv + concatenation':<28} {small >> 20:>6} {run(concatenate, small):>9.0f}")
+    print(f"{'recv_into 1 MB buffer':<28} {size >> 20:>6} {run(recv_into, size):>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--bulk-mb", type=int, default=256)
+    args = parser.parse_args()
+    if protocol.msgpack is None:
+        print("(msgpack is not installed; v2 frames use JSON bodies)")
+    bench_frames(args.iterations)
+    print()
+    bench_rpc(args.iterations)
+    print()
+    bench_bulk(args.bulk_mb << 20)
+
+
+if __name__ == "__main__":
+    main()
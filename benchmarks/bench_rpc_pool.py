@@ -0,0 +1,67 @@
+"""Small-RPC latency to a loopback NameNode with and without the connection pool.
+
+    python benchmarks/bench_rpc_pool.py [--calls 2000] [--threads 16]
+"""
+import argparse
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, start_namenode, stop  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+from protocol import ConnectionPool, recv_message, send_message  # noqa: E402
+
+MESSAGE = {"action": "download", "name": "no-such-file"}
+
+
+def fresh_call(port):
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        send_message(s, MESSAGE)
+        return recv_message(s)
+
+
+def timed(fn, calls, threads):
+    samples = []
+
+    def one(_):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(calls)))
+    elapsed = time.perf_counter() - start
+    samples.sort()
+    return calls / elapsed, statistics.median(samples) * 1e6, samples[int(len(samples) * 0.99)] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        proc, port = start_namenode(workdir)
+        pool = ConnectionPool()
+        try:
+            print(f"{'mode':<38} {'calls/s':>9} {'p50 us':>9} {'p99 us':>9}")
+            for threads in (1, args.threads):
+                for label, fn in (("new connection per RPC", lambda: fresh_call(port)),
+                                  ("pooled, multiplexed", lambda: pool.call("127.0.0.1", port, MESSAGE))):
+                    rate, p50, p99 = timed(fn, args.calls, threads)
+                    print(f"{label + f' ({threads} threads)':<38} {rate:>9.0f} {p50:>9.0f} {p99:>9.0f}")
+        finally:
+            pool.close()
+            stop(proc)
+
+
+if __name__ == "__main__":
+    main()
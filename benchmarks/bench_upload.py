@@ -0,0 +1,93 @@
+"""Sequential vs parallel pipelined uploads to N loopback DataNodes.
+
+The NameNode is replaced by a stub that spreads chunks round-robin over the
+DataNodes, so only the client -> DataNode data path is measured.
+
+    python benchmarks/bench_upload.py [--datanodes 3] [--replication 2] [--file-mb 256] [--chunk-mb 16]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, start_datanode, stop  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+from checksum import META_SUFFIX  # noqa: E402
+from transfer import UploadEngine  # noqa: E402
+
+
+def stub_namenode(ports, replication):
+    allocated = {}  # lease ID (the file name) -> chunks allocated so far
+
+    def request(message):
+        if message["action"] == "create":
+            allocated[message["path"]] = 0
+            return {"status": "ok", "lease_id": message["path"]}
+        if message["action"] == "add_block":
+            allocations = []
+            for _ in range(message["count"]):
+                i = allocated[message["lease_id"]]
+                allocated[message["lease_id"]] += 1
+                targets = [ports[(i + r) % len(ports)] for r in range(replication)]
+                allocations.append({
+                    "chunk_id": f"{message['lease_id']}_chunk_{i}",
+                    "datanodes": [{"host": "127.0.0.1", "port": port} for port in targets]
+                })
+            return {"status": "ok", "chunk_allocations": allocations}
+        return {"status": "ok"}
+    return request
+
+
+def run(label, engine, path, name, file_size, replication):
+    start = time.perf_counter()
+    engine.upload(path, name)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {elapsed:>7.2f}s  {file_size / elapsed / 1e6:>8.1f} MB/s of file data, "
+          f"{file_size * replication / elapsed / 1e6:>8.1f} MB/s replicated")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--datanodes", type=int, default=3)
+    parser.add_argument("--replication", type=int, default=2)
+    parser.add_argument("--file-mb", type=int, default=256)
+    parser.add_argument("--chunk-mb", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    chunk_size = args.chunk_mb * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "source.bin")
+        with open(path, "wb") as f:
+            for _ in range(args.file_mb):
+                f.write(os.urandom(1024 * 1024))
+        file_size = os.path.getsize(path)
+
+        procs, ports = [], []
+        try:
+            for i in range(args.datanodes):
+                proc, port = start_datanode(os.path.join(workdir, f"dn{i}"))
+                procs.append(proc)
+                ports.append(port)
+            request = stub_namenode(ports, args.replication)
+
+            sequential = UploadEngine(request=request, max_workers=1, chunk_size=chunk_size, pipeline=False)
+            run("sequential (1 stream, client fan-out)", sequential, path, "seq.bin", file_size, args.replication)
+
+            pipelined = UploadEngine(request=request, max_workers=args.workers, chunk_size=chunk_size, pipeline=True)
+            run(f"pipelined ({pipelined.streams} streams)", pipelined, path, "pipe.bin", file_size, args.replication)
+
+            stored = sum(os.path.getsize(os.path.join(workdir, f"dn{i}", f))
+                         for i in range(args.datanodes) for f in os.listdir(os.path.join(workdir, f"dn{i}"))
+                         if f.startswith("pipe.bin") and not f.endswith(META_SUFFIX))
+            assert stored == file_size * args.replication, "pipelined upload stored the wrong number of bytes"
+        finally:
+            for proc in procs:
+                stop(proc)
+
+
+if __name__ == "__main__":
+    main()
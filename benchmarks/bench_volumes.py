@@ -0,0 +1,148 @@
+"""Aggregate write throughput of a DataNode with one storage volume and with several.
+
+  writer   in-process: --writers threads each store --chunks chunks of
+           --chunk-mb through a VolumeSet (ChunkWriter on the volumes' I/O
+           threads), with 1 volume and with --volumes volumes, with and
+           without batched fsync (--sync-writes); reports MB/s and, with
+           fsync, the fsyncs of the directory per chunk
+  cluster  a loopback NameNode and 2 DataNodes, each with 1 volume and then
+           with --volumes volumes; --clients clients put --files files of
+           --file-mb concurrently; reports aggregate MB/s
+
+Volumes are directories under --root (default /dev/shm, i.e. tmpfs), so
+the numbers show the cost of the write path itself rather than of disks;
+point --root at a directory on real disks (one subdirectory per disk)
+to measure those.
+
+    python benchmarks/bench_volumes.py [--volumes 4] [--writers 8] [--clients 4] [--root /dev/shm]
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, start_datanode, start_namenode, stop  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+import volumes as volumes_module  # noqa: E402
+from client import DFSClient  # noqa: E402
+from volumes import ChunkWriter, VolumeSet  # noqa: E402
+
+
+def store(volume_set, chunk_id, data, sync):
+    """What DataNode.store_chunk does with a chunk's bytes, minus the network and checksums."""
+    volume = volume_set.choose(chunk_id, len(data))
+    path = volume.file(chunk_id)
+    try:
+        writer = ChunkWriter(volume, path + ".tmp", len(data))
+        for position in range(0, len(data), writer.buffer_size):
+            buf = writer.buffer()
+            piece = data[position:position + len(buf)]
+            buf[:len(piece)] = piece
+            writer.write(buf, len(piece))
+        writer.close()
+        os.replace(path + ".tmp", path)
+        volume_set.added(chunk_id, volume)
+        if sync:
+            volume.sync([path])
+    finally:
+        volume_set.release(volume, len(data))
+
+
+def run_writer(args, root):
+    data = memoryview(os.urandom(args.chunk_mb * 1024 * 1024))
+    total = args.writers * args.chunks * len(data)
+    print(f"writer: {args.writers} threads x {args.chunks} chunks of {args.chunk_mb} MB")
+    print(f"  {'volumes':>7} {'fsync':<6} {'MB/s':>8} {'dir fsyncs/chunk':>17}")
+    for count in (1, args.volumes):
+        for sync in (False, True):
+            workdir = tempfile.mkdtemp(dir=root)
+            try:
+                paths = [os.path.join(workdir, f"v{i}") for i in range(count)]
+                for path in paths:
+                    os.makedirs(path)
+                volume_set = VolumeSet([("HDD", path) for path in paths])
+                batches = [0]
+                lock = threading.Lock()
+                for volume in volume_set.volumes:
+                    original = volume._sync_batch
+
+                    def counted(batch, original=original):
+                        with lock:
+                            batches[0] += 1
+                        original(batch)
+                    volume._sync_batch = counted
+
+                def writer(w):
+                    for i in range(args.chunks):
+                        store(volume_set, f"blk_{w}_{i}", data, sync)
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.writers) as pool:
+                    list(pool.map(writer, range(args.writers)))
+                elapsed = time.perf_counter() - start
+                per_chunk = f"{batches[0] / (args.writers * args.chunks):.2f}" if sync else "-"
+                print(f"  {count:>7} {'on' if sync else 'off':<6} {total / elapsed / 1e6:8.0f} {per_chunk:>17}")
+                for volume in volume_set.volumes:
+                    volume.io.shutdown()
+            finally:
+                shutil.rmtree(workdir)
+
+
+def run_cluster(args, root):
+    data = os.urandom(args.file_mb * 1024 * 1024)
+    total = args.clients * args.files * len(data)
+    print(f"cluster: 2 DataNodes, {args.clients} clients x {args.files} files of {args.file_mb} MB, 2 replicas")
+    print(f"  {'volumes':>7} {'MB/s':>8}")
+    for count in (1, args.volumes):
+        workdir = tempfile.mkdtemp(dir=root)
+        try:
+            namenode, port = start_namenode(workdir)
+            datanodes = [start_datanode(",".join(os.path.join(workdir, f"dn{d}", f"v{i}") for i in range(count)),
+                                        namenode_port=port)[0] for d in range(2)]
+            try:
+                time.sleep(2)  # First heartbeats
+
+                def client(c):
+                    dfs = DFSClient("127.0.0.1", port, chunk_size=args.chunk_mb * 1024 * 1024)
+                    for i in range(args.files):
+                        dfs.put_stream(io.BytesIO(data), f"/bench/{c}/{i}")
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.clients) as pool:
+                    list(pool.map(client, range(args.clients)))
+                elapsed = time.perf_counter() - start
+                print(f"  {count:>7} {total / elapsed / 1e6:8.0f}")
+            finally:
+                for datanode in datanodes:
+                    stop(datanode)
+                stop(namenode)
+        finally:
+            shutil.rmtree(workdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--volumes", type=int, default=4)
+    parser.add_argument("--root", default="/dev/shm" if os.path.isdir("/dev/shm") else None,
+                        help="directory to create the volumes in")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--chunks", type=int, default=8)
+    parser.add_argument("--chunk-mb", type=int, default=16)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--file-mb", type=int, default=32)
+    args = parser.parse_args()
+    print(f"write size {volumes_module.WRITE_SIZE // 1024} KB, {volumes_module.WRITE_BUFFERS} buffers per chunk, "
+          f"{volumes_module.IO_THREADS} I/O threads per volume, volumes under {args.root or tempfile.gettempdir()}")
+    run_writer(args, args.root)
+    print()
+    run_cluster(args, args.root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Load test for the NameNode RPC server.
+
+Opens many concurrent persistent connections to a loopback NameNode and
+drives a mix of heartbeat, upload and download RPCs, then reports
+requests/s and latency percentiles per action.
+
+    python benchmarks/loadtest_namenode.py [--connections 1000] [--duration 10]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import start_namenode, stop  # noqa: E402
+
+MIX = {"heartbeat": 0.5, "upload": 0.2, "download": 0.3}
+SEED_FILES = 100
+
+
+async def rpc(reader, writer, message):
+    data = json.dumps(message).encode()
+    writer.write(len(data).to_bytes(4, byteorder='big') + data)
+    await writer.drain()
+    length = int.from_bytes(await reader.readexactly(4), byteorder='big')
+    return json.loads(await reader.readexactly(length))
+
+
+def make_request(action, conn_id, seq):
+    if action == "heartbeat":
+        return {"action": "heartbeat", "datanode_host": "10.0.0.%d" % (conn_id % 250 + 1),
+                "datanode_port": 5001 + conn_id // 250}
+    if action == "upload":
+        return {"action": "upload", "name": f"load_{conn_id}_{seq}", "filesize": 1024, "num_chunks": 1}
+    return {"action": "download", "name": f"seed_{random.randrange(SEED_FILES)}"}
+
+
+async def run(port, connections, duration):
+    # Register DataNodes and seed files that downloads can find
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for i in range(3):
+        await rpc(reader, writer, {"action": "heartbeat", "datanode_host": "127.0.0.1", "datanode_port": 6000 + i})
+    for i in range(SEED_FILES):
+        await rpc(reader, writer, {"action": "upload", "name": f"seed_{i}", "filesize": 1024, "num_chunks": 1})
+    writer.close()
+
+    latencies = {action: [] for action in MIX}
+    latencies["errors"] = []
+    start_barrier = asyncio.Event()
+    all_connected = asyncio.Event()
+    connected = 0
+    deadline = float("inf")
+    connect_limit = asyncio.Semaphore(200)  # Avoid overflowing the accept backlog while connecting
+
+    async def connect_and_run(conn_id):
+        nonlocal connected
+        async with connect_limit:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        connected += 1
+        if connected == connections:
+            all_connected.set()
+        await start_barrier.wait()
+        actions, weights = zip(*MIX.items())
+        seq = 0
+        try:
+            while time.perf_counter() < deadline:
+                action = random.choices(actions, weights)[0]
+                start = time.perf_counter()
+                response = await rpc(reader, writer, make_request(action, conn_id, seq))
+                latencies[action].append(time.perf_counter() - start)
+                if response.get("status") not in ("ok", "success"):
+                    latencies["errors"].append(response)
+                seq += 1
+        finally:
+            writer.close()
+
+    tasks = [asyncio.create_task(connect_and_run(conn_id)) for conn_id in range(connections)]
+    # Start the clock only once every client holds an open connection
+    await all_connected.wait()
+    started = time.perf_counter()
+    deadline = started + duration
+    start_barrier.set()
+    await asyncio.gather(*tasks)
+    return latencies, time.perf_counter() - started
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        proc, port = start_namenode(workdir)
+        try:
+            latencies, elapsed = asyncio.run(run(port, args.connections, args.duration))
+        finally:
+            stop(proc)
+
+    total = sum(len(latencies[a]) for a in MIX)
+    print(f"{args.connections} connections, {elapsed:.1f}s, {total / elapsed:.0f} requests/s total, "
+          f"{len(latencies['errors'])} errors")
+    print(f"{'action':<10} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for action in MIX:
+        samples = sorted(latencies[action])
+        if samples:
+            print(f"{action:<10} {len(samples) / elapsed:>9.0f} {percentile(samples, 0.5):>9.2f} "
+                  f"{percentile(samples, 0.99):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Helpers for running a NameNode and DataNodes as loopback processes."""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def start_datanode(storage_dir, port=None, namenode_port=0, quiet=True, extra_args=()):
+    """Start a DataNode process on loopback and return (process, port)."""
+    port = port or free_port()
+    cmd = [sys.executable, os.path.join(REPO_DIR, "DataNode.py"),
+           "--port", str(port), "--storage-dir", storage_dir,
+           "--namenode-host", "127.0.0.1", "--namenode-port", str(namenode_port),
+           "--advertise-host", "127.0.0.1", *extra_args]
+    out = subprocess.DEVNULL if quiet else None
+    proc = subprocess.Popen(cmd, stdout=out, stderr=out)
+    wait_for_port(port)
+    return proc, port
+
+
+def start_namenode(workdir, port=None, quiet=True, extra_args=()):
+    """Start a NameNode process on loopback with its metadata in `workdir`. Returns (process, port)."""
+    port = port or free_port()
+    cmd = [sys.executable, os.path.join(REPO_DIR, "NameNode.py"), "--host", "127.0.0.1", "--port", str(port),
+           *extra_args]
+    out = subprocess.DEVNULL if quiet else None
+    proc = subprocess.Popen(cmd, cwd=workdir, stdout=out, stderr=out)
+    wait_for_port(port)
+    return proc, port
+
+
+def process_usage(proc):
+    """CPU seconds used so far and current and peak resident memory of a process, from /proc (Linux).
+
+    Returns None where /proc is not available.
+    """
+    try:
+        with open(f"/proc/{proc.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{proc.pid}/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    return {"cpu_seconds": (int(fields[11]) + int(fields[12])) / ticks,  # utime + stime
+            "rss_bytes": int(status["VmRSS"].split()[0]) * 1024,
+            "peak_rss_bytes": int(status["VmHWM"].split()[0]) * 1024}
+
+
+def kill(proc):
+    """Kill a process without giving it a chance to clean up (simulated crash)."""
+    proc.kill()
+    proc.wait()
+
+
+def stop(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
@@ -0,0 +1,110 @@
+"""Time to restore full replication after a DataNode crash.
+
+Starts a NameNode and --datanodes DataNodes as loopback processes, uploads a
+--file-mb file in --chunk-mb chunks, SIGKILLs one DataNode holding replicas,
+and polls the NameNode until every chunk is back at full replication. Then
+downloads the file and checks it against the original.
+
+    python benchmarks/replication_harness.py [--datanodes 4] [--file-mb 64] [--chunk-mb 4] [--dead-node-timeout 6]
+"""
+import argparse
+import functools
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localcluster import REPO_DIR, kill, start_datanode, start_namenode, stop  # noqa: E402
+
+sys.path.insert(0, REPO_DIR)
+from transfer import DownloadEngine, UploadEngine, namenode_request  # noqa: E402
+
+REPLICATION = 2
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def replica_counts(request, name):
+    response = request({"action": "download", "name": name})
+    return [len(chunk["datanodes"]) for chunk in response["chunks"]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--datanodes", type=int, default=4)
+    parser.add_argument("--file-mb", type=int, default=64)
+    parser.add_argument("--chunk-mb", type=int, default=4)
+    parser.add_argument("--dead-node-timeout", type=float, default=6)
+    parser.add_argument("--heartbeat-interval", type=float, default=1)
+    parser.add_argument("--max-wait", type=float, default=120)
+    parser.add_argument("--verbose", action="store_true", help="show NameNode and DataNode output")
+    args = parser.parse_args()
+
+    quiet = not args.verbose
+    with tempfile.TemporaryDirectory() as workdir:
+        namenode, nn_port = start_namenode(workdir, quiet=quiet,
+                                           extra_args=["--dead-node-timeout", str(args.dead_node_timeout)])
+        request = functools.partial(namenode_request, host="127.0.0.1", port=nn_port)
+        datanodes = {}
+        try:
+            for i in range(args.datanodes):
+                proc, port = start_datanode(os.path.join(workdir, f"dn{i}"), namenode_port=nn_port, quiet=quiet,
+                                            extra_args=["--heartbeat-interval", str(args.heartbeat_interval)])
+                datanodes[f"127.0.0.1:{port}"] = proc
+            time.sleep(args.heartbeat_interval * 2)  # First heartbeats register the DataNodes
+
+            source = os.path.join(workdir, "input.bin")
+            with open(source, "wb") as f:
+                for _ in range(args.file_mb):
+                    f.write(os.urandom(1024 * 1024))
+            UploadEngine(request, chunk_size=args.chunk_mb * 1024 * 1024).upload(source, "replicated.bin")
+            # Let every DataNode send the incremental block report listing the new chunks
+            time.sleep(args.heartbeat_interval * 3)
+
+            response = request({"action": "download", "name": "replicated.bin"})
+            holdings = {}
+            for chunk in response["chunks"]:
+                for dn in chunk["datanodes"]:
+                    key = f"{dn['host']}:{dn['port']}"
+                    holdings[key] = holdings.get(key, 0) + 1
+            victim = max(holdings, key=holdings.get)
+            print(f"{len(response['chunks'])} chunks x {REPLICATION} replicas on {len(datanodes)} DataNodes; "
+                  f"killing {victim} ({holdings[victim]} replicas)")
+            kill(datanodes.pop(victim))
+            killed_at = time.time()
+
+            detected_at = None
+            while True:
+                counts = replica_counts(request, "replicated.bin")
+                if detected_at is None and min(counts) < REPLICATION:
+                    detected_at = time.time()
+                    print(f"  node declared dead after {detected_at - killed_at:.1f}s, "
+                          f"{sum(1 for c in counts if c < REPLICATION)} chunks under-replicated")
+                if detected_at is not None and min(counts) >= REPLICATION:
+                    break
+                if time.time() - killed_at > args.max_wait:
+                    raise SystemExit(f"Replication not restored after {args.max_wait}s: {counts}")
+                time.sleep(0.2)
+            repaired_at = time.time()
+            print(f"  re-replicated {holdings[victim]} replicas in {repaired_at - detected_at:.1f}s "
+                  f"({repaired_at - killed_at:.1f}s after the crash)")
+
+            restored = os.path.join(workdir, "output.bin")
+            DownloadEngine(request).download("replicated.bin", restored)
+            print(f"  download after repair matches: {sha256(source) == sha256(restored)}")
+        finally:
+            for proc in datanodes.values():
+                stop(proc)
+            stop(namenode)
+
+
+if __name__ == "__main__":
+    main()
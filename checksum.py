@@ -0,0 +1,129 @@
+# checksum.py
+"""Per-chunk checksums: one CRC per BYTES_PER_CHECKSUM sub-block, kept in a sidecar file."""
+import json
+import os
+import zlib
+
+try:
+    import crc32c as _crc32c
+except ImportError:
+    _crc32c = None
+
+BYTES_PER_CHECKSUM = 512 * 1024
+META_SUFFIX = ".meta"  # Sidecar file name: <chunk file><META_SUFFIX>
+
+# CRC functions with the zlib.crc32(data, value) signature, by name
+ALGORITHMS = {"crc32": zlib.crc32}
+if _crc32c is not None:
+    ALGORITHMS["crc32c"] = _crc32c.crc32c
+DEFAULT_ALGORITHM = "crc32c" if "crc32c" in ALGORITHMS else "crc32"
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+def checksum_function(algorithm):
+    try:
+        return ALGORITHMS[algorithm]
+    except KeyError:
+        raise ChecksumError(f"Unsupported checksum algorithm: {algorithm}")
+
+
+def sidecar_path(chunk_file):
+    return chunk_file + META_SUFFIX
+
+
+def write_sidecar(chunk_file, checksums, algorithm=DEFAULT_ALGORITHM, bytes_per_checksum=BYTES_PER_CHECKSUM):
+    """Atomically store the checksums of `chunk_file` next to it."""
+    path = sidecar_path(chunk_file)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"algorithm": algorithm, "bytes_per_checksum": bytes_per_checksum, "checksums": checksums},
+                  f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def read_sidecar(chunk_file):
+    """Return the sidecar of `chunk_file` as a dict, or None if it has none."""
+    try:
+        with open(sidecar_path(chunk_file), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class StreamingChecksum:
+    """Checksums data fed in arbitrary pieces, one CRC per sub-block."""
+
+    def __init__(self, algorithm=DEFAULT_ALGORITHM, bytes_per_checksum=BYTES_PER_CHECKSUM):
+        self.algorithm = algorithm
+        self.bytes_per_checksum = bytes_per_checksum
+        self.crc = checksum_function(algorithm)
+        self.checksums = []
+        self.current = 0
+        self.filled = 0  # Bytes of the current sub-block seen so far
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            n = min(len(view), self.bytes_per_checksum - self.filled)
+            self.current = self.crc(view[:n], self.current)
+            self.filled += n
+            view = view[n:]
+            if self.filled == self.bytes_per_checksum:
+                self.checksums.append(self.current)
+                self.current = 0
+                self.filled = 0
+
+    def finish(self):
+        """Return the checksum list, including the trailing partial sub-block."""
+        if self.filled:
+            self.checksums.append(self.current)
+            self.current = 0
+            self.filled = 0
+        return self.checksums
+
+
+class StreamingVerifier(StreamingChecksum):
+    """Checks data fed in pieces against stored checksums as each sub-block completes.
+
+    `offset` is the position in the chunk where the data starts and
+    `checksums` the stored CRCs from the sub-block containing it onwards.
+    Bytes before the first sub-block boundary of an unaligned start cannot
+    be checked and are skipped.
+    """
+
+    def __init__(self, checksums, algorithm=DEFAULT_ALGORITHM, bytes_per_checksum=BYTES_PER_CHECKSUM, offset=0):
+        super().__init__(algorithm, bytes_per_checksum)
+        self.expected = checksums
+        self.skip = -offset % bytes_per_checksum
+        if self.skip:
+            self.expected = checksums[1:]
+        self.base = offset + self.skip  # Chunk offset of the first checked byte
+        self.checked = 0
+
+    def update(self, data):
+        if self.skip:
+            skipped = min(self.skip, len(data))
+            self.skip -= skipped
+            data = memoryview(data)[skipped:]
+        super().update(data)
+        self._check()
+
+    def finish(self, at_end=True):
+        """Check the trailing partial sub-block; only valid if the data ran to the end of the chunk."""
+        if at_end:
+            super().finish()
+            self._check()
+            if len(self.checksums) != len(self.expected):
+                raise ChecksumError(f"Chunk has {len(self.checksums)} sub-blocks, "
+                                    f"checksums cover {len(self.expected)}")
+
+    def _check(self):
+        while self.checked < len(self.checksums):
+            i = self.checked
+            if i >= len(self.expected) or self.checksums[i] != self.expected[i]:
+                start = self.base + i * self.bytes_per_checksum
+                raise ChecksumError(f"Checksum mismatch in bytes {start}-{start + self.bytes_per_checksum}")
+            self.checked += 1
@@ -0,0 +1,170 @@
+# chunkcache.py
+"""Size-aware, scan-resistant cache of hot chunks (TinyLFU admission over a segmented LRU)."""
+import threading
+import zlib
+from collections import OrderedDict
+
+SKETCH_WIDTH = 4096  # Counters per row of the frequency sketch (a power of two)
+SKETCH_DEPTH = 4  # Rows (independent hashes) of the frequency sketch
+MAX_FREQUENCY = 15  # Sketch counters saturate here (4-bit counters, as in TinyLFU)
+ADMIT_FREQUENCY = 2  # Accesses (within the sketch's memory) before a chunk is worth loading
+PROTECTED_FRACTION = 0.8  # Share of the budget for entries hit again after admission
+
+
+class FrequencySketch:
+    """Count-min sketch of recent access counts.
+
+    Counters saturate at MAX_FREQUENCY and are all halved once
+    10 * width increments have been recorded, so the sketch forgets old
+    popularity and follows a changing working set.
+    """
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.mask = width - 1
+        self.rows = [bytearray(width) for _ in range(depth)]
+        self.sample_size = 10 * width
+        self.additions = 0
+
+    def _indexes(self, key):
+        h = zlib.crc32(key.encode())
+        return [(h * (2 * i + 0x9E3779B1) >> 7) & self.mask for i in range(len(self.rows))]
+
+    def increment(self, key):
+        added = False
+        for row, i in zip(self.rows, self._indexes(key)):
+            if row[i] < MAX_FREQUENCY:
+                row[i] += 1
+                added = True
+        if added:
+            self.additions += 1
+            if self.additions >= self.sample_size:
+                self._age()
+
+    def frequency(self, key):
+        return min(row[i] for row, i in zip(self.rows, self._indexes(key)))
+
+    def _age(self):
+        for row in self.rows:
+            for i, count in enumerate(row):
+                row[i] = count >> 1
+        self.additions //= 2
+
+
+class ChunkCache:
+    """Holds the data of popular chunks within `capacity` bytes.
+
+    Every lookup is counted in a FrequencySketch. A miss only suggests
+    loading the chunk (`should_load`) once it has been asked for
+    ADMIT_FREQUENCY times, and a loaded chunk is only admitted (`put`) if it
+    is more popular than every entry that would have to be evicted for it
+    (TinyLFU). A one-off scan therefore never displaces the working set.
+
+    Admitted entries start on a probation LRU list and move to a protected
+    list, capped at PROTECTED_FRACTION of the budget, when they are hit;
+    eviction candidates come from probation first. Values are opaque; the
+    caller passes each one's size in bytes.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.protected_capacity = int(capacity * PROTECTED_FRACTION)
+        self.sketch = FrequencySketch()
+        self.probation = OrderedDict()  # key -> (value, size), least recently used first
+        self.protected = OrderedDict()
+        self.protected_bytes = 0
+        self.used = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    def get(self, key):
+        """Return the cached value of `key`, or None."""
+        with self.lock:
+            self.sketch.increment(key)
+            entry = self.probation.pop(key, None)
+            if entry is not None:
+                # Hit again after admission: promote, demoting protected entries that no longer fit
+                self.protected[key] = entry
+                self.protected_bytes += entry[1]
+                while self.protected_bytes > self.protected_capacity and len(self.protected) > 1:
+                    demoted, demoted_entry = self.protected.popitem(last=False)
+                    self.protected_bytes -= demoted_entry[1]
+                    self.probation[demoted] = demoted_entry
+            else:
+                entry = self.protected.get(key)
+                if entry is None:
+                    self.misses += 1
+                    return None
+                self.protected.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def should_load(self, key, size):
+        """After a miss: is `key` popular enough, and `size` small enough, to be worth loading?"""
+        with self.lock:
+            if size > self.capacity or self.sketch.frequency(key) < ADMIT_FREQUENCY:
+                return False
+            return self._victims(key, size) is not None
+
+    def put(self, key, value, size):
+        """Offer a loaded chunk to the cache. Returns whether it was admitted."""
+        with self.lock:
+            if key in self.probation or key in self.protected:
+                return True
+            victims = self._victims(key, size) if size <= self.capacity else None
+            if victims is None:
+                self.rejected += 1
+                return False
+            for victim in victims:
+                self._remove(victim)
+                self.evicted += 1
+            self.probation[key] = (value, size)
+            self.used += size
+            self.admitted += 1
+            return True
+
+    def invalidate(self, key):
+        """Drop `key` (its chunk was deleted or replaced)."""
+        with self.lock:
+            self._remove(key)
+
+    def keys(self):
+        with self.lock:
+            return list(self.probation) + list(self.protected)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"capacity_bytes": self.capacity, "used_bytes": self.used,
+                    "entries": len(self.probation) + len(self.protected),
+                    "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "admitted": self.admitted, "rejected": self.rejected, "evicted": self.evicted}
+
+    def _victims(self, key, size):
+        """The entries to evict to fit `size` more bytes, or None if `key` is not worth them."""
+        needed = self.used + size - self.capacity
+        if needed <= 0:
+            return []
+        frequency = self.sketch.frequency(key)
+        victims = []
+        for segment in (self.probation, self.protected):
+            for victim, (_, victim_size) in segment.items():
+                if self.sketch.frequency(victim) >= frequency:
+                    return None
+                victims.append(victim)
+                needed -= victim_size
+                if needed <= 0:
+                    return victims
+        return None
+
+    def _remove(self, key):
+        entry = self.probation.pop(key, None)
+        if entry is None:
+            entry = self.protected.pop(key, None)
+            if entry is None:
+                return
+            self.protected_bytes -= entry[1]
+        self.used -= entry[1]
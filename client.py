@@ -0,0 +1,425 @@
+# client.py
+"""GUI-free client library: file operations and file-like streams over the DFS."""
+import functools
+import io
+import os
+import queue
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from checksum import BYTES_PER_CHECKSUM
+from erasure import DEFAULT_EC_POLICY, footprint, parse_policy
+from locations import LocationCache, chunk_span, find_chunk
+from shortcircuit import ShortCircuitCache
+from throttle import TokenBucket
+from transfer import (CHUNK_SIZE, MAX_WORKERS, MEMORY_BUDGET, DownloadEngine, TransferError, UploadEngine,
+                      namenode_request)
+
+READ_WINDOW = 8 * BYTES_PER_CHECKSUM  # Bytes fetched per read request; whole checksum sub-blocks
+READ_AHEAD = 4  # Windows prefetched ahead of a sequential reader
+_ABORT = object()  # Queued by DFSWriter.abort() to fail the upload
+
+
+class DFSClient:
+    """Client for one NameNode.
+
+    `put`/`get` copy whole files (or folder trees) with the parallel
+    transfer engines; `open` returns file-like streams for reading at any
+    offset or writing sequentially. Failures raise TransferError.
+
+    Chunk locations are kept in `cache` (a LocationCache; pass
+    cache=None to ask the NameNode on every open). Changes made through
+    this client drop the affected entries at once; changes made by others
+    are noticed when an entry expires or a read on it fails.
+
+    Files are written with `ec`, an erasure coding policy such as "RS-6-3",
+    if one is given, and replicated otherwise. `convert` and `convert_cold`
+    rewrite existing replicated files with a policy. Replicated files are
+    written with chunk `compression` ("auto" or a codec name) if one is
+    given, or deduplicated against the rest of the cluster with `dedup`;
+    compression cannot be combined with `ec` or `dedup` (TransferError).
+
+    New files are pinned to a storage `tier` (e.g. "SSD") if one is given.
+    Replicas on this host are read by mapping their files when their
+    DataNode offers it (see shortcircuit), unless `short_circuit` is off.
+
+    With `bandwidth` (bytes/s) everything this client sends and receives
+    over TCP shares one limit, reads taking precedence over writes.
+    DataNodes queue transfers fairly between tenants: this client's
+    `tenant` (e.g. a user name), or its address if None.
+    """
+
+    def __init__(self, host=None, port=None, chunk_size=CHUNK_SIZE, max_workers=MAX_WORKERS,
+                 memory_budget=MEMORY_BUDGET, verify=True, cache=True, ec=None, compression=None, dedup=False,
+                 short_circuit=True, tier=None, bandwidth=None, tenant=None):
+        if compression and (ec or dedup):
+            # The stripe and dedup write paths store chunks as they are
+            raise TransferError(f"Compression cannot be combined with {'erasure coding' if ec else 'dedup'}")
+        self.request = functools.partial(namenode_request, host=host, port=port)
+        self.cache = LocationCache() if cache is True else cache or None
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.memory_budget = memory_budget
+        self.verify = verify
+        self.ec = parse_policy(ec) if ec else None
+        self.compression = compression
+        self.dedup = dedup
+        self.short_circuit = ShortCircuitCache() if short_circuit else None
+        self.tier = tier
+        self.throttle = TokenBucket(bandwidth) if bandwidth else None
+        self.tenant = tenant
+
+    def upload_engine(self, progress=None, ec=None):
+        return UploadEngine(self.request, max_workers=self.max_workers, memory_budget=self.memory_budget,
+                            chunk_size=self.chunk_size, progress=progress, ec=ec or self.ec,
+                            compression=self.compression, dedup=self.dedup, tier=self.tier, throttle=self.throttle,
+                            tenant=self.tenant)
+
+    def download_engine(self, progress=None):
+        return DownloadEngine(self.request, max_workers=self.max_workers, verify=self.verify, progress=progress,
+                              cache=self.cache, short_circuit=self.short_circuit, throttle=self.throttle,
+                              tenant=self.tenant)
+
+    # Whole-file transfers
+
+    def put(self, local_path, path, progress=None):
+        """Upload a local file or directory tree to `path`. Returns [(path, size), ...]."""
+        engine = self.upload_engine(progress)
+        self._invalidate(path, recursive=True)
+        if os.path.isdir(local_path):
+            return engine.upload_folder(local_path, path)
+        return [engine.upload(local_path, path)]
+
+    def put_stream(self, stream, path, progress=None):
+        """Upload everything read from a binary file object to `path`. Returns its size."""
+        self._invalidate(path)
+        return self.upload_engine(progress).upload_stream(stream, path)[1]
+
+    def get(self, path, local_path, progress=None):
+        """Download `path` into the local file `local_path`. Returns its size."""
+        return self.download_engine(progress).download(path, local_path)
+
+    # Namespace
+
+    def ls(self, path="/"):
+        """Yield the entries of a directory (or the entry of a file), fetching pages as needed."""
+        start_after = None
+        while True:
+            response = self._call({"action": "ls", "path": path, "start_after": start_after})
+            yield from response["entries"]
+            if not response.get("has_more") or not response["entries"]:
+                return
+            start_after = response["entries"][-1]["name"]
+
+    def mkdir(self, path):
+        return self._call({"action": "mkdir", "path": path})["message"]
+
+    def rename(self, src, dst):
+        self._invalidate(src, recursive=True)
+        self._invalidate(dst, recursive=True)
+        return self._call({"action": "rename", "src": src, "dst": dst})["message"]
+
+    def delete(self, path, recursive=False):
+        self._invalidate(path, recursive=True)
+        return self._call({"action": "delete", "path": path, "recursive": recursive})["message"]
+
+    # Erasure coding
+
+    def convert(self, path, policy=DEFAULT_EC_POLICY, progress=None):
+        """Rewrite the file at `path` with an erasure coding policy. Returns its size.
+
+        The EC copy is written next to the file and swapped in by the
+        NameNode only if the file is unchanged by then; otherwise the copy
+        is deleted and TransferError raised.
+        """
+        policy = parse_policy(policy)
+        self._invalidate(path)
+        locations = self.download_engine().locate(path)
+        if not locations.chunks:
+            return 0  # Nothing to encode
+        directory, _, name = path.rstrip("/").rpartition("/")
+        tmp = f"{directory}/.{name}.{policy.name}.{uuid.uuid4().hex[:8]}"
+        with self.open(path, "rb") as src:
+            size = self.upload_engine(progress, policy).upload_stream(src, tmp)[1]
+        try:
+            self._call({"action": "replace", "src": tmp, "dst": path,
+                        "first_chunk": locations.chunks[0]["chunk_id"]})
+        except TransferError:
+            self._call({"action": "delete", "path": tmp})
+            raise
+        finally:
+            self._invalidate(path)
+        return size
+
+    def cold_files(self, path="/", older_than=None, min_size=1):
+        """Replicated files under `path` not read for `older_than` seconds (the NameNode's default if None).
+
+        Returns (files, replication): [{path, size, chunk_size}, ...] (up to
+        one listing page of them) and the replica count they are stored with.
+        """
+        message = {"action": "cold_files", "path": path, "min_size": min_size}
+        if older_than is not None:
+            message["older_than"] = older_than
+        response = self._call(message)
+        return response["files"], response["replication"]
+
+    def convert_cold(self, path="/", policy=DEFAULT_EC_POLICY, older_than=None):
+        """Convert the cold files under `path` that take less space with `policy` than replicated.
+
+        Returns [(path, size), ...] of the files converted. Failures are
+        printed and skipped; the file stays as it was.
+        """
+        policy = parse_policy(policy)
+        cell_size = self.upload_engine(ec=policy).chunk_size
+        files, replication = self.cold_files(path, older_than, min_size=policy.data * cell_size)
+        converted = []
+        for entry in files:
+            if footprint(policy, entry["size"], cell_size) >= entry["size"] * replication:
+                continue
+            try:
+                converted.append((entry["path"], self.convert(entry["path"], policy)))
+            except (TransferError, OSError) as e:
+                print(f"[ERROR] Could not convert {entry['path']} to {policy.name}: {e}")
+        return converted
+
+    def _invalidate(self, path, recursive=False):
+        if self.cache is not None:
+            self.cache.invalidate(path, recursive)
+
+    def _call(self, message):
+        response = self.request(message)
+        if not response or response.get("status") != "ok":
+            raise TransferError((response or {}).get("message", f"{message['action']} failed"))
+        return response
+
+    # Streams
+
+    def open(self, path, mode="rb", read_ahead=READ_AHEAD):
+        """Open a DFS file as a binary stream.
+
+        "rb" returns a seekable, buffered reader that prefetches the next
+        `read_ahead` windows while it is read sequentially. "wb" returns a
+        writer that uploads each chunk in the background as soon as it is
+        full; the file appears in the namespace when the writer is closed.
+        """
+        if mode == "rb":
+            return io.BufferedReader(DFSReader(self.download_engine(), path, read_ahead=read_ahead))
+        if mode == "wb":
+            self._invalidate(path)
+            return DFSWriter(self.upload_engine(), path)
+        raise ValueError(f"Unsupported mode: {mode!r} (use 'rb' or 'wb')")
+
+
+class DFSReader(io.RawIOBase):
+    """A seekable, read-only stream over a DFS file.
+
+    The file is fetched in READ_WINDOW ranges that never cross a chunk
+    boundary, each from the best replica with the DownloadEngine's hedging,
+    fallback, checksum verification and relocation. After every read the next
+    `read_ahead` windows are fetched in the background; windows behind the
+    read position are dropped, so a seek simply starts a new run.
+    """
+
+    def __init__(self, engine, path, window=READ_WINDOW, read_ahead=READ_AHEAD):
+        super().__init__()
+        self.engine = engine
+        self.name = path
+        self.locations = engine.locate(path)
+        self.size = self.locations.size
+        self.chunk_size = self.locations.chunk_size
+        self.window = min(window, self.chunk_size)
+        self.windows_per_chunk = -(-self.chunk_size // self.window)
+        self.read_ahead = read_ahead
+        self.position = 0
+        self.windows = {}  # window index -> Future of its bytes
+        self.pool = ThreadPoolExecutor(max_workers=read_ahead + 1)
+        # Replica attempts run on their own pool so windows waiting on hedges never starve them
+        self.attempt_pool = ThreadPoolExecutor(max_workers=(read_ahead + 1) * 2)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError(f"Invalid whence: {whence}")
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self.position = offset
+        return offset
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if self.position >= self.size:
+            return 0
+        chunk, in_chunk = find_chunk(self.locations, self.position)
+        index = chunk * self.windows_per_chunk + in_chunk // self.window
+        skip = in_chunk % self.window
+        data = self._window(index).result()
+        n = min(len(b), len(data) - skip)
+        memoryview(b).cast("B")[:n] = data[skip:skip + n]
+        self.position += n
+        self._prefetch(index)
+        return n
+
+    def _window(self, index):
+        future = self.windows.get(index)
+        if future is None:
+            chunk, window = divmod(index, self.windows_per_chunk)
+            chunk_length = chunk_span(self.locations, chunk)[1]
+            offset = window * self.window
+            length = min(self.window, chunk_length - offset)
+            future = self.pool.submit(self.engine.read_range, self.attempt_pool, self.name, self.locations,
+                                      chunk, offset, length)
+            self.windows[index] = future
+        return future
+
+    def _prefetch(self, index):
+        """Keep window `index` and the read_ahead windows after it in flight and forget the rest."""
+        keep = [index]
+        while len(keep) <= self.read_ahead:
+            following = self._next_window(keep[-1])
+            if following is None:
+                break
+            keep.append(following)
+        for stale in [i for i in self.windows if i not in keep]:
+            self.windows.pop(stale).cancel()
+        for ahead in keep[1:]:
+            self._window(ahead)
+
+    def _next_window(self, index):
+        """The index of the window after `index`, or None at the end of the file.
+
+        Window indexes count windows_per_chunk per chunk; chunks shorter than
+        chunk_size (the last one, or any in a deduplicated file) skip the rest.
+        """
+        chunk, window = divmod(index, self.windows_per_chunk)
+        if (window + 1) * self.window < chunk_span(self.locations, chunk)[1]:
+            return index + 1
+        if chunk + 1 < len(self.locations.chunks):
+            return (chunk + 1) * self.windows_per_chunk
+        return None
+
+    def close(self):
+        if not self.closed:
+            for future in self.windows.values():
+                future.cancel()
+            self.windows.clear()
+            self.pool.shutdown(wait=True)
+            self.attempt_pool.shutdown(wait=True)
+        super().close()
+
+
+class DFSWriter(io.RawIOBase):
+    """A write-only stream that creates a DFS file.
+
+    Data is gathered into chunk-sized buffers; each full buffer is handed
+    to a background upload (UploadEngine.upload_chunks) and the caller
+    carries on filling the next one. When the uploads fall behind, write()
+    blocks instead of buffering without bound. close() sends the last,
+    short chunk and waits for the file to be completed; leaving a `with`
+    block on an exception calls abort() instead, which discards the file.
+    """
+
+    def __init__(self, engine, path):
+        super().__init__()
+        self.engine = engine
+        self.name = path
+        self.chunk_size = engine.chunk_size
+        self.buffer = bytearray(self.chunk_size)
+        self.filled = 0
+        self.written = 0
+        self.queue = queue.Queue(maxsize=1)
+        self.error = None
+        self.thread = threading.Thread(target=self._upload, daemon=True)
+        self.thread.start()
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.written
+
+    def write(self, b):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        view = memoryview(b).cast("B")
+        total = len(view)
+        while view:
+            n = min(len(view), self.chunk_size - self.filled)
+            self.buffer[self.filled:self.filled + n] = view[:n]
+            self.filled += n
+            view = view[n:]
+            if self.filled == self.chunk_size:
+                self._send(self.buffer)
+                self.buffer = bytearray(self.chunk_size)
+                self.filled = 0
+        self.written += total
+        return total
+
+    def close(self):
+        """Upload what is left and complete the file."""
+        if self.closed:
+            return
+        try:
+            if self.filled:
+                self._send(memoryview(self.buffer)[:self.filled])
+            self._send(None)
+            self.thread.join()
+            if self.error:
+                raise self.error
+        finally:
+            super().close()
+
+    def abort(self):
+        """Stop the upload and discard the file."""
+        if self.closed:
+            return
+        try:
+            self._send(_ABORT)
+        except Exception:
+            pass  # The upload already failed (and was abandoned)
+        self.thread.join()
+        super().close()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def _send(self, item):
+        while True:
+            if not self.thread.is_alive():
+                raise self.error or TransferError(f"Upload of {self.name} stopped")
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _chunks(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if item is _ABORT:
+                raise TransferError(f"Write of {self.name} aborted")
+            yield item
+
+    def _upload(self):
+        try:
+            self.engine.upload_chunks(self._chunks(), self.name)
+        except BaseException as e:
+            self.error = e
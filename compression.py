@@ -0,0 +1,122 @@
+# compression.py
+"""Optional chunk compression: a chunk is stored as independently compressed frames."""
+import lzma
+import zlib
+
+try:
+    import zstandard as _zstd
+except ImportError:
+    _zstd = None
+
+try:
+    import lz4.frame as _lz4
+except ImportError:
+    _lz4 = None
+
+COMPRESSION_FRAME = 1024 * 1024  # Uncompressed bytes per frame; a range read decompresses only its frames
+SAMPLES = 4  # Slices of a chunk compressed to judge how compressible it is...
+SAMPLE_SIZE = 64 * 1024  # ...of this many bytes each
+INCOMPRESSIBLE_RATIO = 0.9  # Chunks whose samples do not shrink below this share of their size are stored raw
+HIGHLY_COMPRESSIBLE_RATIO = 0.5  # Below this, spend more CPU for a better ratio
+
+
+class CompressionError(ValueError):
+    pass
+
+
+# Codec name -> (compress(data, level), decompress(data), level for fast, level for strong compression)
+CODECS = {
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress, 1, 6),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress, 0, 6),
+}
+if _zstd is not None:
+    CODECS["zstd"] = (lambda data, level: _zstd.ZstdCompressor(level=level).compress(data),
+                      lambda data: _zstd.ZstdDecompressor().decompress(data), 1, 3)
+if _lz4 is not None:
+    CODECS["lz4"] = (lambda data, level: _lz4.compress(data, compression_level=level), _lz4.decompress, 0, 9)
+
+
+def codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise CompressionError(f"Unsupported compression codec: {name} (installed: {', '.join(CODECS)})")
+
+
+def sample_ratio(read, length):
+    """Compressed/original size of SAMPLES slices spread over a chunk, with fast zlib.
+
+    `read(view, position)` returns the chunk's bytes from `position` on, as
+    for UploadEngine._write_file.
+    """
+    size = min(SAMPLE_SIZE, length)
+    buf = bytearray(size)
+    view = memoryview(buf)
+    original = compressed = 0
+    for i in range(SAMPLES):
+        data = read(view, (length - size) * i // max(1, SAMPLES - 1))
+        original += len(data)
+        compressed += len(zlib.compress(data, 1))
+    return compressed / original if original else 1.0
+
+
+def choose_codec(ratio, preferred="auto"):
+    """(codec, level) for a chunk whose samples compress to `ratio`, or None to store it raw.
+
+    "auto" takes the fastest installed codec (lz4, zstd, zlib) for data
+    that compresses moderately and the best ratio per CPU second (zstd,
+    zlib) for data that compresses well; a named codec is always used at
+    its strong level. lzma is only used when asked for.
+    """
+    if ratio >= INCOMPRESSIBLE_RATIO:
+        return None
+    if preferred != "auto":
+        return preferred, codec(preferred)[3]
+    if ratio >= HIGHLY_COMPRESSIBLE_RATIO:
+        name = next(name for name in ("lz4", "zstd", "zlib") if name in CODECS)
+        return name, CODECS[name][2]
+    name = "zstd" if "zstd" in CODECS else "zlib"
+    return name, CODECS[name][3]
+
+
+def compress_frame(name, level, data):
+    """Compress one frame, or return it as is if that does not make it smaller.
+
+    Runs in the upload engine's worker processes, so it takes only picklable arguments.
+    """
+    compressed = codec(name)[0](data, level)
+    return compressed if len(compressed) < len(data) else data
+
+
+def decompress_frame(name, frame, length):
+    """Inverse of compress_frame for a frame of `length` uncompressed bytes."""
+    if len(frame) == length:
+        return frame  # Stored raw
+    try:
+        data = codec(name)[1](frame)
+    except CompressionError:
+        raise
+    except Exception as e:  # zlib.error, lzma.LZMAError, ... depending on the codec
+        raise CompressionError(f"Corrupt {name} frame: {e}")
+    if len(data) != length:
+        raise CompressionError(f"Frame decompressed to {len(data)} bytes, expected {length}")
+    return data
+
+
+def frame_span(meta, offset, length):
+    """(first frame, last frame, stored start, stored end) holding uncompressed bytes offset .. offset + length."""
+    first = offset // meta["frame_size"]
+    last = (offset + max(length, 1) - 1) // meta["frame_size"]
+    ends = meta["ends"]
+    return first, last, ends[first - 1] if first else 0, ends[last]
+
+
+def valid_metadata(meta, length):
+    """Whether `meta` ({codec, frame_size, ends}) can describe a chunk of `length` uncompressed bytes."""
+    try:
+        frame_size, ends = meta["frame_size"], meta["ends"]
+        return (isinstance(meta["codec"], str) and isinstance(frame_size, int) and frame_size > 0
+                and len(ends) == -(-length // frame_size) and all(isinstance(end, int) for end in ends)
+                and all(0 < b - a <= frame_size for a, b in zip([0] + ends, ends)))
+    except (KeyError, TypeError):
+        return False
@@ -0,0 +1,128 @@
+# dedup.py
+"""Content-defined chunking (FastCDC) and chunk fingerprints, for deduplicated files."""
+import hashlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CDC_MIN_SIZE = 256 * 1024  # No cut points closer than this to the start of a chunk...
+CDC_AVG_SIZE = 1024 * 1024  # ...cut points are made hard to find before this (a power of two)...
+CDC_MAX_SIZE = 4 * 1024 * 1024  # ...and easy after it, until a chunk is cut here regardless
+SPLIT_BUFFER = 16 * 1024 * 1024  # Bytes gathered before looking for cut points
+
+
+def _gear_table():
+    """256 pseudo-random 32-bit values, fixed so every client cuts the same data the same way."""
+    return [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], "little") for i in range(256)]
+
+
+GEAR = _gear_table()
+
+
+def _mask(bits):
+    """A 32-bit mask with `bits` set bits spread from the top bit down (FastCDC's padded masks)."""
+    mask = 0
+    for k in range(bits):
+        mask |= 1 << (31 - k * 32 // bits)
+    return mask
+
+
+def fingerprint(data):
+    """The content address of a chunk: its SHA-256, hex encoded."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class _CutPoints:
+    """Positions in `data` whose gear hash has no bits of a mask set.
+
+    The 32-bit gear hash h = (h << 1) + GEAR[byte] forgets a byte after 32
+    steps, so at any position it is the sum of GEAR[byte] << age over the
+    32 bytes ending there. With NumPy that is computed for all positions at
+    once by doubling the window five times (h over 2w bytes = h over the
+    last w + (h over the w before) << w); without it, byte by byte from
+    the start of each search, which is slower but finds the same points.
+    """
+
+    def __init__(self, data, masks):
+        self.data = data
+        self.masks = masks
+        self.candidates = None
+        if np is not None and len(data):
+            h = np.array(GEAR, dtype=np.uint32)[np.frombuffer(data, dtype=np.uint8)]
+            out = np.empty_like(h)  # Ping-pong buffers: an in-place shifted add would copy its overlapping input
+            for window in (1, 2, 4, 8, 16):
+                out[:window] = h[:window]
+                np.left_shift(h[:-window], window, out=out[window:])
+                np.add(out[window:], h[window:], out=out[window:])
+                h, out = out, h
+            self.candidates = {mask: np.flatnonzero((h & np.uint32(mask)) == 0) for mask in masks}
+
+    def find(self, mask, begin, end):
+        """The first position in begin .. end - 1 that is a cut point for `mask`, or None."""
+        if begin >= end:
+            return None
+        if self.candidates is not None:
+            candidates = self.candidates[mask]
+            i = int(np.searchsorted(candidates, begin))
+            return int(candidates[i]) if i < len(candidates) and candidates[i] < end else None
+        data = self.data
+        h = 0
+        for position in range(max(0, begin - 31), end):
+            h = ((h << 1) + GEAR[data[position]]) & 0xFFFFFFFF
+            if position >= begin and not h & mask:
+                return position
+        return None
+
+
+def split(pieces, min_size=CDC_MIN_SIZE, avg_size=CDC_AVG_SIZE, max_size=CDC_MAX_SIZE):
+    """Cut the bytes of `pieces` (bytes-like objects, in order) into content-defined chunks.
+
+    Yields each chunk as a memoryview. Cut points depend only on the 32
+    bytes before them, so an insertion or deletion changes the chunks
+    around it and leaves the rest as they were. Uses FastCDC's normalized
+    chunking: a stricter mask before `avg_size` and a looser one after it
+    keep chunk sizes close to the average.
+    """
+    if avg_size & (avg_size - 1) or not 32 <= min_size <= avg_size <= max_size:
+        raise ValueError("Need 32 <= min_size <= avg_size <= max_size with avg_size a power of two")
+    bits = avg_size.bit_length() - 1
+    strict, loose = _mask(min(32, bits + 2)), _mask(max(1, bits - 2))
+    pieces = iter(pieces)
+    buffered = [b""]
+    final = False
+    while True:
+        size = sum(map(len, buffered))
+        while not final and size < SPLIT_BUFFER:
+            piece = next(pieces, None)
+            if piece is None:
+                final = True
+            else:
+                buffered.append(piece)
+                size += len(piece)
+        data = b"".join(buffered)
+        if not data:
+            return
+        # `data` starts at a chunk boundary, so every position searched has 32 bytes of history
+        cut_points = _CutPoints(data, (strict, loose))
+        view = memoryview(data)
+        start = 0
+        n = len(data)
+        while start < n:
+            end = None
+            if n - start > min_size:
+                position = cut_points.find(strict, start + min_size - 1, min(start + avg_size - 1, n))
+                if position is None and start + avg_size - 1 <= n:
+                    position = cut_points.find(loose, start + avg_size - 1, min(start + max_size - 1, n))
+                    if position is None and start + max_size <= n:
+                        position = start + max_size - 1
+                if position is not None:
+                    end = position + 1
+            if end is None:
+                if not final:
+                    break  # The cut point depends on bytes not read yet
+                end = n
+            yield view[start:end]
+            start = end
+        buffered = [data[start:]]
@@ -0,0 +1,186 @@
+# dfs.py
+"""Command-line client: dfs put/get/cat/ls/mkdir/mv/rm/convert against a NameNode."""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import time
+
+from client import DFSClient
+from compression import CODECS
+from erasure import DEFAULT_EC_POLICY, ErasureError
+from transfer import CHUNK_SIZE, MAX_WORKERS, NAMENODE_HOST, NAMENODE_PORT, TransferError, tracer
+from volumes import TIERS
+
+COPY_BUFFER = 4 * 1024 * 1024  # Bytes per read/write when streaming through stdin/stdout
+
+
+def report(args, verb, path, size, elapsed):
+    if args.verbose:
+        rate = size / elapsed / 1e6 if elapsed > 0 else 0.0
+        print(f"{verb} {path}: {size} bytes in {elapsed:.3f}s ({rate:.1f} MB/s)", file=sys.stderr)
+
+
+def to_stdout(client, path):
+    """Copy a DFS file to stdout; diagnostics printed meanwhile go to stderr so they cannot mix into the data."""
+    out = sys.stdout.buffer
+    sys.stdout = sys.stderr
+    with client.open(path, "rb") as f:
+        shutil.copyfileobj(f, out, COPY_BUFFER)
+        out.flush()
+        return f.raw.size
+
+
+def cmd_put(client, args):
+    remote = args.remote or "/" + os.path.basename(os.path.abspath(args.local))
+    start = time.perf_counter()
+    if args.local == "-":
+        size = client.put_stream(sys.stdin.buffer, args.remote or "/stdin")
+        report(args, "put", args.remote or "/stdin", size, time.perf_counter() - start)
+        return
+    uploaded = client.put(args.local, remote)
+    report(args, "put", remote, sum(size for _, size in uploaded), time.perf_counter() - start)
+
+
+def cmd_get(client, args):
+    local = args.local or os.path.basename(args.remote.rstrip("/"))
+    start = time.perf_counter()
+    if local == "-":
+        size = to_stdout(client, args.remote)
+    else:
+        size = client.get(args.remote, local)
+    report(args, "get", args.remote, size, time.perf_counter() - start)
+
+
+def cmd_cat(client, args):
+    to_stdout(client, args.remote)
+
+
+def cmd_ls(client, args):
+    for entry in client.ls(args.path):
+        if entry["type"] == "directory":
+            print(f"d {entry['children']:>14} {'':<8} {entry['name']}/")
+        else:
+            print(f"- {entry['size']:>14} {entry['status']:<8} {entry['name']}")
+
+
+def cmd_mkdir(client, args):
+    print(client.mkdir(args.path))
+
+
+def cmd_mv(client, args):
+    print(client.rename(args.src, args.dst))
+
+
+def cmd_rm(client, args):
+    print(client.delete(args.path, args.recursive))
+
+
+def cmd_convert(client, args):
+    for path in args.paths:
+        start = time.perf_counter()
+        size = client.convert(path, args.ec or DEFAULT_EC_POLICY)
+        report(args, "convert", path, size, time.perf_counter() - start)
+
+
+def cmd_convert_cold(client, args):
+    """Convert cold files to EC once, or with --watch every so many seconds until interrupted."""
+    policy = args.ec or DEFAULT_EC_POLICY
+    while True:
+        start = time.perf_counter()
+        converted = client.convert_cold(args.path, policy, args.older_than)
+        for path, size in converted:
+            print(f"Converted {path} ({size} bytes) to {policy}")
+        report(args, "convert-cold", args.path, sum(size for _, size in converted), time.perf_counter() - start)
+        if not args.watch:
+            return
+        time.sleep(args.watch)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="dfs", description="Distributed file system client")
+    parser.add_argument("--namenode", default=os.environ.get("DFS_NAMENODE", f"{NAMENODE_HOST}:{NAMENODE_PORT}"),
+                        help="NameNode address as host:port (default: $DFS_NAMENODE)")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_SIZE // (1024 * 1024), help="chunk size of new files")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="chunks transferred in parallel")
+    parser.add_argument("--no-verify", action="store_true", help="skip checksum verification of downloads")
+    parser.add_argument("--no-short-circuit", action="store_true",
+                        help="read replicas on this host over TCP instead of mapping their files")
+    parser.add_argument("--ec", metavar="POLICY",
+                        help=f"erasure-code new files with POLICY (RS-<data>-<parity>, e.g. {DEFAULT_EC_POLICY}) "
+                             "instead of replicating them")
+    parser.add_argument("--compress", choices=["auto", *CODECS],
+                        help="compress the chunks of new replicated files (not with --ec or --dedup); auto picks a "
+                             "codec per chunk and leaves incompressible ones as they are")
+    parser.add_argument("--tier", choices=TIERS, type=str.upper,
+                        help="pin new files to DataNode volumes of this storage tier where the cluster has them")
+    parser.add_argument("--bandwidth-mb", type=float, metavar="MB/S",
+                        help="limit this client's transfers to MB/s, downloads before uploads")
+    parser.add_argument("--tenant", help="name DataNodes queue this client's transfers under (default: its address)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="cut new files at content-defined boundaries and store only chunks the cluster "
+                             "does not already hold")
+    parser.add_argument("-v", "--verbose", action="store_true", help="report sizes and throughput on stderr")
+    parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="DEBUG also logs retries, hedged reads and degraded reads")
+    parser.add_argument("--trace-sample", type=float, default=0.0, metavar="RATE",
+                        help="trace this share of uploads through the NameNode and DataNodes (0 to 1)")
+    parser.add_argument("--trace-file", help="append the client's spans of traced uploads to this file as JSON lines")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    put = commands.add_parser("put", help="upload a file, a directory tree or stdin (-)")
+    put.add_argument("local")
+    put.add_argument("remote", nargs="?", help="DFS path (default: /<local name>)")
+    put.set_defaults(run=cmd_put)
+    get = commands.add_parser("get", help="download a file (- for stdout)")
+    get.add_argument("remote")
+    get.add_argument("local", nargs="?", help="local path (default: the file's name)")
+    get.set_defaults(run=cmd_get)
+    cat = commands.add_parser("cat", help="write a file to stdout")
+    cat.add_argument("remote")
+    cat.set_defaults(run=cmd_cat)
+    ls = commands.add_parser("ls", help="list a directory")
+    ls.add_argument("path", nargs="?", default="/")
+    ls.set_defaults(run=cmd_ls)
+    mkdir = commands.add_parser("mkdir", help="create a directory and its parents")
+    mkdir.add_argument("path")
+    mkdir.set_defaults(run=cmd_mkdir)
+    mv = commands.add_parser("mv", help="rename a file or directory")
+    mv.add_argument("src")
+    mv.add_argument("dst")
+    mv.set_defaults(run=cmd_mv)
+    rm = commands.add_parser("rm", help="delete a file or directory")
+    rm.add_argument("-r", "--recursive", action="store_true")
+    rm.add_argument("path")
+    rm.set_defaults(run=cmd_rm)
+    convert = commands.add_parser("convert", help=f"rewrite files erasure-coded (--ec, default {DEFAULT_EC_POLICY})")
+    convert.add_argument("paths", nargs="+")
+    convert.set_defaults(run=cmd_convert)
+    convert_cold = commands.add_parser("convert-cold", help="convert replicated files nobody has read lately")
+    convert_cold.add_argument("path", nargs="?", default="/")
+    convert_cold.add_argument("--older-than", type=float, metavar="SECONDS",
+                              help="unread for this long (default: the NameNode's, a week)")
+    convert_cold.add_argument("--watch", type=float, metavar="SECONDS", help="repeat every SECONDS")
+    convert_cold.set_defaults(run=cmd_convert_cold)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s", stream=sys.stderr)
+    tracer.configure(sample_rate=args.trace_sample, path=args.trace_file)
+
+    host, _, port = args.namenode.rpartition(":")
+    try:
+        client = DFSClient(host or NAMENODE_HOST, int(port), chunk_size=args.chunk_mb * 1024 * 1024,
+                           max_workers=args.workers, verify=not args.no_verify, ec=args.ec,
+                           compression=args.compress, dedup=args.dedup,
+                           short_circuit=not args.no_short_circuit, tier=args.tier,
+                           bandwidth=args.bandwidth_mb * 1024 * 1024 if args.bandwidth_mb else None,
+                           tenant=args.tenant)
+        args.run(client, args)
+    except (TransferError, ErasureError, OSError) as e:
+        print(f"dfs {args.command}: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
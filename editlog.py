@@ -0,0 +1,199 @@
+# editlog.py
+import json
+import os
+import threading
+import time
+
+SEGMENT_PREFIX = "edits_"
+SEGMENT_SUFFIX = ".log"
+
+
+def segment_name(first_txid):
+    return f"{SEGMENT_PREFIX}{first_txid:012d}{SEGMENT_SUFFIX}"
+
+
+def list_segments(directory):
+    """Return (first_txid, path) for every edit log segment, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    segments = []
+    for name in os.listdir(directory):
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+            first_txid = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            segments.append((first_txid, os.path.join(directory, name)))
+    segments.sort()
+    return segments
+
+
+def read_segment(path):
+    """Yield the records of one segment, stopping at a torn trailing line."""
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                print(f"[EditLog] Ignoring torn record at end of {path}")
+                return
+
+
+def load_snapshot(path):
+    """Return (files, last_txid) from a snapshot file (legacy plain dicts are txid 0)."""
+    if not os.path.exists(path):
+        return {}, 0
+    with open(path, "r") as f:
+        data = json.load(f)
+    if "last_txid" in data and "files" in data:
+        return data["files"], data["last_txid"]
+    return data, 0
+
+
+def write_snapshot(path, files, last_txid):
+    """Atomically replace the snapshot with a compact copy of `files`."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"last_txid": last_txid, "files": files}, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class EditLog:
+    """Append-only write-ahead log of namespace mutations.
+
+    Records are compact JSON lines. Callers append under their own metadata
+    lock (so txid order matches apply order) and then call `sync()` outside
+    it; concurrent syncs are batched into a single fsync (group commit).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.synced = threading.Condition(self.lock)
+        self.file = None
+        self.segment_first_txid = 0
+        self.last_txid = 0
+        self.synced_txid = 0
+        self.syncing = False
+
+    def open(self, last_txid):
+        """Start a fresh segment after `last_txid` (the last replayed record)."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            self.last_txid = last_txid
+            self.synced_txid = last_txid
+            self._start_segment()
+
+    def _start_segment(self):
+        self.segment_first_txid = self.last_txid + 1
+        path = os.path.join(self.directory, segment_name(self.segment_first_txid))
+        self.file = open(path, "wb")
+
+    def append(self, op, **fields):
+        """Buffer one record and return its txid. Not durable until `sync(txid)`."""
+        with self.lock:
+            self.last_txid += 1
+            record = {"txid": self.last_txid, "op": op}
+            record.update(fields)
+            self.file.write(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+            return self.last_txid
+
+    def sync(self, txid):
+        """Block until every record up to `txid` has been fsynced."""
+        with self.lock:
+            while self.synced_txid < txid:
+                if self.syncing:
+                    self.synced.wait()
+                    continue
+                # Become the syncer for everything appended so far
+                self.syncing = True
+                target = self.last_txid
+                f = self.file
+                self.lock.release()
+                try:
+                    f.flush()
+                    os.fsync(f.fileno())
+                finally:
+                    self.lock.acquire()
+                    self.syncing = False
+                    self.synced.notify_all()
+                self.synced_txid = max(self.synced_txid, target)
+
+    def pending_edits(self):
+        """Number of records in the current (in-progress) segment."""
+        with self.lock:
+            return self.last_txid - self.segment_first_txid + 1
+
+    def roll(self):
+        """Finalize the current segment and start a new one. Returns the last txid of the old segment."""
+        with self.lock:
+            while self.syncing:
+                self.synced.wait()
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.synced_txid = self.last_txid
+            rolled_txid = self.last_txid
+            self._start_segment()
+            return rolled_txid
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
+
+
+class Checkpointer(threading.Thread):
+    """Background thread that folds finalized edit segments into the snapshot.
+
+    The checkpoint is built from the previous snapshot plus the finalized
+    segments (like the HDFS secondary NameNode), so the live namespace is only
+    locked for the instant it takes to roll the log. `decode` turns the
+    snapshot's JSON into the structure `apply_edit` works on and `encode`
+    turns it back.
+    """
+
+    def __init__(self, edit_log, snapshot_path, apply_edit, interval, max_edits, decode=None, encode=None):
+        super().__init__(daemon=True)
+        self.edit_log = edit_log
+        self.snapshot_path = snapshot_path
+        self.apply_edit = apply_edit
+        self.decode = decode or (lambda files: files)
+        self.encode = encode or (lambda files: files)
+        self.interval = interval
+        self.max_edits = max_edits
+        self.checkpoint_lock = threading.Lock()
+
+    def run(self):
+        last_checkpoint = time.time()
+        while True:
+            time.sleep(1)
+            due = time.time() - last_checkpoint >= self.interval
+            if self.edit_log.pending_edits() >= self.max_edits or (due and self.edit_log.pending_edits() > 0):
+                try:
+                    self.checkpoint()
+                except Exception as e:
+                    print(f"[ERROR] Checkpoint failed: {e}")
+                last_checkpoint = time.time()
+
+    def checkpoint(self):
+        """Roll the log, then fold every finalized segment into a new snapshot."""
+        with self.checkpoint_lock:
+            rolled_txid = self.edit_log.roll()
+            files, last_txid = load_snapshot(self.snapshot_path)
+            files = self.decode(files)
+            folded = []
+            for first_txid, path in list_segments(self.edit_log.directory):
+                if first_txid > rolled_txid:
+                    break
+                for record in read_segment(path):
+                    if last_txid < record["txid"] <= rolled_txid:
+                        self.apply_edit(files, record)
+                        last_txid = record["txid"]
+                folded.append(path)
+            write_snapshot(self.snapshot_path, self.encode(files), last_txid)
+            for path in folded:
+                os.remove(path)
+            print(f"[NameNode] Checkpoint written at txid {last_txid}, folded {len(folded)} segment(s)")
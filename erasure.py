@@ -0,0 +1,168 @@
+# erasure.py
+"""Reed-Solomon erasure coding over GF(256), for files stored as data and parity cells."""
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EC_CELL_SIZE = 4 * 1024 * 1024  # Largest cell (chunk) of an EC file; writers hold whole stripes in memory
+DEFAULT_EC_POLICY = "RS-6-3"
+GF_POLYNOMIAL = 0x11d  # x^8 + x^4 + x^3 + x^2 + 1, the usual Reed-Solomon field
+
+# An EC policy: each stripe of `data` cells is stored with `parity` extra
+# cells, and any `data` of those `data + parity` cells recover the rest.
+ECPolicy = namedtuple("ECPolicy", "name data parity")
+
+
+class ErasureError(ValueError):
+    pass
+
+
+def _tables():
+    exp = [0] * 512
+    log = [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= GF_POLYNOMIAL
+    for i in range(255, 512):
+        exp[i] = exp[i - 255]
+    return exp, log
+
+
+EXP, LOG = _tables()
+
+
+def gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return EXP[LOG[a] + LOG[b]]
+
+
+def gf_inv(a):
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    return EXP[255 - LOG[a]]
+
+
+# MUL_TABLES[c] maps every byte x to c * x, for bytes.translate
+MUL_TABLES = [bytes(gf_mul(c, x) for x in range(256)) for c in range(256)]
+
+
+def parse_policy(name):
+    """"RS-<data>-<parity>" (e.g. "RS-6-3") -> ECPolicy."""
+    if isinstance(name, ECPolicy):
+        return name
+    parts = name.split("-") if isinstance(name, str) else ()
+    if len(parts) != 3 or parts[0].upper() != "RS" or not all(p.isdigit() for p in parts[1:]):
+        raise ErasureError(f"Invalid erasure coding policy {name!r} (expected RS-<data>-<parity>, e.g. RS-6-3)")
+    data, parity = int(parts[1]), int(parts[2])
+    if data < 1 or parity < 1 or data + parity > 255:
+        raise ErasureError(f"Invalid erasure coding policy {name!r} (need data, parity >= 1 and data + parity <= 255)")
+    return ECPolicy(f"RS-{data}-{parity}", data, parity)
+
+
+def parity_matrix(policy):
+    """The `parity` x `data` Cauchy matrix below the identity of the systematic generator.
+
+    Every square submatrix of a Cauchy matrix is invertible, so any `data`
+    rows of [I; C] are too: any `data` surviving cells determine the stripe.
+    """
+    return [[gf_inv((policy.data + i) ^ j) for j in range(policy.data)] for i in range(policy.parity)]
+
+
+def invert(matrix):
+    """Invert a square matrix over GF(256) by Gauss-Jordan elimination."""
+    n = len(matrix)
+    rows = [list(row) + [int(i == j) for j in range(n)] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = next((r for r in range(col, n) if rows[r][col]), None)
+        if pivot is None:
+            raise ErasureError("Singular matrix")
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        scale = gf_inv(rows[col][col])
+        rows[col] = [gf_mul(scale, v) for v in rows[col]]
+        for r in range(n):
+            factor = rows[r][col]
+            if r != col and factor:
+                rows[r] = [v ^ gf_mul(factor, p) for v, p in zip(rows[r], rows[col])]
+    return [row[n:] for row in rows]
+
+
+def combine(coefficients, cells, length):
+    """Return sum(c * cell) over GF(256) as `length` bytes.
+
+    Cells shorter than `length` count as zero-padded. Each product is one
+    bytes.translate() through MUL_TABLES, a table lookup per byte in C
+    (about 3x faster than the same lookup with NumPy fancy indexing). The
+    products are summed with vectorized NumPy XORs when NumPy is installed,
+    and otherwise as big integers, which is slower but also runs in C.
+    """
+    if np is not None:
+        acc = np.zeros(length, dtype=np.uint8)
+        for c, cell in zip(coefficients, cells):
+            if c == 0 or not len(cell):
+                continue
+            product = cell if c == 1 else bytes(cell).translate(MUL_TABLES[c])
+            acc[:len(cell)] ^= np.frombuffer(product, dtype=np.uint8)
+        return acc.tobytes()
+    acc = 0
+    for c, cell in zip(coefficients, cells):
+        if c == 0 or not len(cell):
+            continue
+        acc ^= int.from_bytes(cell if c == 1 else bytes(cell).translate(MUL_TABLES[c]), "little")
+    return acc.to_bytes(length, "little")
+
+
+def encode(policy, cells):
+    """Return the `parity` parity cells of a stripe of data cells.
+
+    `cells` holds up to `data` bytes-like objects; short cells and missing
+    trailing ones count as zeros. Parity cells are as long as the longest.
+    """
+    policy = parse_policy(policy)
+    length = max((len(cell) for cell in cells), default=0)
+    return [combine(row, cells, length) for row in parity_matrix(policy)]
+
+
+def reconstruct(policy, cells, wanted, length):
+    """Rebuild cells of a stripe from any `data` others.
+
+    `cells` maps positions in the stripe (0 .. data - 1 for data cells, data
+    .. data + parity - 1 for parity cells) to their bytes, zero-padded to
+    `length` if short. Returns {position: bytes} for each position in `wanted`.
+    """
+    policy = parse_policy(policy)
+    available = sorted(cells)[:policy.data]
+    if len(available) < policy.data:
+        raise ErasureError(f"{len(cells)} cells cannot rebuild a {policy.name} stripe (need {policy.data})")
+    parity = parity_matrix(policy)
+    generator = [[int(i == j) for j in range(policy.data)] for i in range(policy.data)] + parity
+    decode = invert([generator[p] for p in available])  # Available cells -> data cells
+    sources = [cells[p] for p in available]
+    rebuilt = {}
+    for position in wanted:
+        if position in cells:
+            rebuilt[position] = bytes(cells[position])
+            continue
+        row = generator[position]
+        # Cell = row . data = row . (decode . available)
+        coefficients = [0] * policy.data
+        for r, factor in enumerate(row):
+            if factor:
+                coefficients = [c ^ gf_mul(factor, d) for c, d in zip(coefficients, decode[r])]
+        rebuilt[position] = combine(coefficients, sources, length)
+    return rebuilt
+
+
+def footprint(policy, size, cell_size):
+    """Bytes stored for a `size`-byte file in `policy` with cells of `cell_size` bytes."""
+    policy = parse_policy(policy)
+    stripe = policy.data * cell_size
+    parity = sum(min(cell_size, size - start) for start in range(0, size, stripe)) * policy.parity
+    return size + parity
@@ -0,0 +1,229 @@
+# lease.py
+"""Write leases: a file being written belongs to one client until it is completed, abandoned or expires."""
+import time
+import uuid
+
+from compression import valid_metadata
+from namespace import block_name
+
+LEASE_TIMEOUT = 60  # A lease not renewed for this many seconds is reclaimed
+
+
+class LeaseError(Exception):
+    """A write-session request that cannot be honoured (unknown lease, foreign block, ...)."""
+
+
+class Lease:
+    """One open write session: the blocks allocated to it so far and which of them hold data.
+
+    Erasure-coded files (`ec` is their ECPolicy) are allocated whole stripes
+    at a time: `data` data cells followed by `parity` parity cells.
+
+    Deduplicated files (`dedup`) have chunks of any length up to
+    chunk_size, each declared with its fingerprint when it is allocated.
+    A chunk whose content the cluster already holds is not allocated a new
+    block: the existing block is listed again and counts as committed.
+
+    A file pinned to a storage `tier` has its chunks placed on that tier.
+    """
+
+    def __init__(self, lease_id, path, holder, chunk_size, now, ec=None, dedup=False, tier=None):
+        self.lease_id = lease_id
+        self.path = path
+        self.holder = holder
+        self.chunk_size = chunk_size
+        self.ec = ec
+        self.tier = tier
+        self.last_renewed = now
+        self.blocks = []  # Allocated block IDs, in chunk order
+        self.targets = {}  # Block ID -> DataNode IDs it was allocated to
+        self.lengths = {}  # Block ID -> bytes, for blocks the client has committed
+        self.compression = {}  # Block ID -> {codec, frame_size, ends}, for committed blocks stored compressed
+        self.dedup = dedup
+        self.fingerprints = {}  # Block ID -> (SHA-256 digest, length) declared for chunks of a deduplicated file
+        self.digests = {}  # SHA-256 digest -> block allocated to this lease, so repeated content is stored once
+        self.reused = set()  # Blocks of other files listed by this one
+        self.completing = False  # Set while its file is being added to the namespace
+
+    def layout(self):
+        """Return (blocks, unused, size) for completing the file.
+
+        The file is the committed blocks in allocation order; allocated
+        blocks after the last committed one were never needed and are
+        returned as `unused`. Every block but the last must be full, since
+        readers place chunk i at offset i * chunk_size (except in
+        deduplicated files, which record each chunk's length).
+
+        For an EC file the same holds for its data cells. The file keeps
+        every stripe up to the one holding the last committed data cell, and
+        all parity cells of those stripes must be committed, each as long as
+        the first data cell of its stripe.
+        """
+        if self.ec is None:
+            data = self.blocks
+        else:
+            width = self.ec.data + self.ec.parity
+            stripes = [self.blocks[i:i + width] for i in range(0, len(self.blocks), width)]
+            data = [block for stripe in stripes for block in stripe[:self.ec.data]]
+        count = len(data)
+        while count and data[count - 1] not in self.lengths:
+            count -= 1
+        for i, block in enumerate(data[:count]):
+            length = self.lengths.get(block)
+            if length is None:
+                raise LeaseError(f"Chunk {i} ({block_name(block)}) of {self.path} was never committed")
+            if i < count - 1 and length != self.chunk_size and not self.dedup:
+                raise LeaseError(f"Chunk {i} of {self.path} has {length} bytes; only the last chunk may be short")
+        size = sum(self.lengths[block] for block in data[:count])
+        if self.ec is None:
+            # Only blocks allocated to this lease and not in the file are unused (see Lease.digests)
+            kept = set(self.blocks[:count])
+            unused = [block for block in dict.fromkeys(self.blocks[count:]) if block in self.targets and block not in kept]
+            return self.blocks[:count], unused, size
+        used = -(-count // self.ec.data)
+        for stripe in stripes[:used]:
+            for block in stripe[self.ec.data:]:
+                if self.lengths.get(block) != self.lengths[stripe[0]]:
+                    raise LeaseError(f"Parity cell {block_name(block)} of {self.path} was not committed in full")
+        return self.blocks[:used * width], self.blocks[used * width:], size
+
+
+class LeaseManager:
+    """Tracks open write sessions by ID, path, holder and block.
+
+    A path has at most one live lease. Leases are renewed by every request
+    made under them and by `renew(holder)`, which clients call periodically
+    for all their open files at once. Leases left unrenewed for `timeout`
+    seconds are reclaimed: they are dropped and their blocks passed to
+    `on_reclaim`, if set, so the chunks already written can be deleted.
+    """
+
+    def __init__(self, timeout=LEASE_TIMEOUT):
+        self.timeout = timeout
+        self.leases = {}  # lease ID -> Lease
+        self.by_path = {}  # path -> Lease
+        self.by_holder = {}  # holder -> {lease ID, ...}
+        self.blocks = {}  # block ID -> Lease
+        self.on_reclaim = None
+
+    def open(self, path, holder, chunk_size, now=None, ec=None, dedup=False, tier=None):
+        now = now or time.time()
+        existing = self.by_path.get(path)
+        if existing is not None:
+            if existing.last_renewed + self.timeout > now:
+                raise LeaseError(f"{path} is already being written by {existing.holder}")
+            self.reclaim(existing)
+        lease = Lease(uuid.uuid4().hex, path, holder, chunk_size, now, ec, dedup, tier)
+        self.leases[lease.lease_id] = lease
+        self.by_path[path] = lease
+        self.by_holder.setdefault(holder, set()).add(lease.lease_id)
+        return lease
+
+    def get(self, lease_id, now=None):
+        """Return the lease and renew it. Raises LeaseError if it is unknown or has expired."""
+        now = now or time.time()
+        lease = self.leases.get(lease_id)
+        if lease is None:
+            raise LeaseError("No such lease (it was completed, abandoned or expired)")
+        if lease.completing:
+            raise LeaseError(f"{lease.path} is already being completed")
+        if lease.last_renewed + self.timeout <= now:
+            self.reclaim(lease)  # Expired but not swept yet: reclaim it as the sweep would
+            raise LeaseError(f"The lease on {lease.path} has expired")
+        lease.last_renewed = now
+        return lease
+
+    def renew(self, holder, now=None):
+        """Renew every live lease of `holder`, reclaiming expired ones as `get` does. Returns how many it has."""
+        now = now or time.time()
+        renewed = 0
+        for lease_id in list(self.by_holder.get(holder, ())):
+            lease = self.leases[lease_id]
+            if lease.last_renewed + self.timeout <= now and not lease.completing:
+                self.reclaim(lease)
+                continue
+            lease.last_renewed = now
+            renewed += 1
+        return renewed
+
+    def add_blocks(self, lease, first_block, targets, fingerprints=None):
+        """Record the consecutive blocks first_block, first_block + 1, ... allocated to `targets`.
+
+        Chunks of deduplicated files come with the (digest, length) they were declared with.
+        """
+        for i, datanode_ids in enumerate(targets):
+            block = first_block + i
+            lease.blocks.append(block)
+            lease.targets[block] = datanode_ids
+            self.blocks[block] = lease
+            if fingerprints is not None:
+                lease.fingerprints[block] = fingerprints[i]
+                lease.digests[fingerprints[i][0]] = block
+
+    def reuse(self, lease, block, digest=None, length=None):
+        """List an existing block again as the next chunk of a deduplicated file.
+
+        A block allocated to this lease (content repeated within the file)
+        is committed along with its first chunk. A block of other files is
+        given with the `digest` and `length` it holds and counts as committed.
+        """
+        lease.blocks.append(block)
+        if digest is not None:
+            lease.lengths[block] = length
+            lease.fingerprints[block] = (digest, length)
+            lease.reused.add(block)
+
+    def commit(self, lease, block, length, compression=None):
+        """Note that the pipeline of a block acknowledged `length` bytes.
+
+        A compressed chunk is committed with its uncompressed `length` and
+        the `compression` metadata of the frames its replicas hold.
+        """
+        if self.blocks.get(block) is not lease:
+            raise LeaseError(f"Chunk {block_name(block)} was not allocated to this lease")
+        if not isinstance(length, int) or not 0 < length <= lease.chunk_size:
+            raise LeaseError(f"Invalid length {length!r} for chunk {block_name(block)}")
+        if lease.dedup and lease.fingerprints[block][1] != length:
+            raise LeaseError(f"Chunk {block_name(block)} was declared with {lease.fingerprints[block][1]} bytes, "
+                             f"not {length}")
+        if compression is not None:
+            if lease.ec is not None or lease.dedup:
+                raise LeaseError(f"Chunk {block_name(block)} of {lease.path} cannot be compressed "
+                                 "(erasure-coded or deduplicated file)")
+            if not valid_metadata(compression, length):
+                raise LeaseError(f"Invalid compression metadata for chunk {block_name(block)}")
+            lease.compression[block] = compression
+        else:
+            lease.compression.pop(block, None)
+        lease.lengths[block] = length
+
+    def owner(self, block):
+        return self.blocks.get(block)
+
+    def release(self, lease):
+        """Forget a lease whose file was completed (or whose blocks the caller disposes of)."""
+        self.leases.pop(lease.lease_id, None)
+        if self.by_path.get(lease.path) is lease:
+            del self.by_path[lease.path]
+        holder_leases = self.by_holder.get(lease.holder)
+        if holder_leases is not None:
+            holder_leases.discard(lease.lease_id)
+            if not holder_leases:
+                del self.by_holder[lease.holder]
+        for block in lease.blocks:
+            if self.blocks.get(block) is lease:
+                del self.blocks[block]
+
+    def reclaim(self, lease):
+        """Drop a lease together with its file: every block allocated to it is orphaned."""
+        self.release(lease)
+        if self.on_reclaim and lease.targets:
+            self.on_reclaim(list(lease.targets))
+
+    def expire(self, now=None):
+        """Reclaim leases not renewed within the timeout. Returns them."""
+        cutoff = (now or time.time()) - self.timeout
+        expired = [lease for lease in self.leases.values() if lease.last_renewed < cutoff and not lease.completing]
+        for lease in expired:
+            self.reclaim(lease)
+        return expired
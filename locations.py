@@ -0,0 +1,110 @@
+# locations.py
+"""Client-side cache of file -> chunk locations, so reopening a file need not ask the NameNode."""
+import bisect
+import itertools
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from namespace import normalize_path
+
+LOCATION_CACHE_SIZE = 4096  # Files whose locations are cached
+LOCATION_CACHE_TTL = 30  # Seconds a cached entry is trusted without asking the NameNode again
+
+# What a download response says about a file. `generation` changes whenever
+# the NameNode's namespace or any replica set changes, so two responses with
+# the same generation describe the same locations. Erasure-coded files also
+# carry their ECPolicy and, per stripe, the locations of its parity cells.
+# Deduplicated files have chunks of varying length; `offsets` holds where
+# each starts, then the file size (see chunk_span and find_chunk).
+Locations = namedtuple("Locations", "size chunk_size chunks generation ec parity offsets",
+                       defaults=(None, None, None))
+
+
+def chunk_offsets(lengths):
+    """Locations.offsets for chunks of these lengths."""
+    return list(itertools.accumulate(lengths, initial=0))
+
+
+def chunk_span(locations, index):
+    """(offset in the file, length) of chunk `index`."""
+    if locations.offsets is not None:
+        return locations.offsets[index], locations.offsets[index + 1] - locations.offsets[index]
+    start = index * locations.chunk_size
+    return start, min(locations.chunk_size, locations.size - start)
+
+
+def find_chunk(locations, position):
+    """(chunk index, offset in that chunk) of byte `position` of the file."""
+    if locations.offsets is not None:
+        index = bisect.bisect_right(locations.offsets, position, hi=len(locations.offsets) - 1) - 1
+        return index, position - locations.offsets[index]
+    return divmod(position, locations.chunk_size)
+
+
+class LocationCache:
+    """A thread-safe LRU map of path -> Locations whose entries expire after `ttl` seconds.
+
+    Entries can also go stale before they expire (a DataNode died, the file
+    was replaced); readers that fail on a cached entry drop it with
+    `invalidate` and ask the NameNode again. Counters of hits, misses,
+    evictions and invalidations are kept for `stats()`.
+    """
+
+    def __init__(self, capacity=LOCATION_CACHE_SIZE, ttl=LOCATION_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict()  # path -> (expiry time, Locations), least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, path, now=None):
+        path = normalize_path(path)
+        now = now or time.monotonic()
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self.entries[path]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, path, locations, now=None):
+        path = normalize_path(path)
+        now = now or time.monotonic()
+        with self.lock:
+            self.entries[path] = (now + self.ttl, locations)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, path, recursive=False):
+        """Drop the entry of `path`, and with `recursive` those of everything under it."""
+        path = normalize_path(path)
+        with self.lock:
+            dropped = [path] if path in self.entries else []
+            if recursive:
+                prefix = path if path == "/" else path + "/"
+                dropped += [cached for cached in self.entries if cached.startswith(prefix)]
+            for cached in dropped:
+                del self.entries[cached]
+            self.invalidations += len(dropped)
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "evictions": self.evictions, "invalidations": self.invalidations}
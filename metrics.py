@@ -0,0 +1,277 @@
+# metrics.py
+"""Counters, gauges and histograms in the Prometheus text format, served over HTTP at /metrics.
+
+Each process keeps its own metrics in REGISTRY; NameNode and DataNode
+serve them with `serve` when started with --metrics-port. Recording is a
+dict lookup and a short lock, cheap enough for the request path; metrics
+with labels hand out a child per label combination with `labels(...)`,
+which hot paths can keep instead of looking it up each time.
+"""
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the histogram buckets of request latencies
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)  # For batch sizes and the like
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Value:
+    """The value of one counter or gauge for one set of label values."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _Buckets:
+    """The observations of one histogram for one set of label values."""
+
+    def __init__(self, bounds):
+        self.lock = threading.Lock()
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last one counts observations above every bound
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """A context manager observing the seconds its block takes."""
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("buckets", "start")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.buckets.observe(time.perf_counter() - self.start)
+
+
+class Metric:
+    """A named metric with optional labels. Subclasses say how to create and print each child."""
+    kind = None
+
+    def __init__(self, name, help, labels=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.children = {}  # Tuple of label values -> child
+        self.lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values):
+        values = tuple(map(str, values))
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            with self.lock:
+                child = self.children.setdefault(values, self._child())
+        return child
+
+    def remove(self, *values):
+        """Stop reporting the child with these label values (e.g. of a DataNode that died)."""
+        with self.lock:
+            self.children.pop(tuple(map(str, values)), None)
+
+    def _child(self):
+        raise NotImplementedError
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def samples(self):
+        """Lines of this metric in the text format, without its HELP and TYPE."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    """A value that only goes up (requests served, bytes sent).
+
+    With `function`, the value is read from that when rendered instead, for
+    counts another object keeps anyway.
+    """
+    kind = "counter"
+
+    def __init__(self, name, help, labels=(), registry=None, function=None):
+        super().__init__(name, help, labels, registry)
+        self.function = function
+
+    def _child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        if self.function is not None:
+            return [f"{self.name} {_number(self.function())}"]
+        with self.lock:
+            children = list(self.children.items())
+        return [f"{self.name}{self._label_text(values)} {_number(child.value)}" for values, child in children]
+
+
+class Gauge(Counter):
+    """A value that goes up and down."""
+    kind = "gauge"
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+
+class Histogram(Metric):
+    """Observations (latencies, sizes) counted into cumulative buckets, with their sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), registry=None, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels, registry)
+        self.bounds = tuple(sorted(buckets))
+
+    def _child(self):
+        return _Buckets(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self):
+        with self.lock:
+            children = list(self.children.items())
+        lines = []
+        for values, child in children:
+            with child.lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, n in zip(self.bounds + (float("inf"),), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{self._label_text(values, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(values)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._label_text(values)} {count}")
+        return lines
+
+
+class TimedLock:
+    """A threading.Lock whose acquisitions record how long they waited in a Histogram."""
+
+    def __init__(self, histogram):
+        self.lock = threading.Lock()
+        self.wait = histogram.labels()
+
+    def __enter__(self):
+        if not self.lock.acquire(blocking=False):
+            start = time.perf_counter()
+            self.lock.acquire()
+            self.wait.observe(time.perf_counter() - start)
+        else:
+            self.wait.observe(0)
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
+class Registry:
+    """The metrics of one process, in registration order."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def serve(host, port, registry=REGISTRY, pages=None):
+    """Serve `registry` at http://host:port/metrics on a daemon thread. Returns the server.
+
+    `pages` maps further paths to functions returning JSON-ready objects
+    (e.g. "/traces" to the recent spans of a Tracer).
+    """
+    pages = dict(pages or {})
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/metrics":
+                body, content_type = registry.render().encode(), "text/plain; version=0.0.4; charset=utf-8"
+            elif path in pages:
+                body, content_type = json.dumps(pages[path]()).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes every few seconds would drown everything else
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
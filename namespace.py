@@ -0,0 +1,592 @@
+# namespace.py
+"""The NameNode's directory tree: path lookup, listings and namespace mutations."""
+import bisect
+import itertools
+import sys
+from array import array
+
+LISTING_LIMIT = 1000  # Entries returned per listing page
+BLOCK_PREFIX = "blk_"  # Chunk IDs on the wire and on DataNodes are BLOCK_PREFIX + integer block ID
+
+
+class NamespaceError(Exception):
+    """A namespace operation that cannot be applied (missing path, name clash, ...)."""
+
+
+def split_path(path):
+    """Return the components of an absolute path ("/a/b" -> ["a", "b"]).
+
+    Relative paths are taken relative to the root, so legacy flat file names
+    still work. Empty, "." and ".." components are rejected.
+    """
+    if not isinstance(path, str):
+        raise NamespaceError(f"Invalid path: {path!r}")
+    parts = [part for part in path.split("/") if part]
+    for part in parts:
+        if part in (".", ".."):
+            raise NamespaceError(f"Invalid path: {path!r}")
+    return parts
+
+
+def normalize_path(path):
+    return "/" + "/".join(split_path(path))
+
+
+def block_name(block):
+    """The chunk ID of a block ("blk_<id>"). Legacy chunk ID strings are returned unchanged."""
+    return block if isinstance(block, str) else f"{BLOCK_PREFIX}{block}"
+
+
+def block_key(chunk_id):
+    """Inverse of block_name(): "blk_<id>" -> integer block ID; legacy chunk IDs stay strings."""
+    digits = chunk_id[len(BLOCK_PREFIX):]
+    if chunk_id.startswith(BLOCK_PREFIX) and digits.isascii() and digits.isdigit():
+        return int(digits)
+    return chunk_id
+
+
+def flat_targets(chunk_targets):
+    """Flatten per-chunk lists of DataNode IDs into one tuple of interned strings.
+
+    Returns () unless every chunk has the same number of targets, since
+    INodeFile.chunk_targets() slices the tuple at a fixed stride.
+    """
+    if len({len(targets) for targets in chunk_targets}) > 1:
+        return ()
+    return tuple(sys.intern(datanode_id) for targets in chunk_targets for datanode_id in targets)
+
+
+def compression_records(entries):
+    """Pack per-chunk compression metadata for an inode.
+
+    `entries` holds a {codec, frame_size, ends} dict, or None for a chunk
+    stored raw, per chunk. Returns None if no chunk is compressed, else a
+    tuple of (interned codec, frame size, array of frame ends) or None.
+    """
+    if not entries or not any(entries):
+        return None
+    return tuple(None if entry is None else (sys.intern(entry["codec"]), entry["frame_size"], array("Q", entry["ends"]))
+                 for entry in entries)
+
+
+def dedup_records(lengths, fingerprints):
+    """INodeFile keyword arguments for a deduplicated file's chunk lengths and hex fingerprints, if any."""
+    if fingerprints is None:
+        return {}
+    return {"lengths": array("Q", lengths), "fingerprints": tuple(bytes.fromhex(f) for f in fingerprints)}
+
+
+def intern_tier(tier):
+    """Share one string per storage tier among all inodes pinned to it."""
+    return sys.intern(tier) if tier else None
+
+
+class INodeFile:
+    """A file inode.
+
+    Its chunks are the consecutive block IDs first_block .. first_block +
+    num_blocks - 1, so a file costs the same handful of slots whatever its
+    size. Files whose blocks were allocated in several batches list their
+    ranges as (first block, count) pairs in `extents`. `targets` holds the
+    DataNode IDs each chunk was allocated to, flat and in chunk order, for
+    use until block reports arrive. Files written before integer block IDs
+    keep their chunk ID strings in `legacy_ids`.
+
+    Erasure-coded files name their policy in `ec` (e.g. "RS-6-3"). Their
+    blocks are whole stripes, each `data` data cells followed by `parity`
+    parity cells, every cell stored once; data cells past the end of the
+    file (in the last stripe) are never written and read as zeros.
+
+    Files with compressed chunks keep, in `compression`, each chunk's codec
+    and where its frames end in the stored bytes (see compression_records());
+    sizes everywhere else are uncompressed.
+
+    Deduplicated files are cut at content-defined boundaries, so their
+    chunks vary in size (up to chunk_size): `lengths` holds each chunk's
+    length and `fingerprints` its SHA-256 digest. Their blocks may be shared
+    with other deduplicated files (see Namespace).
+
+    Files pinned to a storage tier (e.g. "SSD") name it in `tier`; their
+    replicas are placed on DataNode volumes of that tier where possible.
+    """
+
+    __slots__ = ("size", "chunk_size", "first_block", "num_blocks", "complete", "targets", "legacy_ids", "extents",
+                 "ec", "compression", "lengths", "fingerprints", "tier")
+
+    def __init__(self, size, chunk_size, first_block, num_blocks, targets=(), complete=False, legacy_ids=None,
+                 extents=None, ec=None, compression=None, lengths=None, fingerprints=None, tier=None):
+        self.size = size
+        self.chunk_size = chunk_size
+        self.first_block = first_block
+        self.num_blocks = num_blocks
+        self.complete = complete
+        self.targets = targets
+        self.legacy_ids = legacy_ids
+        self.extents = extents
+        self.ec = ec
+        self.compression = compression
+        self.lengths = lengths
+        self.fingerprints = fingerprints
+        self.tier = tier
+
+    @classmethod
+    def from_blocks(cls, size, chunk_size, blocks, targets=(), complete=False, ec=None, compression=None,
+                    lengths=None, fingerprints=None, tier=None):
+        """An inode for a list of integer block IDs, grouping consecutive IDs into extents.
+
+        `lengths` and hex `fingerprints` are given for deduplicated files.
+        """
+        extents = []
+        for block in blocks:
+            if extents and extents[-1][0] + extents[-1][1] == block:
+                extents[-1][1] += 1
+            else:
+                extents.append([block, 1])
+        first_block = extents[0][0] if extents else 0
+        extents = tuple(map(tuple, extents)) if len(extents) > 1 else None
+        return cls(size, chunk_size, first_block, len(blocks), targets, complete, extents=extents, ec=ec,
+                   compression=compression_records(compression), tier=tier, **dedup_records(lengths, fingerprints))
+
+    @property
+    def dedup(self):
+        return self.fingerprints is not None
+
+    @property
+    def status(self):
+        return "complete" if self.complete else "pending"
+
+    def blocks(self):
+        """The file's block keys in chunk order: integer IDs, or legacy chunk ID strings."""
+        if self.legacy_ids is not None:
+            return self.legacy_ids
+        if self.extents is not None:
+            return itertools.chain.from_iterable(range(first, first + count) for first, count in self.extents)
+        return range(self.first_block, self.first_block + self.num_blocks)
+
+    def ranges(self):
+        """The (first block, count) ranges of a file with integer block IDs."""
+        if self.extents is not None:
+            return self.extents
+        return ((self.first_block, self.num_blocks),) if self.num_blocks else ()
+
+    def range_end(self, first):
+        """One past the last block of the range starting at `first` (`first` if there is none)."""
+        for start, count in self.ranges():
+            if start == first:
+                return start + count
+        return first
+
+    def chunk_targets(self, index):
+        """The DataNode IDs chunk `index` was allocated to."""
+        replication = len(self.targets) // self.num_blocks if self.num_blocks else 0
+        return self.targets[index * replication:(index + 1) * replication]
+
+    def chunk_compression(self, index):
+        """The {codec, frame_size, ends} of chunk `index`, or None if it is stored raw."""
+        entry = self.compression[index] if self.compression is not None else None
+        if entry is None:
+            return None
+        return {"codec": entry[0], "frame_size": entry[1], "ends": entry[2].tolist()}
+
+    def to_json(self):
+        data = {"size": self.size, "chunk_size": self.chunk_size, "status": self.status}
+        if self.legacy_ids is not None:
+            data["chunks"] = [{"chunk_id": chunk_id} for chunk_id in self.legacy_ids]
+        else:
+            data["first_block"] = self.first_block
+            data["num_blocks"] = self.num_blocks
+            if self.extents is not None:
+                data["extents"] = self.extents
+            if self.ec is not None:
+                data["ec"] = self.ec
+            if self.compression is not None:
+                data["compression"] = [self.chunk_compression(i) for i in range(self.num_blocks)]
+            if self.dedup:
+                data["lengths"] = self.lengths.tolist()
+                data["fingerprints"] = [digest.hex() for digest in self.fingerprints]
+            if self.tier is not None:
+                data["tier"] = self.tier
+        return data
+
+    @classmethod
+    def from_json(cls, data):
+        """Decode to_json() output, or a file metadata dict from before integer block IDs."""
+        if "first_block" not in data:
+            chunks = data["chunks"]
+            targets = flat_targets([[f"{dn['host']}:{dn['port']}" for dn in chunk.get("datanodes", ())]
+                                    for chunk in chunks])
+            return cls(data["size"], data.get("chunk_size"), 0, len(chunks), targets,
+                       data.get("status") == "complete", tuple(chunk["chunk_id"] for chunk in chunks))
+        extents = data.get("extents")
+        return cls(data["size"], data.get("chunk_size"), data["first_block"], data["num_blocks"],
+                   complete=data.get("status") == "complete",
+                   extents=tuple(map(tuple, extents)) if extents else None, ec=data.get("ec"),
+                   compression=compression_records(data.get("compression")), tier=intern_tier(data.get("tier")),
+                   **dedup_records(data.get("lengths"), data.get("fingerprints")))
+
+
+class Directory:
+    """A directory inode. Child names are kept sorted so listings can be paged with bisect."""
+
+    __slots__ = ("children", "names")
+
+    def __init__(self):
+        self.children = {}  # name -> Directory or INodeFile
+        self.names = []  # Sorted child names
+
+    def add(self, name, node):
+        if name not in self.children:
+            bisect.insort(self.names, name)
+        self.children[name] = node
+
+    def remove(self, name):
+        node = self.children.pop(name)
+        del self.names[bisect.bisect_left(self.names, name)]
+        return node
+
+
+def is_directory(node):
+    return isinstance(node, Directory)
+
+
+class Namespace:
+    """A tree of directories whose leaves are INodeFiles.
+
+    Also indexes which file owns each block, so block reports can tell live
+    chunks from leftovers of deleted files. Since a file's blocks are one
+    contiguous range, the index is a sorted array of range starts searched
+    with bisect rather than an entry per block. Starts of removed files are
+    left in the array (they never match a live block, as block IDs are not
+    reused) until they make up half of it. When files are removed (deleted
+    or overwritten) their block keys are passed to `on_chunks_removed`, if
+    set.
+
+    Blocks of deduplicated files are not in that index: any number of
+    files may list them, so they are reference-counted in `shared` instead,
+    and `fingerprints` finds the block holding given content. A shared
+    block is removed when the last file listing it is.
+    """
+
+    def __init__(self):
+        self.root = Directory()
+        self.file_count = 0
+        self.next_block_id = 1
+        self.block_starts = array("q")  # Sorted first blocks of indexed ranges, including some removed ones
+        self.files_by_start = {}  # First block of a range -> INodeFile, live files only
+        self.stale_starts = 0  # Entries of block_starts no longer in files_by_start
+        self.legacy_blocks = {}  # Legacy chunk ID -> INodeFile
+        self.shared = {}  # Block of deduplicated files -> [references, fingerprint, length, allocation targets]
+        self.fingerprints = {}  # SHA-256 digest -> shared block with that content
+        self.on_chunks_removed = None
+
+    # Lookup
+
+    def lookup(self, path):
+        """Return the Directory or INodeFile at `path`, or None."""
+        node = self.root
+        for part in split_path(path):
+            if not is_directory(node):
+                return None
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def get_file(self, path):
+        node = self.lookup(path)
+        return None if node is None or is_directory(node) else node
+
+    def listing(self, path, start_after=None, limit=LISTING_LIMIT):
+        """Return (entries, has_more) for the children of `path` named after `start_after`."""
+        node = self.lookup(path)
+        if node is None:
+            raise NamespaceError(f"No such file or directory: {normalize_path(path)}")
+        if not is_directory(node):
+            return [self._entry(split_path(path)[-1], node)], False
+        start = bisect.bisect_right(node.names, start_after) if start_after is not None else 0
+        names = node.names[start:start + limit]
+        entries = [self._entry(name, node.children[name]) for name in names]
+        return entries, start + limit < len(node.names)
+
+    @staticmethod
+    def _entry(name, node):
+        if is_directory(node):
+            return {"name": name, "type": "directory", "children": len(node.children)}
+        return {"name": name, "type": "file", "size": node.size, "status": node.status}
+
+    def is_live(self, block):
+        """Whether any file lists the block."""
+        return block in self.shared or self.owner(block) is not None
+
+    def find_block(self, fingerprint, length):
+        """The shared block holding the content with this SHA-256 digest (bytes) and length, or None."""
+        block = self.fingerprints.get(fingerprint)
+        return block if block is not None and self.shared[block][2] == length else None
+
+    def owner(self, block):
+        """The file owning a block (integer ID or legacy chunk ID), or None.
+
+        Shared blocks of deduplicated files have no single owner (None).
+        """
+        if isinstance(block, str):
+            return self.legacy_blocks.get(block)
+        i = bisect.bisect_right(self.block_starts, block) - 1
+        if i < 0:
+            return None
+        inode = self.files_by_start.get(self.block_starts[i])
+        if inode is None or block >= inode.range_end(self.block_starts[i]):
+            return None
+        return inode
+
+    def iter_files(self, path="/"):
+        """Yield (path, INodeFile) for every file under `path`."""
+        node = self.lookup(path)
+        prefix = normalize_path(path)
+        if node is None:
+            return
+        if not is_directory(node):
+            yield prefix, node
+            return
+        stack = [(prefix.rstrip("/"), node)]
+        while stack:
+            dir_path, directory = stack.pop()
+            for name, child in directory.children.items():
+                child_path = f"{dir_path}/{name}"
+                if is_directory(child):
+                    stack.append((child_path, child))
+                else:
+                    yield child_path, child
+
+    # Mutations (applied by the NameNode's metadata writer and on edit log replay)
+
+    def allocate_blocks(self, count):
+        """Reserve `count` consecutive block IDs and return the first.
+
+        On the NameNode only the metadata writer calls this, applying a
+        reserve_blocks edit that logs the new next_block_id, so IDs handed
+        out are never reused after a restart.
+        """
+        first = self.next_block_id
+        self.next_block_id += count
+        return first
+
+    def _parent(self, parts, create=False):
+        """Return the Directory holding the last component of `parts`."""
+        node = self.root
+        for i, part in enumerate(parts[:-1]):
+            child = node.children.get(part)
+            if child is None:
+                if not create:
+                    raise NamespaceError(f"No such directory: /{'/'.join(parts[:i + 1])}")
+                child = Directory()
+                node.add(part, child)
+            elif not is_directory(child):
+                raise NamespaceError(f"Not a directory: /{'/'.join(parts[:i + 1])}")
+            node = child
+        return node
+
+    def add_file(self, path, inode, reused=(), chunk_targets=None):
+        """Create (or replace) the file at `path`, creating missing parent directories.
+
+        `reused` lists shared blocks a deduplicated file expects other files
+        to hold already; if one has been removed meanwhile the file is not
+        added. The allocation targets of a deduplicated file's chunks are
+        kept with its new shared blocks (`chunk_targets`, per chunk) rather
+        than in the inode.
+        """
+        parts = split_path(path)
+        if not parts:
+            raise NamespaceError("Cannot create a file at /")
+        for block in reused:
+            if block not in self.shared:
+                raise NamespaceError(f"Chunk {block_name(block)} reused by {normalize_path(path)} was removed")
+        parent = self._parent(parts, create=True)
+        existing = parent.children.get(parts[-1])
+        if is_directory(existing):
+            raise NamespaceError(f"Is a directory: {normalize_path(path)}")
+        if existing is not None:
+            self._forget_file(existing)
+        parent.add(parts[-1], inode)
+        self.file_count += 1
+        self._index_file(inode, chunk_targets)
+        if inode.legacy_ids is None and not inode.dedup:
+            for first, _ in inode.ranges():
+                if self.block_starts and first < self.block_starts[-1]:
+                    bisect.insort(self.block_starts, first)
+                else:
+                    self.block_starts.append(first)
+        return True
+
+    def complete_file(self, path):
+        inode = self.get_file(path)
+        if inode is None:
+            return False
+        inode.complete = True
+        return True
+
+    def mkdir(self, path):
+        """Create a directory and any missing parents. Returns False if it already exists."""
+        parts = split_path(path)
+        if not parts:
+            return False
+        parent = self._parent(parts, create=True)
+        existing = parent.children.get(parts[-1])
+        if existing is not None:
+            if is_directory(existing):
+                return False
+            raise NamespaceError(f"File exists: {normalize_path(path)}")
+        parent.add(parts[-1], Directory())
+        return True
+
+    def rename(self, src, dst):
+        """Move a file or directory. The destination must not exist; its parent must."""
+        src_parts = split_path(src)
+        dst_parts = split_path(dst)
+        if not src_parts or not dst_parts:
+            raise NamespaceError("Cannot rename /")
+        if len(dst_parts) > len(src_parts) and dst_parts[:len(src_parts)] == src_parts:
+            raise NamespaceError(f"Cannot move {normalize_path(src)} inside itself")
+        src_parent = self._parent(src_parts)
+        if src_parts[-1] not in src_parent.children:
+            raise NamespaceError(f"No such file or directory: {normalize_path(src)}")
+        dst_parent = self._parent(dst_parts)
+        if dst_parts[-1] in dst_parent.children:
+            raise NamespaceError(f"Destination exists: {normalize_path(dst)}")
+        dst_parent.add(dst_parts[-1], src_parent.remove(src_parts[-1]))
+        return True
+
+    def replace(self, src, dst, first_chunk=None):
+        """Move the file at `src` over the file at `dst`, whose blocks are removed.
+
+        With `first_chunk`, only while `dst` is still the file with that first
+        chunk ID, so a file rewritten in the meantime is never clobbered.
+        """
+        target = self.get_file(dst)
+        if target is None:
+            raise NamespaceError(f"No such file: {normalize_path(dst)}")
+        if first_chunk is not None and block_name(next(iter(target.blocks()), "")) != first_chunk:
+            raise NamespaceError(f"{normalize_path(dst)} was changed")
+        if self.get_file(src) is None:
+            raise NamespaceError(f"No such file: {normalize_path(src)}")
+        self.delete(dst)
+        return self.rename(src, dst)
+
+    def delete(self, path, recursive=False):
+        """Remove a file or directory. Returns False if nothing is there."""
+        parts = split_path(path)
+        if not parts:
+            raise NamespaceError("Cannot delete /")
+        try:
+            parent = self._parent(parts)
+        except NamespaceError:
+            return False
+        node = parent.children.get(parts[-1])
+        if node is None:
+            return False
+        if is_directory(node) and node.children and not recursive:
+            raise NamespaceError(f"Directory not empty: {normalize_path(path)}")
+        parent.remove(parts[-1])
+        if is_directory(node):
+            stack = [node]
+            while stack:
+                for child in stack.pop().children.values():
+                    if is_directory(child):
+                        stack.append(child)
+                    else:
+                        self._forget_file(child)
+        else:
+            self._forget_file(node)
+        return True
+
+    def _index_file(self, inode, chunk_targets=None):
+        """Record the file's blocks as owned, except in block_starts (callers keep that sorted)."""
+        if inode.legacy_ids is not None:
+            for chunk_id in inode.legacy_ids:
+                self.legacy_blocks[chunk_id] = inode
+        elif inode.dedup:
+            for i, (block, digest, length) in enumerate(zip(inode.blocks(), inode.fingerprints, inode.lengths)):
+                entry = self.shared.get(block)
+                if entry is None:
+                    targets = tuple(map(sys.intern, chunk_targets[i])) if chunk_targets else ()
+                    self.shared[block] = [1, digest, length, targets]
+                    self.fingerprints.setdefault(digest, block)
+                else:
+                    entry[0] += 1
+                self.next_block_id = max(self.next_block_id, block + 1)
+        else:
+            for first, count in inode.ranges():
+                self.files_by_start[first] = inode
+                self.next_block_id = max(self.next_block_id, first + count)
+
+    def _forget_file(self, inode):
+        self.file_count -= 1
+        if inode.dedup:
+            blocks = []  # Shared blocks no other file lists
+            for block in inode.blocks():
+                entry = self.shared[block]
+                entry[0] -= 1
+                if not entry[0]:
+                    del self.shared[block]
+                    if self.fingerprints.get(entry[1]) == block:
+                        del self.fingerprints[entry[1]]
+                    blocks.append(block)
+            if self.on_chunks_removed and blocks:
+                self.on_chunks_removed(blocks)
+            return
+        if inode.legacy_ids is not None:
+            for chunk_id in inode.legacy_ids:
+                if self.legacy_blocks.get(chunk_id) is inode:
+                    del self.legacy_blocks[chunk_id]
+        else:
+            for first, _ in inode.ranges():
+                if self.files_by_start.get(first) is inode:
+                    del self.files_by_start[first]
+                    self.stale_starts += 1
+            if self.stale_starts > len(self.block_starts) // 2:
+                self.block_starts = array("q", sorted(self.files_by_start))
+                self.stale_starts = 0
+        blocks = list(inode.blocks())
+        if self.on_chunks_removed and blocks:
+            self.on_chunks_removed(blocks)
+
+    # Snapshots
+
+    def to_snapshot(self):
+        """A JSON-ready nested copy of the tree.
+
+        Allocation targets are left out: after a restart, block reports say
+        where chunks are.
+        """
+        def encode(directory):
+            return {"type": "directory",
+                    "children": {name: encode(child) if is_directory(child) else child.to_json()
+                                 for name, child in directory.children.items()}}
+        return {"/": encode(self.root), "next_block_id": self.next_block_id}
+
+    @classmethod
+    def from_snapshot(cls, files):
+        """Build a Namespace from `to_snapshot()` output, or from a legacy flat {name: meta} dict."""
+        namespace = cls()
+        if "/" not in files:
+            for name, meta in files.items():
+                namespace.add_file(name, INodeFile.from_json(meta))
+            return namespace
+        namespace.next_block_id = files.get("next_block_id", 1)
+
+        def decode(data, directory):
+            # Children are re-added in sorted order, so building the name list is linear
+            for name in sorted(data["children"]):
+                child = data["children"][name]
+                if child.get("type") == "directory":
+                    node = Directory()
+                    decode(child, node)
+                    directory.children[name] = node
+                else:
+                    node = INodeFile.from_json(child)
+                    directory.children[name] = node
+                    namespace.file_count += 1
+                    namespace._index_file(node)
+                directory.names.append(name)
+        decode(files["/"], namespace.root)
+        namespace.block_starts = array("q", sorted(namespace.files_by_start))
+        return namespace
@@ -0,0 +1,132 @@
+# placement.py
+"""Block placement: which DataNodes receive the replicas of each chunk."""
+import bisect
+import itertools
+import random
+
+DEFAULT_RACK = "/default-rack"
+NOMINAL_BANDWIDTH = 100 * 1024 * 1024  # Bytes/s of reported throughput counted as one in-flight transfer
+MAX_REJECTIONS = 16  # Weighted draws tried before falling back to an explicit scan
+
+
+def node_id(node):
+    return f"{node['host']}:{node['port']}"
+
+
+class PlacementPolicy:
+    """Load- and capacity-aware, rack-aware replica placement.
+
+    Each DataNode gets a weight proportional to its free space (minus bytes
+    already scheduled to it), discounted by its load: in-flight transfers
+    plus recent throughput in units of NOMINAL_BANDWIDTH. Replicas are drawn
+    by weighted random choice, so load spreads across the cluster in
+    proportion to capacity without every chunk landing on the single "best"
+    node.
+
+    Rack awareness follows HDFS: the second replica goes to a different rack
+    than the first, the third to the same rack as the second (on another
+    node), and any further replicas anywhere not yet used.
+
+    For a file pinned to a storage `tier`, a node's free space is that of
+    its volumes of the tier (from its heartbeats' "storage"), so replicas go
+    to nodes that have the tier while there are enough of them; the rest
+    fall back to nodes without it.
+    """
+
+    def __init__(self, replication=2, rng=None):
+        self.replication = replication
+        self.rng = rng or random.Random()
+        self.scheduled = {}  # node id -> bytes allocated since its last heartbeat
+
+    def node_weight(self, node, tier=None):
+        if tier is not None:
+            free = ((node.get("storage") or {}).get(tier) or {}).get("free_bytes", 0)
+        else:
+            free = node.get("free_bytes")
+        if free is None:
+            free = 1  # Nodes that do not report capacity still take a (small) share
+        free -= self.scheduled.get(node_id(node), 0)
+        load = node.get("inflight", 0) + node.get("throughput", 0) / NOMINAL_BANDWIDTH
+        return max(free, 0) / (1 + load)
+
+    def heartbeat(self, node):
+        """Fresh free-space figures from a heartbeat supersede our scheduled-bytes estimate."""
+        self.scheduled.pop(node_id(node), None)
+
+    def allocate(self, nodes, num_chunks, chunk_size, width=None, tier=None):
+        """Return a list of replica node lists, one per chunk, or None if there are too few nodes.
+
+        With `width`, each entry is instead `width` distinct nodes for the
+        cells of one erasure-coded stripe, spread over as many racks as
+        possible so a rack failure costs few cells of any stripe.
+        """
+        replicas = width or self.replication
+        if len(nodes) < replicas:
+            return None
+        weights = [self.node_weight(node, tier) for node in nodes]
+        if not any(weights):
+            weights = [1] * len(nodes)  # Everybody is full or unknown: fall back to uniform
+        cum_weights = list(itertools.accumulate(weights))
+        racks = [node.get("rack", DEFAULT_RACK) for node in nodes]
+        rack_count = len(set(racks))
+
+        allocations = []
+        for _ in range(num_chunks):
+            chosen = []
+            for replica in range(replicas):
+                if width:
+                    used = {racks[i] for i in chosen}
+                    want = (lambda i, used=used: racks[i] not in used) if len(used) < rack_count else None
+                elif replica == 1:
+                    want = lambda i: racks[i] != racks[chosen[0]]
+                elif replica == 2:
+                    want = lambda i: racks[i] == racks[chosen[1]]
+                else:
+                    want = None
+                chosen.append(self._pick(cum_weights, weights, chosen, want))
+            allocations.append([nodes[i] for i in chosen])
+            for i in chosen:
+                key = node_id(nodes[i])
+                self.scheduled[key] = self.scheduled.get(key, 0) + chunk_size
+        return allocations
+
+    def choose_target(self, nodes, holders, chunk_size, tier=None):
+        """Pick one extra replica location for a chunk already stored on `holders`.
+
+        Prefers a rack none of the holders is on. Returns None if every
+        node already holds the chunk.
+        """
+        holder_ids = {node_id(node) for node in holders}
+        candidates = [node for node in nodes if node_id(node) not in holder_ids]
+        if not candidates:
+            return None
+        weights = [self.node_weight(node, tier) for node in candidates]
+        if not any(weights):
+            weights = [1] * len(candidates)
+        holder_racks = {node.get("rack", DEFAULT_RACK) for node in holders}
+        racks = [node.get("rack", DEFAULT_RACK) for node in candidates]
+        i = self._pick(list(itertools.accumulate(weights)), weights, [], lambda i: racks[i] not in holder_racks)
+        target = candidates[i]
+        key = node_id(target)
+        self.scheduled[key] = self.scheduled.get(key, 0) + chunk_size
+        return target
+
+    def _pick(self, cum_weights, weights, chosen, want):
+        """Weighted draw of a node index not in `chosen`, preferring ones satisfying `want`."""
+        total = cum_weights[-1]
+        for _ in range(MAX_REJECTIONS):
+            i = bisect.bisect_right(cum_weights, self.rng.random() * total)
+            i = min(i, len(cum_weights) - 1)
+            if i not in chosen and (want is None or want(i)):
+                return i
+        # Rare path: the preferred set is small or light. Draw from it explicitly,
+        # relaxing the rack preference if nothing satisfies it.
+        for predicate in (want, None):
+            candidates = [i for i in range(len(weights))
+                          if i not in chosen and (predicate is None or predicate(i))]
+            if candidates:
+                candidate_weights = [weights[i] for i in candidates]
+                if not any(candidate_weights):
+                    candidate_weights = None
+                return self.rng.choices(candidates, candidate_weights)[0]
+        raise ValueError("Not enough DataNodes for the requested replication")
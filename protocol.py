@@ -0,0 +1,345 @@
+# protocol.py
+"""Wire protocol helpers and the client-side connection pool.
+
+Two framings share every connection type:
+
+  v1  a 4-byte big-endian length followed by UTF-8 JSON
+  v2  a 12-byte binary header (FRAME_HEADER: magic, version, body codec,
+      flags, request_id, body length) followed by the body, encoded with
+      msgpack when both peers have it and JSON otherwise
+
+The first byte tells them apart: v2 frames start with MAGIC, which a v1
+frame could only do with a body over 3.5 GB. Servers answer in the framing
+of the request. Clients open each connection by sending a v1 "hello"
+listing the versions and codecs they support; a peer that predates v2
+does not recognise it, so the connection simply stays on v1.
+
+A message may carry a "request_id"; servers echo it in the response, which
+lets several requests be in flight on one connection at once. Bulk data
+(chunk contents) is never framed: it follows its message as raw bytes, so
+it can go through sendfile and recv_into without copies.
+"""
+import contextlib
+import itertools
+import json
+import os
+import select
+import socket
+import struct
+import threading
+import time
+import weakref
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CONNECT_TIMEOUT = 10
+MAX_IDLE_PER_HOST = 8  # Idle pooled connections kept per (host, port)
+IDLE_TIMEOUT = 60  # Seconds an idle pooled connection is kept open
+PROTOCOL_VERSION = 2  # Highest framing version spoken here
+MAGIC = 0xD5  # First byte of every v2 frame
+FRAME_HEADER = struct.Struct("!BBBBII")  # magic, version, codec, flags, request_id, body length
+
+# Body codecs of v2 frames: id -> (name, encode, decode), most preferred first
+CODECS = {}
+if msgpack is not None:
+    CODECS[1] = ("msgpack", msgpack.packb, msgpack.unpackb)
+_json_encoder = json.JSONEncoder(separators=(",", ":"))
+CODECS[0] = ("json", lambda message: _json_encoder.encode(message).encode("utf-8"), json.loads)
+CODEC_IDS = {name: codec for codec, (name, _, _) in CODECS.items()}
+
+# Socket -> (version, codec) it speaks: set by the hello exchange on clients
+# and by the last frame received on servers. Sockets not listed speak v1.
+_framing = weakref.WeakKeyDictionary()
+
+
+def recv_into_exact(sock, view):
+    """Fill a memoryview from a socket."""
+    received = 0
+    while received < len(view):
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("Connection closed by peer")
+        received += count
+
+
+def recv_exact(sock, n):
+    """Read exactly n bytes from a socket into a new bytearray."""
+    buf = bytearray(n)
+    recv_into_exact(sock, memoryview(buf))
+    return buf
+
+
+def encode_frame(message, version=1, codec=0):
+    """Serialize one message in the given framing."""
+    if version < 2:
+        data = json.dumps(message).encode('utf-8')
+        return len(data).to_bytes(4, byteorder='big') + data
+    request_id = message.get("request_id")
+    if request_id is not None:
+        message = {key: value for key, value in message.items() if key != "request_id"}
+    body = CODECS[codec][1](message)
+    return FRAME_HEADER.pack(MAGIC, version, codec, 0, request_id or 0, len(body)) + body
+
+
+def decode_frame(header, body):
+    """Parse a v2 frame from its FRAME_HEADER bytes and body. Returns (message, version, codec)."""
+    _, version, codec, _, request_id, _ = FRAME_HEADER.unpack(header)
+    return _decode_body(codec, body, request_id), version, codec
+
+
+def _decode_body(codec, body, request_id):
+    try:
+        message = CODECS[codec][2](body)
+    except KeyError:
+        raise ValueError(f"Unsupported frame codec {codec}")
+    if request_id:
+        message["request_id"] = request_id
+    return message
+
+
+def send_message(sock, message):
+    sock.sendall(encode_frame(message, *_framing.get(sock, (1, 0))))
+
+
+def recv_message(sock):
+    """Read one message of either framing. Returns None if the peer closed the connection between messages."""
+    header = bytearray(FRAME_HEADER.size)
+    view = memoryview(header)
+    count = sock.recv_into(view[:4])
+    if not count:
+        return None
+    recv_into_exact(sock, view[count:4])
+    if header[0] != MAGIC:
+        return json.loads(recv_exact(sock, int.from_bytes(header[:4], byteorder='big')))
+    recv_into_exact(sock, view[4:])
+    _, version, codec, _, request_id, length = FRAME_HEADER.unpack(header)
+    message = _decode_body(codec, recv_exact(sock, length), request_id)
+    if _framing.get(sock) != (version, codec):
+        _framing[sock] = (version, codec)
+    return message
+
+
+def send_fds_message(sock, message, fds):
+    """Send one v1 message over a Unix socket with open file descriptors attached (SCM_RIGHTS)."""
+    frame = encode_frame(message)
+    sent = socket.send_fds(sock, [frame], fds)
+    if sent < len(frame):
+        sock.sendall(memoryview(frame)[sent:])
+
+
+def recv_fds_message(sock, maxfds):
+    """Receive a message sent with send_fds_message. Returns (message, fds); the caller owns the fds."""
+    data, fds, _, _ = socket.recv_fds(sock, 64 * 1024, maxfds)
+    try:
+        if not data:
+            raise ConnectionError("Connection closed by peer")
+        if len(data) < 4:
+            data += recv_exact(sock, 4 - len(data))
+        length = int.from_bytes(data[:4], byteorder='big')
+        if len(data) < 4 + length:
+            data += recv_exact(sock, 4 + length - len(data))
+        return json.loads(data[4:4 + length]), fds
+    except BaseException:
+        for fd in fds:
+            os.close(fd)
+        raise
+
+
+def hello_response(message):
+    """A server's answer to a client's hello: the highest common version and the preferred common codec."""
+    version = min(max(message.get("versions", [1])), PROTOCOL_VERSION)
+    offered = message.get("codecs", ["json"])
+    codec = next(name for name in CODEC_IDS if name in offered or name == "json")
+    return {"status": "ok", "version": version, "codec": codec}
+
+
+def negotiate(sock):
+    """Agree on a framing with the server at the other end of a new connection."""
+    send_message(sock, {"action": "hello", "message_type": "hello", "versions": list(range(1, PROTOCOL_VERSION + 1)),
+                        "codecs": list(CODEC_IDS)})
+    response = recv_message(sock)
+    if response is None:
+        raise ConnectionError("Connection closed during hello")
+    version = response.get("version", 1)  # Older servers answer with an error
+    if version >= 2 and response.get("codec") in CODEC_IDS:
+        _framing[sock] = (version, CODEC_IDS[response["codec"]])
+    return version
+
+
+def _is_stale(sock):
+    """An idle connection that is readable has been closed (or desynchronized) by the peer."""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+class MultiplexedConnection:
+    """One socket shared by many concurrent request/response calls.
+
+    Each call is tagged with a fresh request_id; a reader thread routes
+    responses back to the waiting callers, in whatever order they arrive.
+    """
+
+    def __init__(self, host, port, timeout=CONNECT_TIMEOUT):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        try:
+            negotiate(self.sock)
+        except Exception:
+            self.sock.close()
+            raise
+        self.sock.settimeout(None)
+        self.send_lock = threading.Lock()
+        self.pending = {}
+        self.ids = itertools.count(1)
+        self.closed = False
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def call(self, message, timeout=None):
+        request_id = next(self.ids)
+        future = Future()
+        self.pending[request_id] = future
+        try:
+            with self.send_lock:
+                if self.closed:
+                    raise ConnectionError("Connection closed")
+                send_message(self.sock, dict(message, request_id=request_id))
+            response = future.result(timeout)
+        except FutureTimeout:
+            raise TimeoutError(f"No response to {message.get('action', 'request')} within {timeout}s")
+        except OSError:
+            self.close()
+            raise
+        finally:
+            self.pending.pop(request_id, None)
+        response.pop("request_id", None)
+        return response
+
+    def _read_loop(self):
+        error = ConnectionError("Connection closed by peer")
+        try:
+            while True:
+                response = recv_message(self.sock)
+                if response is None:
+                    break
+                future = self.pending.pop(response.get("request_id"), None)
+                if future is not None:
+                    future.set_result(response)
+        except (OSError, ValueError) as e:
+            error = ConnectionError(f"Connection lost: {e}")
+        self.close()
+        for future in list(self.pending.values()):
+            if not future.done():
+                future.set_exception(error)
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class ConnectionPool:
+    """Keep-alive connections keyed by (host, port).
+
+    `call()` sends small RPCs over one shared multiplexed connection per
+    peer. `connection()` checks out an exclusive socket for streaming
+    transfers and returns it to the pool afterwards, unless the transfer
+    failed, in which case the socket is closed.
+    """
+
+    def __init__(self, max_idle=MAX_IDLE_PER_HOST, idle_timeout=IDLE_TIMEOUT):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.idle = {}  # (host, port) -> [(socket, idle_since), ...]
+        self.multiplexed = {}  # (host, port) -> MultiplexedConnection
+
+    def call(self, host, port, message, timeout=CONNECT_TIMEOUT):
+        """Send one RPC and return its response."""
+        key = (host, port)
+        with self.lock:
+            conn = self.multiplexed.get(key)
+            if conn is None or conn.closed:
+                conn = None
+        if conn is None:
+            conn = MultiplexedConnection(host, port, timeout)
+            with self.lock:
+                existing = self.multiplexed.get(key)
+                if existing is not None and not existing.closed:
+                    conn.close()
+                    conn = existing
+                else:
+                    self.multiplexed[key] = conn
+        return conn.call(message, timeout)
+
+    @contextlib.contextmanager
+    def connection(self, host, port, timeout=CONNECT_TIMEOUT):
+        """Check out an exclusive connection to (host, port) for the duration of a `with` block."""
+        sock = self.acquire(host, port, timeout)
+        try:
+            yield sock
+        except BaseException:
+            self.release(host, port, sock, reusable=False)
+            raise
+        self.release(host, port, sock)
+
+    def acquire(self, host, port, timeout=CONNECT_TIMEOUT):
+        """Check out an exclusive connection; hand it back with `release()`."""
+        sock = self._checkout((host, port))
+        if sock is None:
+            sock = socket.create_connection((host, port), timeout=timeout)
+            try:
+                negotiate(sock)
+            except Exception:
+                sock.close()
+                raise
+        sock.settimeout(timeout)
+        return sock
+
+    def release(self, host, port, sock, reusable=True):
+        """Return a connection to the pool, or close it if it may be mid-message."""
+        if reusable:
+            self._checkin((host, port), sock)
+        else:
+            sock.close()
+
+    def _checkout(self, key):
+        now = time.monotonic()
+        while True:
+            with self.lock:
+                idle = self.idle.get(key)
+                if not idle:
+                    return None
+                sock, idle_since = idle.pop()
+            if now - idle_since < self.idle_timeout and not _is_stale(sock):
+                return sock
+            sock.close()
+
+    def _checkin(self, key, sock):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append((sock, time.monotonic()))
+                return
+        sock.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+            multiplexed, self.multiplexed = self.multiplexed, {}
+        for sockets in idle.values():
+            for sock, _ in sockets:
+                sock.close()
+        for conn in multiplexed.values():
+            conn.close()
+
+
+default_pool = ConnectionPool()
@@ -0,0 +1,163 @@
+# replication.py
+"""Re-replication of under-replicated chunks after DataNode failures."""
+import time
+
+from namespace import block_name
+
+PRIORITY_LAST_REPLICA = 0  # Only one live replica left: one more failure loses data
+PRIORITY_UNDER_REPLICATED = 1
+
+
+class ReplicationMonitor:
+    """Finds under-replicated chunks and schedules DataNode-to-DataNode copies.
+
+    Chunks become suspects when a DataNode holding them dies, when a block
+    report drops them, or when a full block report lists them. Each
+    scheduling round checks the suspects against the live replica index,
+    most urgent first (chunks down to their last replica before chunks
+    missing only one of several), and queues "replicate" commands for
+    source DataNodes; these are delivered in heartbeat responses. No node
+    takes part (as source or target) in more than `max_streams` copies at
+    once, so repair traffic cannot starve client I/O.
+
+    Chunks are tracked by their NameNode block keys (see
+    namespace.block_key); commands carry the chunk ID DataNodes know.
+    Chunks that should have a replica count other than `replication`
+    (cells of erasure-coded files have one) are given by `replicas_of`,
+    if set: block key -> wanted replicas. Likewise `tier_of` gives the
+    storage tier new copies should be placed on (None for any).
+    """
+
+    def __init__(self, replication, max_streams=2, timeout=300, startup_delay=30):
+        self.replication = replication
+        self.max_streams = max_streams
+        self.timeout = timeout
+        self.not_before = time.time() + startup_delay  # Let block reports arrive before judging
+        self.suspects = set()
+        self.pending = {}  # block key -> [(source ID, target ID, deadline), ...]
+        self.streams = {}  # DataNode ID -> copies it is taking part in
+        self.commands = {}  # DataNode ID -> commands awaiting its next heartbeat
+        self.missing = set()  # Chunks with no live replica at all
+        self.replicas_of = None
+        self.tier_of = None
+
+    def check(self, chunk_id):
+        self.suspects.add(chunk_id)
+
+    def chunk_reported(self, chunk_id, datanode_id):
+        """A block report shows `datanode_id` now holds the chunk; finish any copy targeting it."""
+        self.missing.discard(chunk_id)
+        copies = self.pending.get(chunk_id)
+        if not copies:
+            return
+        for copy in list(copies):
+            if copy[1] == datanode_id:
+                copies.remove(copy)
+                self._release(copy)
+        if not copies:
+            del self.pending[chunk_id]
+
+    def node_dead(self, datanode_id):
+        """Forget commands for a dead node and retry copies it was part of."""
+        self.commands.pop(datanode_id, None)
+        for chunk_id, copies in list(self.pending.items()):
+            for copy in list(copies):
+                if datanode_id in copy[:2]:
+                    copies.remove(copy)
+                    self._release(copy)
+                    self.suspects.add(chunk_id)
+            if not copies:
+                del self.pending[chunk_id]
+
+    def invalidate(self, chunk_id, datanode_ids):
+        """Stop repairing a chunk that no longer belongs to a file and have its replicas deleted."""
+        self.suspects.discard(chunk_id)
+        self.missing.discard(chunk_id)
+        for copy in self.pending.pop(chunk_id, ()):
+            self._release(copy)
+        for datanode_id in datanode_ids:
+            self.commands.setdefault(datanode_id, []).append({"command": "delete", "chunk_id": block_name(chunk_id)})
+
+    def wanted(self, chunk_id):
+        """How many replicas the chunk should have."""
+        if self.replicas_of is None:
+            return self.replication
+        return self.replicas_of(chunk_id)
+
+    def take_commands(self, datanode_id):
+        return self.commands.pop(datanode_id, [])
+
+    def schedule(self, block_index, datanodes, placement, chunk_size=0):
+        """Run one scheduling round. Returns the number of copies scheduled."""
+        now = time.time()
+        if now < self.not_before:
+            return 0
+        self._expire(now)
+
+        queue = []
+        for chunk_id in list(self.suspects):
+            live = [dn for dn in block_index.get(chunk_id, ()) if dn in datanodes]
+            pending = len(self.pending.get(chunk_id, ()))
+            wanted = self.wanted(chunk_id)
+            if not live:
+                if chunk_id not in self.missing:
+                    print(f"[NameNode] Chunk {block_name(chunk_id)} has no live replicas")
+                    self.missing.add(chunk_id)
+                self.suspects.discard(chunk_id)
+            elif len(live) + pending >= wanted:
+                self.suspects.discard(chunk_id)
+            else:
+                priority = PRIORITY_LAST_REPLICA if len(live) == 1 else PRIORITY_UNDER_REPLICATED
+                queue.append((priority, len(live) / wanted, chunk_id, live, wanted))
+        queue.sort(key=lambda entry: entry[:2])  # Block keys may mix integer and legacy string IDs
+
+        scheduled = 0
+        for _, _, chunk_id, live, wanted in queue:
+            copies = self.pending.setdefault(chunk_id, [])
+            needed = wanted - len(live) - len(copies)
+            holders = [datanodes[dn] for dn in live] + [datanodes[c[1]] for c in copies if c[1] in datanodes]
+            tier = self.tier_of(chunk_id) if self.tier_of is not None else None
+            for _ in range(needed):
+                sources = [dn for dn in live if self.streams.get(dn, 0) < self.max_streams]
+                if not sources:
+                    break
+                source = min(sources, key=lambda dn: self.streams.get(dn, 0))
+                candidates = [node for node_id, node in datanodes.items()
+                              if self.streams.get(node_id, 0) < self.max_streams]
+                target = placement.choose_target(candidates, holders, chunk_size, tier)
+                if target is None:
+                    break
+                target_id = f"{target['host']}:{target['port']}"
+                copy = (source, target_id, now + self.timeout)
+                copies.append(copy)
+                holders.append(target)
+                self.streams[source] = self.streams.get(source, 0) + 1
+                self.streams[target_id] = self.streams.get(target_id, 0) + 1
+                command = {
+                    "command": "replicate",
+                    "chunk_id": block_name(chunk_id),
+                    "target": {"host": target["host"], "port": target["port"]}
+                }
+                if tier is not None:
+                    command["tier"] = tier
+                self.commands.setdefault(source, []).append(command)
+                scheduled += 1
+            if not copies:
+                del self.pending[chunk_id]
+        if scheduled:
+            print(f"[NameNode] Scheduled {scheduled} re-replication(s), {len(self.suspects)} chunk(s) still queued")
+        return scheduled
+
+    def _expire(self, now):
+        for chunk_id, copies in list(self.pending.items()):
+            for copy in list(copies):
+                if copy[2] < now:
+                    copies.remove(copy)
+                    self._release(copy)
+                    self.suspects.add(chunk_id)
+            if not copies:
+                del self.pending[chunk_id]
+
+    def _release(self, copy):
+        for datanode_id in copy[:2]:
+            self.streams[datanode_id] = max(0, self.streams.get(datanode_id, 0) - 1)
@@ -0,0 +1,121 @@
+# shortcircuit.py
+"""Short-circuit reads: a client on the same host as a replica maps the chunk file instead of streaming it.
+
+A DataNode started with --domain-socket listens on that Unix socket and
+advertises its path in heartbeats; the NameNode lists it with the
+DataNode's replicas. A client that finds the replica's host is its own
+sends {"message_type": "request_fd", "chunk_id"} over the socket and gets
+back an open descriptor of the chunk (SCM_RIGHTS) with its checksums, and
+maps the chunk into memory. Reads then copy straight out of the page
+cache: no TCP, no DataNode thread per read, no receive buffers.
+
+Mapped chunks are kept in a ShortCircuitCache, so later reads of the same
+chunk (the windows of a DFSReader) skip the round trip. Chunk IDs are
+never reused for other data, so a mapping stays good even if the DataNode
+deletes or moves the file meanwhile; it is unmapped once evicted and no
+longer being read.
+"""
+import functools
+import mmap
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from protocol import CONNECT_TIMEOUT, recv_fds_message, send_message
+
+SHORT_CIRCUIT_CACHE = 256  # Mapped chunks a client keeps open
+RETRY_DELAY = 30  # Seconds before a domain socket that failed is tried again
+
+
+@functools.lru_cache(maxsize=1024)
+def is_local(host):
+    """Whether `host` is an address of this machine, i.e. one a socket can bind to."""
+    try:
+        addresses = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    except OSError:
+        return False
+    for family, _, _, _, address in addresses:
+        try:
+            with socket.socket(family, socket.SOCK_STREAM) as s:
+                s.bind((address[0], 0))
+            return True
+        except OSError:
+            continue
+    return False
+
+
+class MappedChunk:
+    """A chunk mapped read-only into memory, with the checksums the DataNode stores for it."""
+
+    def __init__(self, fd, header):
+        self.size = header["size"]
+        self.data = mmap.mmap(fd, self.size, access=mmap.ACCESS_READ) if self.size else b""
+        self.checksums = header["checksums"]
+        self.algorithm = header.get("algorithm")
+        self.bytes_per_checksum = header.get("bytes_per_checksum")
+
+
+class ShortCircuitCache:
+    """The chunks this client has mapped, least recently used first, and domain sockets that failed."""
+
+    def __init__(self, capacity=SHORT_CIRCUIT_CACHE):
+        self.capacity = capacity
+        self.chunks = OrderedDict()  # (domain socket, chunk ID) -> MappedChunk
+        self.failed = {}  # Domain socket -> when it last failed
+        self.lock = threading.Lock()
+
+    def usable(self, datanode):
+        """Whether `datanode` offers short-circuit reads to this host and its socket has not failed lately."""
+        path = datanode.get("domain_socket")
+        if not path or not is_local(datanode["host"]):
+            return False
+        failed = self.failed.get(path)
+        return failed is None or time.monotonic() - failed > RETRY_DELAY
+
+    def get(self, datanode, chunk_id, trace=None):
+        """The MappedChunk of `chunk_id` from a local DataNode, requesting it if not mapped yet.
+
+        Raises OSError (or ValueError for a refused request); the socket is
+        then left alone for RETRY_DELAY if it could not be used at all.
+        """
+        key = (datanode["domain_socket"], chunk_id)
+        with self.lock:
+            chunk = self.chunks.get(key)
+            if chunk is not None:
+                self.chunks.move_to_end(key)
+                return chunk
+        chunk = self._request(datanode["domain_socket"], chunk_id, trace)
+        with self.lock:
+            self.chunks[key] = chunk
+            self.chunks.move_to_end(key)
+            while len(self.chunks) > self.capacity:
+                self.chunks.popitem(last=False)  # Unmapped when its last reader lets go
+        return chunk
+
+    def invalidate(self, datanode, chunk_id):
+        """Forget a mapping whose data turned out corrupt."""
+        with self.lock:
+            self.chunks.pop((datanode["domain_socket"], chunk_id), None)
+
+    def _request(self, path, chunk_id, trace):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.settimeout(CONNECT_TIMEOUT)
+                s.connect(path)
+                request = {"message_type": "request_fd", "chunk_id": chunk_id}
+                if trace:
+                    request["trace"] = trace
+                send_message(s, request)
+                header, fds = recv_fds_message(s, 1)
+        except OSError:
+            self.failed[path] = time.monotonic()
+            raise
+        try:
+            if header.get("status") != "ok" or len(fds) != 1:
+                raise ValueError(header.get("message", "No descriptor passed"))
+            return MappedChunk(fds[0], header)
+        finally:
+            for fd in fds:
+                os.close(fd)  # A mapping holds its own reference to the file
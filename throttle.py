@@ -0,0 +1,168 @@
+# throttle.py
+"""Bandwidth limits and admission control for chunk transfers.
+
+A TokenBucket paces the bytes a client or a DataNode moves to a set rate.
+A TransferScheduler caps the chunk streams a DataNode serves at once and
+queues the rest, taking them in PRIORITIES order and, within a priority,
+round-robin over tenants (users or client hosts), so one client with many
+streams cannot crowd out another with a single one. Bulk transfers may
+never take the last RESERVED_SHARE of the streams, which are kept for
+reads and re-replication.
+
+Requests that would wait past `queue_timeout`, or find `max_queued`
+others waiting already, are refused with Busy. A sender that asked for
+"admission" gets {"status": "busy", "retry_after"} before it has sent any
+data, so it can try again later (or another replica) on the same
+connection.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+PRIORITIES = ("interactive", "replication", "bulk")  # Transfer classes, served first to last
+MAX_STREAMS = 64  # Chunk streams a DataNode serves at once
+RESERVED_SHARE = 0.25  # Share of those streams bulk transfers may not take
+MAX_QUEUED = 256  # Requests waiting for a stream before new ones are refused
+QUEUE_TIMEOUT = 10  # Seconds a request waits for a stream before it is refused
+RETRY_AFTER = 1.0  # Seconds a refused sender is told to wait
+THROTTLE_STEP = 256 * 1024  # Bytes sent per step of a paced transfer
+MAX_DEFER = 0.05  # Seconds a paced step gives way to higher priorities before it goes anyway
+
+
+class Busy(Exception):
+    """No stream could be had in time; try again after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after=RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def priority_of(message, default):
+    """The transfer class a request asks for, or `default` if it names none (or an unknown one)."""
+    priority = message.get("priority")
+    return priority if priority in PRIORITIES else default
+
+
+class TokenBucket:
+    """Paces transfers to `rate` bytes/s, letting up to `burst` bytes through at once after a pause.
+
+    `consume(n, priority)` blocks until `n` bytes may be moved. While a
+    transfer of a higher priority is waiting, lower ones do not take
+    tokens, so bulk traffic yields the bandwidth to reads and
+    re-replication once the limit is reached; but for no longer than
+    MAX_DEFER per step, so they slow it down without ever stopping it.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate / 10, 4 * THROTTLE_STEP)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.cond = threading.Condition()
+        self.waiting = [0] * len(PRIORITIES)
+
+    def consume(self, n, priority="bulk"):
+        rank = PRIORITIES.index(priority)
+        need = min(n, self.burst)  # A step larger than a burst goes once the bucket is full, leaving a debt
+        deadline = time.monotonic() + MAX_DEFER
+        with self.cond:
+            self.waiting[rank] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if any(self.waiting[:rank]) and now < deadline:
+                        self.cond.wait(deadline - now)  # Or until a higher-priority transfer has taken its share
+                        continue
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= need:
+                        self.tokens -= n
+                        return
+                    self.cond.wait((need - self.tokens) / self.rate)
+            finally:
+                self.waiting[rank] -= 1
+                self.cond.notify_all()
+
+
+class _Waiter:
+    __slots__ = ("event", "admitted")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.admitted = False
+
+
+class TransferScheduler:
+    """Admission of chunk streams on a DataNode: a cap, priority classes and per-tenant fair queuing."""
+
+    def __init__(self, max_streams=MAX_STREAMS, reserved_share=RESERVED_SHARE, max_queued=MAX_QUEUED,
+                 queue_timeout=QUEUE_TIMEOUT):
+        self.max_streams = max_streams
+        self.bulk_streams = max(1, int(max_streams * (1 - reserved_share)))
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.lock = threading.Lock()
+        self.active = dict.fromkeys(PRIORITIES, 0)
+        self.queues = {priority: OrderedDict() for priority in PRIORITIES}  # Tenant -> deque of _Waiters
+        self.queued = 0
+
+    def admit(self, priority, tenant, wait=True):
+        """Take one stream, waiting in the queue for it if need be; hand it back with `release`.
+
+        Raises Busy if none is free within the queue timeout. With
+        wait=False the stream is taken even over the cap: for the later
+        legs of a write pipeline, already admitted at its head, which must
+        not wait on streams held by others waiting on them.
+        """
+        with self.lock:
+            if not wait or (self._free(priority) and not self._waiting(priority)):
+                self.active[priority] += 1
+                return
+            if self.queued >= self.max_queued:
+                raise Busy(f"{self.queued} transfers queued already")
+            waiter = _Waiter()
+            self.queues[priority].setdefault(tenant, deque()).append(waiter)
+            self.queued += 1
+        if waiter.event.wait(self.queue_timeout):
+            return
+        with self.lock:
+            if waiter.admitted:
+                return  # Let in just as the wait timed out
+            waiters = self.queues[priority][tenant]
+            waiters.remove(waiter)
+            if not waiters:
+                del self.queues[priority][tenant]
+            self.queued -= 1
+        raise Busy(f"No transfer stream free within {self.queue_timeout}s")
+
+    def release(self, priority):
+        with self.lock:
+            self.active[priority] -= 1
+            self._dispatch()
+
+    def _free(self, priority):
+        active = sum(self.active.values())
+        if priority == "bulk":
+            return active < self.max_streams and self.active["bulk"] < self.bulk_streams
+        return active < self.max_streams
+
+    def _waiting(self, priority):
+        """Whether requests of `priority` or higher are queued (a newcomer must not overtake them)."""
+        return any(self.queues[p] for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+
+    def _dispatch(self):
+        for priority in PRIORITIES:
+            tenants = self.queues[priority]
+            while tenants and self._free(priority):
+                tenant, waiters = next(iter(tenants.items()))
+                waiter = waiters.popleft()
+                if waiters:
+                    tenants.move_to_end(tenant)  # Next turn goes to the next tenant
+                else:
+                    del tenants[tenant]
+                self.queued -= 1
+                self.active[priority] += 1
+                waiter.admitted = True
+                waiter.event.set()
+            if tenants:
+                return  # Lower priorities wait until these have gone
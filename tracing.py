@@ -0,0 +1,135 @@
+# tracing.py
+"""Sampled tracing: spans that follow one operation from the client through the NameNode and DataNodes.
+
+A client starts a trace for a sampled share of its operations (e.g. one
+upload) and sends the context of the current span along with each request
+as message["trace"] = {"trace_id", "span_id"}. Servers record a child span
+for requests that carry one and pass their own on (a DataNode to the next
+in its pipeline), so the spans of all processes join into one tree by
+trace_id. Requests without a context cost nothing beyond the key lookup.
+
+Each process keeps its last TRACE_BUFFER finished spans in memory (served
+at /traces next to /metrics) and can append them as JSON lines to a file.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+TRACE_BUFFER = 1000  # Finished spans each process keeps for /traces
+
+
+class Span:
+    """One timed step of a trace. Use as a context manager, or call `end`."""
+
+    def __init__(self, tracer, name, trace_id, parent_id, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.ended = False
+
+    def context(self):
+        """What to send as message["trace"] so the receiver's span becomes a child of this one."""
+        return {"trace_id": self.trace_id, "span_id": self.span_id}
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        if self.ended:
+            return
+        self.ended = True
+        record = {"trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                  "service": self.tracer.service, "name": self.name, "start": self.start,
+                  "duration_ms": (time.perf_counter() - self.started) * 1000}
+        if self.attributes:
+            record["attributes"] = self.attributes
+        if error is not None:
+            record["error"] = f"{type(error).__name__}: {error}"
+        self.tracer.record(record)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(exc)
+
+
+class _NoSpan:
+    """Stands in for a span of an operation that is not being traced."""
+
+    def context(self):
+        return None
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def __bool__(self):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class Tracer:
+    """Creates and records the spans of one process (`service`: "client", "namenode", "datanode:<port>")."""
+
+    def __init__(self, service, sample_rate=0.0, path=None, capacity=TRACE_BUFFER):
+        self.service = service
+        self.sample_rate = sample_rate
+        self.path = path
+        self.spans = deque(maxlen=capacity)
+        self.lock = threading.Lock()
+
+    def configure(self, service=None, sample_rate=None, path=None):
+        if service is not None:
+            self.service = service
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if path is not None:
+            self.path = path
+
+    def trace(self, name, **attributes):
+        """Start a new trace with probability sample_rate; otherwise return NO_SPAN."""
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return NO_SPAN
+        return Span(self, name, uuid.uuid4().hex, None, attributes)
+
+    def span(self, name, parent, **attributes):
+        """Start a child of `parent` (a Span, or a context received in a message) if it is traced."""
+        if not parent:
+            return NO_SPAN
+        if isinstance(parent, Span):
+            parent = parent.context()
+        try:
+            return Span(self, name, str(parent["trace_id"]), str(parent["span_id"]), attributes)
+        except (KeyError, TypeError):
+            return NO_SPAN  # Not a context we understand: do not fail the request over it
+
+    def record(self, record):
+        line = json.dumps(record) + "\n" if self.path else None
+        with self.lock:
+            self.spans.append(record)
+            if line is not None:
+                with open(self.path, "a") as f:
+                    f.write(line)
+
+    def recent(self):
+        with self.lock:
+            return list(self.spans)
@@ -0,0 +1,1183 @@
+# transfer.py
+"""Headless transfer engines used by the client (no Tkinter dependency)."""
+import itertools
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, FIRST_EXCEPTION, as_completed, wait
+from checksum import ALGORITHMS, ChecksumError, StreamingChecksum, StreamingVerifier
+from compression import (COMPRESSION_FRAME, CompressionError, choose_codec, codec, compress_frame, decompress_frame,
+                         frame_span, sample_ratio)
+from dedup import CDC_MAX_SIZE, fingerprint, split
+from erasure import EC_CELL_SIZE, ErasureError, encode, parse_policy, reconstruct
+from locations import Locations, chunk_offsets, chunk_span
+from protocol import default_pool, recv_exact, recv_message, send_message
+from throttle import RETRY_AFTER
+from tracing import Tracer
+
+NAMENODE_HOST = '192.168.164.58'  # or the IP of the NameNode
+NAMENODE_PORT = 5000
+CHUNK_SIZE = 64 * 1024 * 1024  # 64 MB
+BUFFER_SIZE = 1024 * 1024  # Bytes read from disk and sent per step
+MAX_WORKERS = 4  # Chunks streamed in parallel
+MEMORY_BUDGET = 64 * 1024 * 1024  # Upper bound on transfer buffers held at once
+MAX_PARALLEL_FILES = 16  # Files of a folder upload in progress at once
+LEASE_RENEW_INTERVAL = 20  # Seconds between renewals of the write leases of files being uploaded
+DATANODE_TIMEOUT = 20
+HEDGE_MIN_DELAY = 0.05  # Never hedge a chunk read sooner than this (seconds)
+HEDGE_MULTIPLIER = 2.0  # Hedge once a read takes this many times its expected duration
+CACHED_REPLICA_WEIGHT = 0.25  # Expected-duration factor for replicas the NameNode says are in a read cache
+BUSY_RETRIES = 10  # Times a chunk transfer refused by busy DataNodes is tried again
+RELOCATED_FILES = 256  # Files whose latest relocate() result a DownloadEngine keeps for concurrent readers
+
+log = logging.getLogger("dfs")
+tracer = Tracer("client")  # Traces no uploads until given a sample rate (dfs --trace-sample)
+
+
+class TransferError(Exception):
+    """Raised when a transfer cannot be completed."""
+
+
+class DataNodeBusy(TransferError):
+    """A DataNode had no transfer stream free; worth trying again after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after=RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def namenode_request(message, host=None, port=None, timeout=10):
+    """Send one request to the NameNode over the shared keep-alive connection."""
+    return default_pool.call(host or NAMENODE_HOST, port or NAMENODE_PORT, message, timeout)
+
+
+class WriteSession:
+    """A write lease on one file: allocates its chunks in batches and commits acknowledged ones.
+
+    Chunks committed with `commit` are reported to the NameNode with the
+    next allocation request, or with `complete`. Until `complete` the file
+    does not exist in the namespace; `abandon` (or letting the lease expire)
+    discards it along with any chunks already written.
+
+    For an erasure-coded file (`ec`, an ECPolicy) `allocate(count)`
+    allocates `count` stripes: data + parity allocations per stripe. A
+    deduplicated file (`dedup`) declares its chunks with `declare` instead.
+    A file pinned to a storage `tier` is placed on DataNodes with volumes of
+    that tier. If the write is traced (`span`), every request carries its
+    context.
+    """
+
+    def __init__(self, request, name, chunk_size, holder, ec=None, dedup=False, span=None, tier=None):
+        self.trace = span.context() if span else None
+        if self.trace is not None:
+            request = lambda message, request=request: request(dict(message, trace=self.trace))
+        self.request = request
+        self.name = name
+        self.width = ec.data + ec.parity if ec is not None else 1
+        self.lock = threading.Lock()
+        self.committed = []  # Acknowledged chunks not reported yet
+        self.size = 0
+        message = {"action": "create", "path": name, "chunk_size": chunk_size, "holder": holder}
+        if ec is not None:
+            message["ec"] = ec.name
+        if dedup:
+            message["dedup"] = True
+        if tier is not None:
+            message["tier"] = tier
+        response = request(message)
+        if not response or response.get("status") != "ok":
+            raise TransferError((response or {}).get("message", f"Could not create {name}"))
+        self.lease_id = response["lease_id"]
+
+    def allocate(self, count):
+        """Return allocations ({chunk_id, datanodes}) for the next `count` chunks."""
+        with self.lock:
+            committed, self.committed = self.committed, []
+        response = self.request({"action": "add_block", "lease_id": self.lease_id, "count": count,
+                                 "committed": committed})
+        if not response or response.get("status") != "ok":
+            raise TransferError((response or {}).get("message", "Chunk allocation failed"))
+        allocations = response.get("chunk_allocations", [])
+        if not allocations or len(allocations) > count * self.width or len(allocations) % self.width:
+            raise TransferError("Invalid chunk allocation from NameNode")
+        return allocations
+
+    def declare(self, chunks):
+        """Return allocations for the next chunks of a deduplicated file, given as (fingerprint, size).
+
+        Chunks the cluster already holds come back with "duplicate" set;
+        they need not be sent and count towards the file's size at once.
+        """
+        with self.lock:
+            committed, self.committed = self.committed, []
+        response = self.request({"action": "add_chunks", "lease_id": self.lease_id, "committed": committed,
+                                 "chunks": [{"fingerprint": digest, "size": size} for digest, size in chunks]})
+        if not response or response.get("status") != "ok":
+            raise TransferError((response or {}).get("message", "Chunk allocation failed"))
+        allocations = response.get("chunk_allocations", [])
+        if len(allocations) != len(chunks):
+            raise TransferError("Invalid chunk allocation from NameNode")
+        with self.lock:
+            self.size += sum(size for (_, size), allocation in zip(chunks, allocations) if allocation.get("duplicate"))
+        return allocations
+
+    def commit(self, chunk_id, size, parity=False, compression=None):
+        """Report a stored chunk; parity cells do not count towards the file's size.
+
+        A compressed chunk is reported with its uncompressed `size` and its
+        `compression` metadata (see UploadEngine._upload_compressed).
+        """
+        with self.lock:
+            entry = {"chunk_id": chunk_id, "size": size}
+            if compression is not None:
+                entry["compression"] = compression
+            self.committed.append(entry)
+            if not parity:
+                self.size += size
+
+    def complete(self):
+        with self.lock:
+            committed, self.committed = self.committed, []
+        response = self.request({"action": "complete", "lease_id": self.lease_id, "committed": committed,
+                                 "size": self.size})
+        if not response or response.get("status") != "ok":
+            raise TransferError((response or {}).get("message", "Failed to confirm upload with NameNode"))
+        return self.size
+
+    def abandon(self):
+        try:
+            self.request({"action": "abandon", "lease_id": self.lease_id})
+        except Exception as e:
+            print(f"[ERROR] Could not abandon the write of {self.name}: {e}")
+
+
+class UploadEngine:
+    """Uploads a file as several chunk streams in parallel.
+
+    Each file is written under a lease (see WriteSession): chunks are
+    allocated `allocation_batch` at a time as the upload progresses, and
+    each chunk is committed once its replica pipeline acknowledged it. While
+    files are being written a background thread renews their leases.
+
+    Each chunk is read from disk in BUFFER_SIZE steps with os.preadv, so memory
+    use is bounded by one buffer per in-flight stream; the number of streams
+    is capped by both `max_workers` and `memory_budget // buffer_size`.
+    `upload_stream` uploads data of unknown size (a pipe, stdin) and holds
+    whole chunks in memory instead, as many as fit in `memory_budget`.
+
+    With `pipeline=True` the chunk is sent once, to the first DataNode of its
+    allocation, which forwards it down the rest of the replica pipeline while
+    writing it (HDFS-style). Replicas the pipeline reports as failed are then
+    pushed directly. With `pipeline=False` the client pushes every replica
+    itself, one after another.
+
+    The chunk is checksummed while it is sent and compared with the
+    checksums the DataNode computed from what it received, so corruption in
+    transit fails the upload instead of being stored.
+
+    `upload_folder` uploads a directory tree with many files in flight at
+    once; their chunks share the same bounded set of streams.
+
+    With an erasure coding policy (`ec`, e.g. "RS-6-3") files are written
+    as stripes instead: each run of `data` chunks (cells, at most
+    EC_CELL_SIZE bytes) is read into memory and encoded, and its data and
+    parity cells go to different DataNodes, one copy each. As many stripes
+    as fit in `memory_budget` (at least one) are in flight.
+
+    With `compression` ("auto" or a codec name from compression.CODECS)
+    each chunk of a replicated file is sampled first; chunks that compress
+    are split into COMPRESSION_FRAME frames, compressed by a pool of
+    `compress_workers` processes and stored compressed, whole chunks held in
+    memory as for `upload_stream`. Incompressible chunks are sent as they are.
+
+    With `dedup=True` replicated files are cut into content-defined chunks
+    (dedup.split, up to CDC_MAX_SIZE bytes) instead, declared to the
+    NameNode by fingerprint, and only chunks the cluster does not hold yet
+    are sent. Deduplicated files are not compressed.
+
+    With a storage `tier` (e.g. "SSD") files are pinned to it: the NameNode
+    places their chunks on DataNodes with volumes of that tier, and each
+    DataNode stores them on one.
+
+    Chunks are sent as "bulk" transfers of `tenant` (the DataNodes' fair
+    queuing key; their address if None), each only once the DataNode has
+    admitted it; a busy DataNode is asked again up to BUSY_RETRIES times.
+    With a `throttle` (a throttle.TokenBucket, which may be shared with
+    downloads) the bytes sent are paced to its rate.
+    """
+
+    def __init__(self, request=namenode_request, max_workers=MAX_WORKERS, memory_budget=MEMORY_BUDGET,
+                 buffer_size=BUFFER_SIZE, chunk_size=CHUNK_SIZE, pipeline=True, progress=None, allocation_batch=None,
+                 ec=None, compression=None, compress_workers=None, dedup=False, tier=None, throttle=None,
+                 tenant=None):
+        self.request = request
+        self.tier = tier
+        self.throttle = throttle
+        self.tenant = tenant
+        self.buffer_size = buffer_size
+        self.ec = parse_policy(ec) if ec else None
+        self.dedup = dedup and self.ec is None
+        self.chunk_size = min(chunk_size, EC_CELL_SIZE) if self.ec else CDC_MAX_SIZE if self.dedup else chunk_size
+        if compression not in (None, "auto"):
+            codec(compression)  # Fail now on codecs that are not installed
+        self.compression = compression if self.ec is None and not self.dedup else None
+        self.compress_workers = compress_workers or os.cpu_count() or 1
+        self.compress_pool = None  # Started with the first compressed chunk, stopped when the last file is written
+        self.memory_budget = memory_budget
+        self.streams = max(1, min(max_workers, memory_budget // buffer_size))
+        self.allocation_batch = allocation_batch or self.streams
+        self.pipeline = pipeline
+        self.progress = progress  # progress(bytes_sent, total_bytes), called from worker threads
+        self.progress_lock = threading.Lock()
+        self.bytes_sent = 0
+        self.total_bytes = 0
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"  # Lease holder name
+        self.lease_lock = threading.Lock()
+        self.open_sessions = 0
+        self.renewer_stop = None
+
+    def upload(self, path, name=None):
+        """Upload `path` as `name` (a path in the DFS) and confirm it with the NameNode."""
+        name = name or os.path.basename(path)
+        self.bytes_sent = 0
+        self.total_bytes = os.path.getsize(path)
+        with ThreadPoolExecutor(max_workers=self.streams) as chunk_pool:
+            return self._upload_file(chunk_pool, path, name)
+
+    def upload_stream(self, stream, name):
+        """Upload everything read from a binary file object (a pipe, stdin, ...) as `name`.
+
+        Returns (name, size). Chunks are read whole before they are sent, so
+        at most max(1, memory_budget // chunk_size) of them are in flight.
+        """
+        def chunks():
+            while True:
+                data = read_chunk(stream, self.chunk_size)
+                if not data:
+                    return
+                yield data
+        return self.upload_chunks(chunks(), name)
+
+    def upload_chunks(self, chunks, name):
+        """Upload the bytes-like objects yielded by `chunks` as the consecutive chunks of `name`.
+
+        Every chunk but the last must be exactly `chunk_size` bytes. The
+        iterator is only advanced while fewer than max(1, memory_budget //
+        chunk_size) chunks are in flight. Returns (name, size).
+        """
+        self.bytes_sent = 0
+        self.total_bytes = 0
+        in_flight = max(1, min(self.streams, self.memory_budget // self.chunk_size))
+
+        def numbered():
+            for index, data in enumerate(chunks):
+                data = memoryview(data)
+                yield index, len(data), lambda view, position, data=data: data[position:position + len(view)]
+
+        with ThreadPoolExecutor(max_workers=in_flight) as chunk_pool:
+            return self._write_file(chunk_pool, name, numbered(), None, in_flight)
+
+    def upload_folder(self, path, name=None, max_files=MAX_PARALLEL_FILES):
+        """Upload the directory tree at `path` under the DFS directory `name`.
+
+        Returns the list of (DFS path, size) uploaded. Files that fail do not
+        stop the others; a TransferError naming them is raised at the end.
+        """
+        name = (name or "/" + os.path.basename(os.path.abspath(path))).rstrip("/")
+        files = []
+        empty_dirs = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            relative = os.path.relpath(dirpath, path)
+            remote_dir = name if relative == "." else name + "/" + relative.replace(os.sep, "/")
+            if not dirnames and not filenames:
+                empty_dirs.append(remote_dir)  # Directories with files are created with them
+            for filename in filenames:
+                local = os.path.join(dirpath, filename)
+                if os.path.isfile(local):
+                    files.append((local, f"{remote_dir}/{filename}"))
+
+        self.bytes_sent = 0
+        self.total_bytes = sum(os.path.getsize(local) for local, _ in files)
+        uploaded = []
+        failures = []
+        with ThreadPoolExecutor(max_workers=self.streams) as chunk_pool, \
+                ThreadPoolExecutor(max_workers=max_files) as file_pool:
+            futures = {file_pool.submit(self._upload_file, chunk_pool, local, remote): remote
+                       for local, remote in files}
+            futures.update({file_pool.submit(self._mkdir, remote): remote for remote in empty_dirs})
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                    if result:
+                        uploaded.append(result)
+                except (OSError, TransferError) as e:
+                    print(f"[ERROR] Failed to upload {futures[future]}: {e}")
+                    failures.append(futures[future])
+        if failures:
+            raise TransferError(f"{len(failures)} of {len(futures)} entries failed to upload, "
+                                f"first: {sorted(failures)[0]}")
+        return uploaded
+
+    def _mkdir(self, name):
+        response = self.request({"action": "mkdir", "path": name})
+        if not response or response.get("status") != "ok":
+            raise TransferError((response or {}).get("message", "mkdir failed"))
+
+    def _upload_file(self, chunk_pool, path, name):
+        file_size = os.path.getsize(path)
+        num_chunks = -(-file_size // self.chunk_size)
+
+        fd = os.open(path, os.O_RDONLY)
+
+        def read(view, position, offset):
+            return view[:os.preadv(fd, [view], offset + position)]
+
+        chunks = ((i, min(self.chunk_size, file_size - i * self.chunk_size),
+                   lambda view, position, offset=i * self.chunk_size: read(view, position, offset))
+                  for i in range(num_chunks))
+        try:
+            name, size = self._write_file(chunk_pool, name, chunks, num_chunks, self.streams)
+        finally:
+            os.close(fd)  # _write_file returns only once no chunk is still reading fd
+        if size != file_size:
+            raise TransferError(f"Uploaded {size} of {file_size} bytes of {path}")
+        return name, size
+
+    def _write_file(self, chunk_pool, name, chunks, num_chunks, max_in_flight):
+        """Write `chunks` under a new lease and complete the file. Returns (name, size).
+
+        `chunks` yields (index, length, read) for each chunk in order, where
+        read(view, position) returns the chunk's bytes from `position` on (up
+        to len(view) of them). It is only advanced while fewer than
+        `max_in_flight` chunks are being sent. `num_chunks` (None if unknown)
+        caps the size of the last allocation batch.
+        """
+        with tracer.trace("client.put", path=name) as span:
+            session = self._open_session(name, span)
+            pending = {}  # future -> arguments of session.commit() once it succeeds
+            try:
+                if self.ec is not None:
+                    self._write_stripes(chunk_pool, session, chunks, num_chunks, pending)
+                elif self.dedup:
+                    self._write_dedup(chunk_pool, session, chunks, pending)
+                else:
+                    self._write_chunks(chunk_pool, session, chunks, num_chunks, max_in_flight, pending)
+                while pending:
+                    self._collect(session, pending)
+                session.complete()
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                wait(pending)  # Cancelled or not, none may still be reading the source
+                session.abandon()
+                raise
+            finally:
+                self._close_session()
+            span.set(size=session.size)
+        return name, session.size
+
+    def _write_chunks(self, chunk_pool, session, chunks, num_chunks, max_in_flight, pending):
+        upload = self._upload_chunk
+        if self.compression is not None:
+            upload = self._upload_compressed
+            max_in_flight = max(1, min(max_in_flight, self.memory_budget // self.chunk_size))
+        allocations = []
+        for index, length, read in chunks:
+            if not allocations:
+                count = self.allocation_batch
+                if num_chunks is not None:
+                    count = min(count, num_chunks - index)
+                allocations = session.allocate(count)
+            allocation = allocations.pop(0)
+            future = chunk_pool.submit(upload, read, index, length, allocation, session.name, trace=session.trace)
+            pending[future] = (allocation["chunk_id"], length)
+            while len(pending) >= max_in_flight:
+                self._collect(session, pending)
+
+    def _write_stripes(self, chunk_pool, session, chunks, num_chunks, pending):
+        """Encode and upload `chunks` a stripe at a time; a stripe's cells are allocated together."""
+        k = self.ec.data
+        width = k + self.ec.parity
+        stripes_in_flight = max(1, self.memory_budget // (width * self.chunk_size))
+        allocations = []
+        chunks = iter(chunks)
+        while True:
+            stripe = list(itertools.islice(chunks, k))
+            if not stripe:
+                return
+            while len(pending) > (stripes_in_flight - 1) * width:
+                self._collect(session, pending)
+            cells = [load_chunk(read, length) for _, length, read in stripe]
+            parity = encode(self.ec, cells)
+            if not allocations:
+                count = self.allocation_batch
+                if num_chunks is not None:
+                    count = min(count, -(-(num_chunks - stripe[0][0]) // k))
+                allocations = session.allocate(count)
+            group, allocations = allocations[:width], allocations[width:]
+            first = stripe[0][0] // k * width
+            # Data cells past the end of the file (in the last stripe) are left unwritten
+            for j, cell in itertools.chain(enumerate(cells), enumerate(parity, k)):
+                read = lambda view, position, cell=memoryview(cell): cell[position:position + len(view)]
+                future = chunk_pool.submit(self._upload_chunk, read, first + j, len(cell), group[j], session.name,
+                                           report=j < k, trace=session.trace)
+                pending[future] = (group[j]["chunk_id"], len(cell), j >= k)
+
+    def _write_dedup(self, chunk_pool, session, chunks, pending):
+        """Re-cut `chunks` at content-defined boundaries and upload the new ones.
+
+        Chunks are fingerprinted and declared a batch at a time; a batch is
+        read while the previous one uploads, so about two batches of
+        memory_budget // (2 * chunk_size) chunks are held at once.
+        """
+        batch_size = max(1, self.memory_budget // self.chunk_size // 2)
+        pieces = split(load_chunk(read, length) for _, length, read in chunks)
+        index = 0
+        while True:
+            batch = list(itertools.islice(pieces, batch_size))
+            if not batch:
+                return
+            allocations = session.declare([(fingerprint(data), len(data)) for data in batch])
+            for data, allocation in zip(batch, allocations):
+                if allocation.get("duplicate"):
+                    self._report(len(data))
+                else:
+                    read = lambda view, position, data=data: data[position:position + len(view)]
+                    future = chunk_pool.submit(self._upload_chunk, read, index, len(data), allocation, session.name,
+                                               trace=session.trace)
+                    pending[future] = (allocation["chunk_id"], len(data))
+                index += 1
+            while len(pending) > batch_size:
+                self._collect(session, pending)
+
+    def _collect(self, session, pending):
+        """Wait for at least one chunk upload; commit the ones that succeeded, re-raise a failure."""
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            commit = pending.pop(future)
+            session.commit(*commit, compression=future.result())
+
+    def _open_session(self, name, span=None):
+        session = WriteSession(self.request, name, self.chunk_size, self.holder, self.ec, self.dedup, span,
+                               self.tier)
+        with self.lease_lock:
+            self.open_sessions += 1
+            if self.open_sessions == 1:
+                self.renewer_stop = threading.Event()
+                threading.Thread(target=self._renew_leases, args=(self.renewer_stop,), daemon=True).start()
+        return session
+
+    def _close_session(self):
+        with self.lease_lock:
+            self.open_sessions -= 1
+            if self.open_sessions == 0:
+                self.renewer_stop.set()
+                if self.compress_pool is not None:
+                    self.compress_pool.shutdown(wait=False)
+                    self.compress_pool = None
+
+    def _renew_leases(self, stop):
+        while not stop.wait(LEASE_RENEW_INTERVAL):
+            try:
+                self.request({"action": "renew_lease", "holder": self.holder})
+            except Exception as e:
+                print(f"[ERROR] Could not renew write leases: {e}")
+
+    def _upload_chunk(self, read, index, length, allocation, name, report=True, trace=None):
+        """Store one chunk on all DataNodes of its allocation, reporting its bytes as progress if `report`."""
+        datanodes = allocation["datanodes"]
+        buf = bytearray(self.buffer_size)
+
+        if self.pipeline:
+            failed = self._send_chunk(read, length, allocation["chunk_id"], name, index,
+                                      datanodes[0], datanodes[1:], buf, report=report, trace=trace)
+        else:
+            failed = datanodes
+        for i, datanode in enumerate(failed):
+            # Direct pushes of replicas the pipeline missed (or all of them when not pipelining)
+            self._send_chunk(read, length, allocation["chunk_id"], name, index, datanode, [], buf,
+                             report and not self.pipeline and i == 0, trace)
+
+    def _upload_compressed(self, read, index, length, allocation, name, trace=None):
+        """Store one chunk compressed if a sample of it compresses. Returns its compression metadata or None.
+
+        Frames are compressed independently, so a reader can decompress just
+        the frames covering the range it wants; each frame ends at the
+        offset in the stored chunk listed in the metadata's "ends".
+        """
+        choice = choose_codec(sample_ratio(read, length), self.compression)
+        if choice is None:
+            self._upload_chunk(read, index, length, allocation, name, trace=trace)
+            return None
+        with self.lease_lock:
+            if self.compress_pool is None:
+                self.compress_pool = ProcessPoolExecutor(max_workers=self.compress_workers)
+            pool = self.compress_pool
+        data = load_chunk(read, length)
+        view = memoryview(data)
+        frames = list(pool.map(compress_frame, itertools.repeat(choice[0]), itertools.repeat(choice[1]),
+                               (bytes(view[i:i + COMPRESSION_FRAME]) for i in range(0, length, COMPRESSION_FRAME))))
+        stored = memoryview(b"".join(frames))
+        if len(stored) == length:
+            # No frame got smaller
+            self._upload_chunk(lambda buf, position: view[position:position + len(buf)], index, length, allocation,
+                               name, trace=trace)
+            return None
+        self._upload_chunk(lambda buf, position: stored[position:position + len(buf)], index, len(stored),
+                           allocation, name, report=False, trace=trace)
+        self._report(length)
+        return {"codec": choice[0], "frame_size": COMPRESSION_FRAME,
+                "ends": list(itertools.accumulate(map(len, frames)))}
+
+    def _send_chunk(self, read, length, chunk_id, name, index, datanode, pipeline, buf, report, trace=None):
+        """Stream one chunk to `datanode` and return the pipeline targets that did not store it."""
+        with tracer.span("client.send_chunk", trace, chunk_id=chunk_id, datanode=datanode_key(datanode),
+                         bytes=length) as span:
+            return self._stream_chunk(read, length, chunk_id, name, index, datanode, pipeline, buf, report,
+                                      span.context())
+
+    def _stream_chunk(self, read, length, chunk_id, name, index, datanode, pipeline, buf, report, trace):
+        message = {
+            "message_type": "file_chunk",
+            "chunk_id": chunk_id,
+            "filename": name,
+            "chunk_index": index,
+            "chunk_size": length,
+            "pipeline": pipeline
+        }
+        if trace is not None:
+            message["trace"] = trace
+        if self.tier is not None:
+            message["tier"] = self.tier
+        if self.tenant is not None:
+            message["tenant"] = self.tenant
+        message["admission"] = True
+        for attempt in itertools.count(1):
+            try:
+                with default_pool.connection(datanode["host"], datanode["port"], DATANODE_TIMEOUT) as s:
+                    send_message(s, message)
+                    resp = recv_message(s)
+                    if resp is None:
+                        raise ConnectionError("DataNode closed the connection")
+                    if resp.get("status") == "ok":
+                        # Admitted: send the chunk
+                        view = memoryview(buf)
+                        checksum = StreamingChecksum()
+                        sent = 0
+                        while sent < length:
+                            data = read(view[:min(self.buffer_size, length - sent)], sent)
+                            if not data:
+                                raise TransferError(f"File shrank while uploading chunk {index}")
+                            if self.throttle is not None:
+                                self.throttle.consume(len(data), "bulk")
+                            s.sendall(data)
+                            checksum.update(data)
+                            sent += len(data)
+                            if report:
+                                self._report(len(data))
+                        resp = recv_message(s)
+                        if resp is None:
+                            raise ConnectionError("DataNode closed the connection")
+            except (OSError, ValueError) as e:
+                raise TransferError(f"Chunk {index} upload failed to DataNode {datanode_key(datanode)}: {e}")
+            if resp.get("status") != "busy" or attempt > BUSY_RETRIES:
+                break
+            log.debug("DataNode %s is busy; retrying chunk %d", datanode_key(datanode), index)
+            time.sleep(resp.get("retry_after", RETRY_AFTER))
+        if resp.get("status") != "success":
+            raise TransferError(f"Chunk {index} upload failed to DataNode {datanode['host']}:{datanode['port']}: {resp}")
+        if resp.get("checksums") not in (None, checksum.finish()):
+            raise TransferError(f"Chunk {index} was corrupted in transit to DataNode {datanode['host']}:{datanode['port']}")
+        return resp.get("failed", [])
+
+    def _report(self, n):
+        if self.progress is None:
+            return
+        with self.progress_lock:
+            self.bytes_sent += n
+            sent = self.bytes_sent
+        self.progress(sent, self.total_bytes)
+
+
+def read_chunk(stream, size):
+    """Read up to `size` bytes from a binary file object, stopping early only at end of file."""
+    buf = bytearray(size)
+    view = memoryview(buf)
+    filled = 0
+    while filled < size:
+        n = stream.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+    return view[:filled]
+
+
+def load_chunk(read, length):
+    """Read a whole chunk into a new bytearray with read(view, position) (see UploadEngine._write_file)."""
+    buf = bytearray(length)
+    view = memoryview(buf)
+    filled = 0
+    while filled < length:
+        data = read(view[filled:], filled)
+        if not len(data):
+            raise TransferError("File shrank while it was being uploaded")
+        view[filled:filled + len(data)] = data
+        filled += len(data)
+    return buf
+
+
+def datanode_key(datanode):
+    return f"{datanode['host']}:{datanode['port']}"
+
+
+class ReplicaSelector:
+    """Ranks replicas by observed latency, throughput and current load.
+
+    Keeps an exponentially weighted moving average of time-to-first-byte and
+    throughput per DataNode and counts this client's in-flight reads to each.
+    Failures are penalized so a dead node drops to the back of the ranking
+    until it proves itself again. Replicas marked "cached" (in their
+    DataNode's read cache) count as CACHED_REPLICA_WEIGHT times as slow, so
+    they win unless clearly overloaded.
+    """
+
+    def __init__(self, alpha=0.3, default_latency=0.01, default_throughput=100e6):
+        self.alpha = alpha
+        self.default_latency = default_latency
+        self.default_throughput = default_throughput
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.throughput = {}
+        self.inflight = {}
+
+    def expected_duration(self, datanode, length):
+        key = datanode_key(datanode)
+        with self.lock:
+            return (self.latency.get(key, self.default_latency)
+                    + length / self.throughput.get(key, self.default_throughput))
+
+    def rank(self, datanodes, length):
+        """Return `datanodes` ordered best-first for a read of `length` bytes."""
+        def score(datanode):
+            inflight = self.inflight.get(datanode_key(datanode), 0)
+            weight = CACHED_REPLICA_WEIGHT if datanode.get("cached") else 1
+            return self.expected_duration(datanode, length) * (1 + inflight) * weight
+        return sorted(datanodes, key=score)
+
+    def begin(self, datanode):
+        key = datanode_key(datanode)
+        with self.lock:
+            self.inflight[key] = self.inflight.get(key, 0) + 1
+
+    def end(self, datanode, latency=None, nbytes=0, elapsed=None, failed=False):
+        key = datanode_key(datanode)
+        with self.lock:
+            self.inflight[key] = max(0, self.inflight.get(key, 0) - 1)
+            if failed:
+                self.latency[key] = self.latency.get(key, self.default_latency) * 4 + 1.0
+                return
+            if latency is not None:
+                self._update(self.latency, key, latency, self.default_latency)
+            if elapsed and nbytes:
+                self._update(self.throughput, key, nbytes / elapsed, self.default_throughput)
+
+    def _update(self, table, key, sample, default):
+        table[key] = (1 - self.alpha) * table.get(key, default) + self.alpha * sample
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _FileChanged(TransferError):
+    """The file being read was replaced; carries its new Locations."""
+
+    def __init__(self, name, locations):
+        super().__init__(f"{name} changed while it was being read")
+        self.locations = locations
+
+
+class _ChunkRead:
+    """Shared state of the (possibly hedged) reads of one chunk."""
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.sockets = set()
+
+    def attach(self, sock):
+        with self.lock:
+            if self.cancelled.is_set():
+                raise _Cancelled()
+            self.sockets.add(sock)
+
+    def detach(self, sock):
+        """Stop tracking a socket before it goes back to the connection pool."""
+        with self.lock:
+            self.sockets.discard(sock)
+
+    def cancel(self):
+        """Stop every losing read, including ones blocked waiting for a slow replica."""
+        with self.lock:
+            self.cancelled.set()
+            for s in self.sockets:
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class DownloadEngine:
+    """Downloads a file's chunks concurrently, writing each at its own offset.
+
+    The output file is preallocated and every chunk is written with os.pwrite
+    as it arrives, so chunks complete in any order. Each chunk is read from
+    the replica the ReplicaSelector ranks best; if that read runs past
+    HEDGE_MULTIPLIER times its expected duration, a hedged read is started on
+    the next replica and whichever finishes first wins. Failed reads fall
+    back to the remaining replicas.
+
+    With `verify=True` every read is checked against the checksums the
+    DataNode stores for the chunk as it streams in; a corrupt replica is
+    reported to the NameNode and the chunk is read from another one.
+
+    With a LocationCache, files are located from the cache when possible.
+    A chunk that no listed replica can serve is retried once with fresh
+    locations if the NameNode's generation has moved on since they were
+    fetched (see `relocate`).
+
+    Erasure-coded files are read like any other; their data cells are the
+    chunks, each with one replica. A range of a cell that cannot be read is
+    rebuilt from the same range of `data` other cells of its stripe.
+
+    A replica on this host whose DataNode offers short-circuit reads is
+    read through a mapping of its file from `short_circuit` (a
+    ShortCircuitCache; None reads every replica over TCP), falling back to
+    the usual reads if that fails.
+
+    Reads are "interactive" transfers of `tenant`, which DataNodes admit
+    ahead of bulk writes. A replica whose DataNode is busy counts as
+    failed; if every replica is, the chunk is tried again after the delay
+    they ask for, up to BUSY_RETRIES times. With a `throttle` (a
+    throttle.TokenBucket) the bytes received over TCP are paced to its rate.
+    """
+
+    def __init__(self, request=namenode_request, max_workers=MAX_WORKERS, buffer_size=BUFFER_SIZE,
+                 hedge=True, selector=None, progress=None, verify=True, cache=None, short_circuit=None, throttle=None,
+                 tenant=None):
+        self.request = request
+        self.throttle = throttle
+        self.tenant = tenant
+        self.cache = cache
+        self.short_circuit = short_circuit
+        self.relocate_lock = threading.Lock()
+        self.relocated = OrderedDict()  # Path -> (stale generation, Locations fetched by relocate()), LRU first
+        self.verify = verify
+        self.max_workers = max_workers
+        self.buffer_size = buffer_size
+        self.hedge = hedge
+        self.selector = selector or ReplicaSelector()
+        self.progress = progress  # progress(bytes_received, total_bytes), called from worker threads
+        self.progress_lock = threading.Lock()
+        self.bytes_received = 0
+        self.total_bytes = 0
+
+    def locate(self, name):
+        """Return the Locations of `name`: its size, chunk size, generation and chunks, each a
+        {chunk_id, datanodes} dict. Served from the cache if it holds a live entry."""
+        if self.cache is not None:
+            locations = self.cache.get(name)
+            if locations is not None:
+                return locations
+        response = self.request({"action": "download", "name": name})
+        if not response or response.get("status") != "ok":
+            raise TransferError((response or {}).get("message", "File not found"))
+        chunks = response.get("chunks", [])
+        file_size = response["size"]
+        chunk_size = response.get("chunk_size", CHUNK_SIZE)
+        lengths = response.get("lengths")
+        offsets = chunk_offsets(lengths) if lengths is not None else None
+        if offsets is not None and (len(chunks) != len(lengths) or offsets[-1] != file_size):
+            raise TransferError("Chunk lengths do not match the file")
+        if offsets is None and len(chunks) != -(-file_size // chunk_size):
+            raise TransferError("No chunk information available")
+        try:
+            ec = parse_policy(response["ec"]) if response.get("ec") else None
+        except ErasureError as e:
+            raise TransferError(str(e))
+        locations = Locations(file_size, chunk_size, chunks, response.get("generation"), ec, response.get("parity"),
+                              offsets)
+        if self.cache is not None:
+            self.cache.put(name, locations)
+        return locations
+
+    def relocate(self, name, stale):
+        """Fetch fresh locations of `name` after a read using `stale` ones failed.
+
+        Returns the new Locations, or None if the NameNode's generation is
+        still that of `stale` (nothing has changed, so retrying is futile).
+        Concurrent callers holding the same stale locations share one
+        NameNode request. Raises _FileChanged if the file now has a
+        different size or chunk layout, i.e. it was replaced.
+        """
+        if stale.generation is None:
+            return None  # A NameNode that does not report generations
+        with self.relocate_lock:
+            generation, fresh = self.relocated.get(name, (None, None))
+            if fresh is None or generation != stale.generation:
+                if self.cache is not None:
+                    self.cache.invalidate(name)
+                fresh = self.locate(name)
+                self.relocated[name] = (stale.generation, fresh)  # Replacing any for an older generation
+                while len(self.relocated) > RELOCATED_FILES:
+                    self.relocated.popitem(last=False)
+            self.relocated.move_to_end(name)
+        if fresh.generation == stale.generation:
+            return None
+        if (fresh.size, fresh.chunk_size, fresh.offsets) != (stale.size, stale.chunk_size, stale.offsets):
+            raise _FileChanged(name, fresh)
+        return fresh
+
+    def download(self, name, save_path):
+        """Download `name` from the cluster into `save_path`."""
+        try:
+            return self._download(name, self.locate(name), save_path)
+        except _FileChanged as e:
+            # Stale cached locations of a replaced file: start over on the new one
+            return self._download(name, e.locations, save_path)
+
+    def _download(self, name, locations, save_path):
+        file_size = locations.size
+        self.bytes_received = 0
+        self.total_bytes = file_size
+        fd = os.open(save_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, file_size)
+            if file_size and hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(fd, 0, file_size)
+                except OSError:
+                    pass  # Not supported by this filesystem; the sparse file still works
+            # Attempts run on their own pool so chunk workers waiting on hedges never starve them
+            with ThreadPoolExecutor(max_workers=self.max_workers) as chunk_pool, \
+                    ThreadPoolExecutor(max_workers=self.max_workers * 2) as attempt_pool:
+                futures = []
+                for i in range(len(locations.chunks)):
+                    offset, length = chunk_span(locations, i)
+                    write = lambda view, position, offset=offset: os.pwrite(fd, view, offset + position)
+                    futures.append(chunk_pool.submit(self.read_chunk_range, attempt_pool, name, locations, i,
+                                                     0, length, write))
+                done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in not_done:
+                    future.cancel()
+                for future in done:
+                    future.result()  # Re-raise the first failure
+        finally:
+            os.close(fd)
+        return file_size
+
+    def read_chunk_range(self, attempt_pool, name, locations, index, offset, length, write):
+        """Read part of chunk `index` of `name`, retrying once on fresh locations if all replicas fail.
+
+        A cell of an erasure-coded file is first rebuilt from its stripe.
+        """
+        chunk_length = chunk_span(locations, index)[1]
+        try:
+            self._download_chunk(attempt_pool, locations.chunks[index], offset, length, chunk_length, write)
+        except TransferError as e:
+            if locations.ec is not None:
+                log.debug("Rebuilding chunk %d of %s from its stripe: %s", index, name, e)
+                try:
+                    return self._reconstruct(attempt_pool, locations, index, offset, length, write)
+                except TransferError as reconstruct_error:
+                    print(f"[ERROR] {reconstruct_error}")
+            fresh = self.relocate(name, locations)
+            if fresh is None:
+                raise
+            log.debug("Retrying chunk %d of %s with locations of generation %s", index, name, fresh.generation)
+            self._download_chunk(attempt_pool, fresh.chunks[index], offset, length, chunk_length, write)
+
+    def read_range(self, attempt_pool, name, locations, index, offset, length):
+        """Read `length` bytes at `offset` of chunk `index` of `name` into a new bytearray."""
+        buf = bytearray(length)
+        view = memoryview(buf)
+
+        def write(data, position):
+            view[position:position + len(data)] = data
+        self.read_chunk_range(attempt_pool, name, locations, index, offset, length, write)
+        return buf
+
+    def _reconstruct(self, attempt_pool, locations, index, offset, length, write):
+        """Rebuild bytes offset .. offset + length of data cell `index` of an EC file and write them.
+
+        The same range is read from other cells of the stripe, data cells
+        first (cells past the end of the file are known to be zeros), until
+        `data` of them have been read; a failed read moves on to the next cell.
+        """
+        ec, chunk_size, size = locations.ec, locations.chunk_size, locations.size
+        stripe = index // ec.data
+        first = stripe * ec.data
+        stripe_length = min(chunk_size, size - first * chunk_size)  # Length of its parity cells
+        known = {}  # Position in the stripe -> bytes of the range
+        candidates = []  # (position, chunk, cell length)
+        for position in range(ec.data + ec.parity):
+            cell = first + position
+            if position >= ec.data:
+                candidates.append((position, locations.parity[stripe][position - ec.data], stripe_length))
+            elif cell >= len(locations.chunks):
+                known[position] = b""
+            elif cell != index:
+                candidates.append((position, locations.chunks[cell], min(chunk_size, size - cell * chunk_size)))
+        with ThreadPoolExecutor(max_workers=ec.data) as pool:
+            running = {}
+            while len(known) < ec.data:
+                while candidates and len(known) + len(running) < ec.data:
+                    position, chunk, cell_length = candidates.pop(0)
+                    running[pool.submit(self._read_cell, attempt_pool, chunk, cell_length, offset, length)] = position
+                if not running:
+                    raise TransferError(f"Cannot rebuild chunk {index}: fewer than {ec.data} cells of its "
+                                        f"{ec.name} stripe are readable")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    position = running.pop(future)
+                    try:
+                        known[position] = future.result()
+                    except TransferError as e:
+                        print(f"[ERROR] {e}")
+        data = reconstruct(ec, known, [index - first], length)[index - first]
+        write(memoryview(data), 0)
+        self._report(length)
+
+    def _read_cell(self, attempt_pool, chunk, cell_length, offset, length):
+        """Bytes offset .. offset + length of a cell, without the zeros past its end."""
+        length = max(0, min(length, cell_length - offset))
+        buf = bytearray(length)
+        view = memoryview(buf)
+
+        def write(data, position):
+            view[position:position + len(data)] = data
+        if length:
+            self._download_chunk(attempt_pool, chunk, offset, length, cell_length, write, report=False)
+        return buf
+
+    def _read_compressed(self, attempt_pool, chunk, offset, length, chunk_length, write, report):
+        """Read a range of a compressed chunk: fetch the stored frames that cover it and decompress them.
+
+        Checksums are verified on the stored (compressed) bytes, as the
+        DataNode computed them.
+        """
+        meta = chunk["compression"]
+        frame_size, ends = meta["frame_size"], meta["ends"]
+        first, last, start, end = frame_span(meta, offset, length)
+        stored = memoryview(self._read_cell(attempt_pool, dict(chunk, compression=None), ends[-1], start, end - start))
+        written = 0
+        for i in range(first, last + 1):
+            frame = stored[(ends[i - 1] if i else 0) - start:ends[i] - start]
+            try:
+                data = decompress_frame(meta["codec"], frame, min(frame_size, chunk_length - i * frame_size))
+            except CompressionError as e:
+                raise TransferError(f"Cannot decompress chunk {chunk['chunk_id']}: {e}")
+            piece = memoryview(data)[max(0, offset - i * frame_size):offset + length - i * frame_size]
+            write(piece, written)
+            written += len(piece)
+        if report:
+            self._report(length)
+
+    def _download_chunk(self, attempt_pool, chunk, offset, length, chunk_length, write, report=True):
+        """Read bytes offset .. offset + length of a chunk, passing them to write(view, position in range).
+
+        Progress is reported as the bytes arrive if `report` is set.
+        """
+        if chunk.get("compression"):
+            return self._read_compressed(attempt_pool, chunk, offset, length, chunk_length, write, report)
+        if self.short_circuit is not None:
+            local = next((datanode for datanode in chunk["datanodes"] if self.short_circuit.usable(datanode)), None)
+            if local is not None:
+                try:
+                    return self._read_local(local, chunk["chunk_id"], offset, length, chunk_length, write, report)
+                except (OSError, ValueError, TransferError) as e:
+                    print(f"[ERROR] Short-circuit read of chunk {chunk['chunk_id']} failed: {e}")
+                    if isinstance(e, ChecksumError):
+                        self.short_circuit.invalidate(local, chunk["chunk_id"])
+                        self._report_corrupt(chunk["chunk_id"], local)
+                        chunk = dict(chunk, datanodes=[datanode for datanode in chunk["datanodes"]
+                                                       if datanode is not local])
+        for attempt in itertools.count(1):
+            try:
+                return self._read_replicas(attempt_pool, chunk, offset, length, chunk_length, write, report)
+            except DataNodeBusy as e:
+                if attempt > BUSY_RETRIES:
+                    raise TransferError(f"Failed to download chunk {chunk['chunk_id']}: {e}")
+                log.debug("%s; retrying in %.1fs", e, e.retry_after)
+                time.sleep(e.retry_after)
+
+    def _read_replicas(self, attempt_pool, chunk, offset, length, chunk_length, write, report):
+        """Read a range of a chunk over TCP from its best replica, hedging and falling back to the others.
+
+        Raises DataNodeBusy if every replica was refused by a busy DataNode.
+        """
+        replicas = self.selector.rank(chunk["datanodes"], length)
+        read = _ChunkRead()
+        running = {}
+        errors = []
+        try:
+            while replicas or running:
+                if not running:
+                    datanode = replicas.pop(0)
+                    running[attempt_pool.submit(self._fetch, datanode, chunk["chunk_id"], offset, length,
+                                                chunk_length, write, read, report)] = datanode
+                    continue
+                timeout = None
+                if self.hedge and replicas and len(running) == 1:
+                    timeout = max(HEDGE_MIN_DELAY,
+                                  HEDGE_MULTIPLIER * self.selector.expected_duration(next(iter(running.values())), length))
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    # The read is slow: hedge on the next-best replica
+                    datanode = replicas.pop(0)
+                    log.debug("Hedging read of %s to %s", chunk["chunk_id"], datanode_key(datanode))
+                    running[attempt_pool.submit(self._fetch, datanode, chunk["chunk_id"], offset, length,
+                                                chunk_length, write, read, report)] = datanode
+                    continue
+                for future in done:
+                    datanode = running.pop(future)
+                    try:
+                        future.result()
+                        return
+                    except (OSError, ValueError, TransferError) as e:
+                        errors.append(e)
+                        if isinstance(e, DataNodeBusy):
+                            log.debug("Replica %s of chunk %s is busy", datanode_key(datanode), chunk["chunk_id"])
+                            continue
+                        print(f"[ERROR] Failed to download chunk {chunk['chunk_id']} from "
+                              f"{datanode_key(datanode)}: {e}")
+                        if isinstance(e, ChecksumError):
+                            self._report_corrupt(chunk["chunk_id"], datanode)
+        finally:
+            read.cancel()  # Stop any losing hedged read
+        if errors and all(isinstance(e, DataNodeBusy) for e in errors):
+            raise DataNodeBusy(f"Every replica of chunk {chunk['chunk_id']} is busy",
+                               min(e.retry_after for e in errors))
+        raise TransferError(f"Failed to download chunk {chunk['chunk_id']}: {errors[-1] if errors else 'no replicas'}")
+
+    def _read_local(self, datanode, chunk_id, offset, length, chunk_length, write, report):
+        """Read a range of a chunk from a mapping of a replica on this host, passing it to write(view, position).
+
+        With `verify`, whole sub-blocks around the range are checked, so
+        unlike over TCP the bytes of an unaligned start are verified too.
+        """
+        chunk = self.short_circuit.get(datanode, chunk_id)
+        if chunk.size != chunk_length:
+            raise TransferError(f"Local replica has {chunk.size} bytes, expected {chunk_length}")
+        start, end = offset, offset + length
+        verifier = None
+        if self.verify and chunk.checksums is not None and chunk.algorithm in ALGORITHMS:
+            bytes_per_checksum = chunk.bytes_per_checksum
+            start -= start % bytes_per_checksum
+            end = min(chunk.size, -(-end // bytes_per_checksum) * bytes_per_checksum)
+            verifier = StreamingVerifier(chunk.checksums[start // bytes_per_checksum:], chunk.algorithm,
+                                         bytes_per_checksum, start)
+        with memoryview(chunk.data) as data:
+            for position in range(start, end, self.buffer_size):
+                piece = data[position:min(position + self.buffer_size, end)]
+                if verifier:
+                    verifier.update(piece)
+                first, last = max(position, offset), min(position + len(piece), offset + length)
+                if first < last:
+                    write(piece[first - position:last - position], first - offset)
+        if verifier:
+            verifier.finish(at_end=end == chunk.size)
+        if report:
+            self._report(length)
+
+    def _fetch(self, datanode, chunk_id, offset, length, chunk_length, write, read, report=True):
+        """Read a range of one chunk from one replica, passing the data to write(view, position)."""
+        self.selector.begin(datanode)
+        start = time.perf_counter()
+        latency = None
+        reported = 0
+        try:
+            with default_pool.connection(datanode["host"], datanode["port"], DATANODE_TIMEOUT) as s:
+                read.attach(s)
+                request = {"message_type": "get_file", "chunk_id": chunk_id, "checksums": self.verify,
+                           "admission": True}
+                if offset or length != chunk_length:
+                    request.update(offset=offset, length=length)
+                if self.tenant is not None:
+                    request["tenant"] = self.tenant
+                send_message(s, request)
+                admission = recv_message(s)
+                if admission is None:
+                    raise ConnectionError("DataNode closed the connection")
+                if admission.get("status") == "busy":
+                    raise DataNodeBusy(f"DataNode {datanode_key(datanode)} is busy: {admission.get('message')}",
+                                       admission.get("retry_after", RETRY_AFTER))
+                if admission.get("status") != "ok":
+                    raise TransferError(f"DataNode {datanode_key(datanode)} refused the read: {admission}")
+                verifier = None
+                if self.verify:
+                    header = recv_message(s)
+                    if header is None:
+                        raise ConnectionError("DataNode closed the connection")
+                    if header["checksums"] is not None and header["algorithm"] in ALGORITHMS:
+                        verifier = StreamingVerifier(header["checksums"], header["algorithm"],
+                                                     header["bytes_per_checksum"], offset)
+                served = int.from_bytes(recv_exact(s, 8), byteorder='big')
+                latency = time.perf_counter() - start
+                if served != length:
+                    raise TransferError(f"Replica served {served} bytes, expected {length}")
+                buf = bytearray(self.buffer_size)
+                view = memoryview(buf)
+                received = 0
+                while received < length:
+                    if read.cancelled.is_set():
+                        raise _Cancelled()
+                    n = s.recv_into(view, min(self.buffer_size, length - received))
+                    if not n:
+                        raise ConnectionError("DataNode disconnected during chunk download")
+                    if self.throttle is not None:
+                        self.throttle.consume(n, "interactive")
+                    if verifier:
+                        verifier.update(view[:n])
+                    with read.lock:
+                        # Checked under the lock cancel() takes, so a losing read writes nothing once the
+                        # winner has returned
+                        if read.cancelled.is_set():
+                            raise _Cancelled()
+                        write(view[:n], received)
+                    received += n
+                    if report and not read.cancelled.is_set():
+                        self._report(n)
+                        reported += n
+                if verifier:
+                    verifier.finish(at_end=offset + length == chunk_length)
+                read.detach(s)
+        except Exception:
+            if read.cancelled.is_set():
+                # Lost the race to a hedged read; not the replica's fault
+                self._report(-reported)
+                self.selector.end(datanode)
+                raise _Cancelled()
+            self._report(-reported)
+            self.selector.end(datanode, failed=True)
+            raise
+        self.selector.end(datanode, latency=latency, nbytes=length, elapsed=time.perf_counter() - start)
+
+    def _report_corrupt(self, chunk_id, datanode):
+        try:
+            self.request({"action": "report_corrupt_chunk", "chunk_id": chunk_id,
+                          "datanode": {"host": datanode["host"], "port": datanode["port"]}})
+        except Exception as e:
+            print(f"[ERROR] Could not report corrupt chunk {chunk_id}: {e}")
+
+    def _report(self, n):
+        if self.progress is None or not n:
+            return
+        with self.progress_lock:
+            self.bytes_received += n
+            received = self.bytes_received
+        self.progress(received, self.total_bytes)
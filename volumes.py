@@ -0,0 +1,283 @@
+# volumes.py
+"""The storage volumes of a DataNode: several data directories, each on its own disk and storage tier.
+
+A DataNode is given its directories as "[TIER]path" entries (the tier
+defaults to DEFAULT_TIER), e.g. "[SSD]/mnt/nvme/dfs,/mnt/hdd1/dfs,
+/mnt/hdd2/dfs". New chunks go to a volume of the tier the writer asked
+for, if the node has one, chosen round-robin or by available space.
+Each volume has its own pool of I/O threads, so writes to different
+disks proceed in parallel and a slow disk only holds up its own chunks,
+and its own syncer, which fsyncs the chunks written meanwhile in one
+batch, with one fsync of the directory for all their renames.
+"""
+import itertools
+import os
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+TIERS = ("RAM_DISK", "SSD", "HDD", "ARCHIVE")  # Storage tiers, fastest first
+DEFAULT_TIER = "HDD"  # Tier of directories given without one
+VOLUME_POLICIES = ("round-robin", "available-space")
+IO_THREADS = 2  # Writer threads per volume
+WRITE_SIZE = 2 * 1024 * 1024  # Bytes per disk write; writes start at multiples of this
+WRITE_BUFFERS = 3  # Buffers per chunk being written: one filling from the network, the rest being written
+
+
+class VolumeError(ValueError):
+    """A bad volume specification."""
+
+
+def parse_volumes(spec):
+    """Parse "[TIER]path,..." into a list of (tier, path)."""
+    volumes = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        tier = DEFAULT_TIER
+        if entry.startswith("["):
+            tier, _, entry = entry[1:].partition("]")
+            tier = tier.upper()
+            if tier not in TIERS:
+                raise VolumeError(f"Unknown storage tier {tier!r} (expected one of {', '.join(TIERS)})")
+        if not entry:
+            raise VolumeError(f"No directory given for a {tier} volume")
+        volumes.append((tier, entry))
+    if not volumes:
+        raise VolumeError("No storage directories given")
+    return volumes
+
+
+def _pwrite_all(fd, view, offset):
+    while view:
+        n = os.pwrite(fd, view, offset)
+        view = view[n:]
+        offset += n
+
+
+class Volume:
+    """One data directory: its tier, I/O threads and syncer."""
+
+    def __init__(self, path, tier=DEFAULT_TIER, io_threads=IO_THREADS):
+        self.path = path
+        self.tier = tier
+        self.io = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix=f"io-{os.path.basename(path)}")
+        self.reserved = 0  # Bytes of chunks being written here, not yet showing in the free space
+        self.sync_lock = threading.Lock()
+        self.sync_queue = []  # (paths, event, errors) awaiting the next batch
+        self.syncing = False
+
+    def file(self, chunk_id):
+        return os.path.join(self.path, chunk_id)
+
+    def usage(self):
+        return shutil.disk_usage(self.path)
+
+    def sync(self, paths):
+        """fsync `paths` (files in this volume) and the directory holding their names.
+
+        Callers that arrive while a batch is being synced join the next one,
+        which the first of them runs for everybody: one directory fsync (and
+        one round of file fsyncs, back to back) per batch however many
+        chunks completed meanwhile.
+        """
+        event = threading.Event()
+        errors = []
+        with self.sync_lock:
+            self.sync_queue.append((paths, event, errors))
+            leader = not self.syncing
+            if leader:
+                self.syncing = True
+        if not leader:
+            event.wait()
+            if errors:
+                raise errors[0]
+            return
+        while True:
+            with self.sync_lock:
+                batch, self.sync_queue = self.sync_queue, []
+                if not batch:
+                    self.syncing = False
+                    break
+            self._sync_batch(batch)
+        if errors:
+            raise errors[0]
+
+    def _sync_batch(self, batch):
+        for paths, _, errors in batch:
+            for path in paths:
+                try:
+                    fd = os.open(path, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError as e:
+                    errors.append(e)
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            for _, _, errors in batch:
+                errors.append(e)
+        for _, event, _ in batch:
+            event.set()
+
+
+class ChunkWriter:
+    """Writes one chunk file through its volume's I/O threads, WRITE_SIZE bytes at a time.
+
+    The caller fills the buffer from `buffer()` (from the network) and
+    hands it to `write`; the volume writes it at its offset while the caller
+    fills the next one. With WRITE_BUFFERS in flight `buffer()` waits for
+    the oldest write, so a slow disk pushes back on the sender.
+    """
+
+    def __init__(self, volume, path, size):
+        self.volume = volume
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.buffer_size = max(1, min(WRITE_SIZE, size))
+        self.free = []
+        self.allocated = 0
+        self.pending = deque()  # (future, buffer), oldest first
+        self.offset = 0
+
+    def buffer(self):
+        if self.free:
+            return self.free.pop()
+        if self.allocated < WRITE_BUFFERS:
+            self.allocated += 1
+            return bytearray(self.buffer_size)
+        future, buf = self.pending.popleft()
+        future.result()
+        return buf
+
+    def write(self, buf, length):
+        """Write the first `length` bytes of `buf` (from `buffer()`) after those written so far."""
+        self.pending.append((self.volume.io.submit(_pwrite_all, self.fd, memoryview(buf)[:length], self.offset), buf))
+        self.offset += length
+
+    def close(self):
+        """Wait for every write, raising the first error, and close the file."""
+        try:
+            while self.pending:
+                future, buf = self.pending.popleft()
+                future.result()
+                self.free.append(buf)
+        finally:
+            for future, _ in self.pending:
+                future.cancel()
+            for future, _ in self.pending:
+                if not future.cancelled():
+                    future.exception()  # Let running writes finish before the descriptor goes
+            self.pending.clear()
+            os.close(self.fd)
+
+
+class VolumeSet:
+    """The volumes of a DataNode and which of them holds each chunk.
+
+    `policy` is how a new chunk's volume is chosen among those of the
+    wanted tier: "round-robin", or "available-space" (the one with the
+    most free space once chunks being written are counted).
+    """
+
+    def __init__(self, volumes, policy="round-robin", io_threads=IO_THREADS):
+        if policy not in VOLUME_POLICIES:
+            raise VolumeError(f"Unknown volume policy {policy!r} (expected one of {', '.join(VOLUME_POLICIES)})")
+        self.volumes = [Volume(path, tier, io_threads) for tier, path in volumes]
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.chunks = {}  # Chunk ID -> Volume holding it
+        self.turns = {}  # Tuple of candidate volumes -> round-robin cycle over them
+
+    def list(self, is_chunk):
+        """{chunk_id: (volume, size)} of the chunks stored, keeping the first copy of any found twice.
+
+        `is_chunk(name)` tells chunk files from others (sidecars, partial uploads).
+        """
+        chunks = {}
+        for volume in self.volumes:
+            with os.scandir(volume.path) as entries:
+                for entry in entries:
+                    if entry.is_file() and is_chunk(entry.name) and entry.name not in chunks:
+                        chunks[entry.name] = (volume, entry.stat().st_size)
+        return chunks
+
+    def index(self, is_chunk):
+        """Find which volume holds each chunk stored (at startup)."""
+        chunks = self.list(is_chunk)
+        with self.lock:
+            self.chunks = {chunk_id: volume for chunk_id, (volume, _) in chunks.items()}
+
+    def path(self, chunk_id):
+        """The file of a stored chunk (for a chunk not stored here, a path that does not exist)."""
+        volume = self.chunks.get(chunk_id)
+        return (volume or self.volumes[0]).file(chunk_id)
+
+    def added(self, chunk_id, volume):
+        with self.lock:
+            self.chunks[chunk_id] = volume
+
+    def removed(self, chunk_id):
+        with self.lock:
+            self.chunks.pop(chunk_id, None)
+
+    def choose(self, chunk_id, size, tier=None):
+        """The volume to write a chunk to, with `size` bytes reserved on it until `release`.
+
+        A chunk stored already is rewritten where it is; otherwise volumes
+        of `tier` (DEFAULT_TIER if None, so fast media are kept for files
+        pinned to them) are preferred, then any.
+        """
+        with self.lock:
+            volume = self.chunks.get(chunk_id)
+            if volume is None:
+                candidates = [v for v in self.volumes if v.tier == (tier or DEFAULT_TIER)] or self.volumes
+                volume = self._choose(candidates, size)
+            volume.reserved += size
+        return volume
+
+    def release(self, volume, size):
+        with self.lock:
+            volume.reserved -= size
+
+    def _choose(self, candidates, size):
+        free = {volume: volume.usage().free - volume.reserved for volume in candidates}
+        if self.policy == "available-space":
+            return max(candidates, key=free.get)
+        turns = self.turns.get(tuple(candidates))
+        if turns is None:
+            turns = self.turns[tuple(candidates)] = itertools.cycle(candidates)
+        for _ in candidates:
+            volume = next(turns)
+            if free[volume] >= size:
+                return volume
+        return max(candidates, key=free.get)  # Nothing has room: let the write fail on the emptiest
+
+    def usage(self):
+        """(capacity, free, {tier: {"capacity_bytes", "free_bytes"}}) over distinct filesystems.
+
+        A disk holding directories of several tiers counts once in the totals
+        and once in each of those tiers, which all draw on its space.
+        """
+        devices = set()
+        seen = set()  # (device, tier)
+        tiers = {}
+        capacity = free = 0
+        for volume in self.volumes:
+            device = os.stat(volume.path).st_dev
+            if (device, volume.tier) in seen:
+                continue  # Two directories of a tier on one disk: count its space once
+            seen.add((device, volume.tier))
+            usage = volume.usage()
+            if device not in devices:
+                devices.add(device)
+                capacity += usage.total
+                free += usage.free
+            tier = tiers.setdefault(volume.tier, {"capacity_bytes": 0, "free_bytes": 0})
+            tier["capacity_bytes"] += usage.total
+            tier["free_bytes"] += usage.free
+        return capacity, free, tiers